@@ -0,0 +1,466 @@
+import hashlib
+import os
+from pathlib import Path
+
+import numpy as np
+
+from src.similarity_search import TopKSimilarities, normalize, select_top_k
+
+# rows scored at once when assigning vectors to their closest list
+ASSIGNMENT_BLOCK_ROWS = 4096
+
+
+class IVFIndex:
+    def __init__(self, dimensions: int, num_lists: int = 0, num_probes: int = 8):
+        """
+        An approximate nearest neighbour index using an inverted file (IVF) layout, implemented
+        with NumPy.
+
+        The normalized embeddings are clustered with spherical k-means into `num_lists` lists.
+        A search only scores the members of the `num_probes` lists whose centroids are closest to
+        the query, so the cost per query grows with roughly the square root of the number of
+        notes rather than linearly. Notes can be added and removed without retraining, and the
+        index retrains itself once it has grown to twice the size it was trained on.
+
+        Only the ids, lists and centroids are saved, with a fingerprint of each embedding. The
+        vectors themselves are already kept by the embedding cache, so a loaded index takes them
+        from the embeddings passed to its first `update`.
+
+        Attributes:
+            dimensions (int): Size of each embedding vector.
+            num_lists (int): Requested number of lists, or 0 to pick roughly sqrt(N) when training.
+            num_probes (int): Number of lists searched per query.
+            ids (list[str]): The id, usually the file path, of each indexed vector.
+            vectors (np.ndarray): (N, dimensions) float32 normalized vectors in `ids` order,
+                empty in a loaded index until `update` is called.
+            fingerprints (np.ndarray): (N,) uint64 hash of each embedding as it was given, used
+                to tell which embeddings changed since they were indexed.
+            assignments (np.ndarray): (N,) int32 list each vector belongs to.
+            centroids (np.ndarray): (num lists, dimensions) float32 normalized list centroids.
+            trained_size (int): Number of vectors the centroids were trained on.
+
+        Args:
+            dimensions: Size of each embedding vector.
+            num_lists: Number of lists to cluster the vectors into, 0 picks it automatically.
+            num_probes: Number of lists searched per query.
+        """
+        self.dimensions = dimensions
+        self.num_lists = num_lists
+        self.num_probes = num_probes
+
+        self.ids = []
+        self.vectors = np.empty((0, dimensions), dtype=np.float32)
+        self.fingerprints = np.empty(0, dtype=np.uint64)
+        self.assignments = np.empty(0, dtype=np.int32)
+        self.centroids = np.empty((0, dimensions), dtype=np.float32)
+        self.trained_size = 0
+
+        # positions of the vectors belonging to each list, rebuilt after any change
+        self._list_members = None
+
+    def build(self, ids: list[str], embeddings):
+        """
+        Replaces the contents of the index and trains its centroids on the given embeddings.
+
+        Args:
+            ids (list[str]): The id of each embedding.
+            embeddings (array-like): A 2D array with one embedding per id.
+
+        Returns:
+            None
+        """
+        embeddings = np.asarray(embeddings, dtype=np.float32).reshape(
+            -1, self.dimensions
+        )
+        self.ids = list(ids)
+        self.vectors = normalize(embeddings)
+        self.fingerprints = fingerprint(embeddings)
+        self.train()
+
+    def train(self, iterations: int = 10, seed: int = 0):
+        """
+        Clusters the indexed vectors with spherical k-means and assigns every vector to its
+        closest centroid. Training runs on a sample of at most 256 vectors per list.
+
+        Args:
+            iterations (int): Number of k-means iterations.
+            seed (int): Seed for the random sampling, making training reproducible.
+
+        Returns:
+            None
+        """
+        num_vectors = len(self.vectors)
+        if num_vectors == 0:
+            self.centroids = np.empty((0, self.dimensions), dtype=np.float32)
+            self.assignments = np.empty(0, dtype=np.int32)
+            self.trained_size = 0
+            self._list_members = None
+            return
+
+        num_lists = self.num_lists or int(np.sqrt(num_vectors))
+        num_lists = max(1, min(num_lists, num_vectors))
+
+        rng = np.random.default_rng(seed)
+        sample_size = min(num_vectors, num_lists * 256)
+        sample = self.vectors[rng.choice(num_vectors, sample_size, replace=False)]
+        centroids = sample[rng.choice(sample_size, num_lists, replace=False)]
+
+        for _ in range(iterations):
+            sample_assignments = np.argmax(sample @ centroids.T, axis=1)
+            sums = np.zeros_like(centroids)
+            np.add.at(sums, sample_assignments, sample)
+            counts = np.bincount(sample_assignments, minlength=num_lists)
+
+            # lists that ended up empty are restarted from a random sample vector
+            empty = counts == 0
+            sums[empty] = sample[rng.choice(sample_size, int(empty.sum()))]
+            centroids = normalize(sums)
+
+        self.centroids = centroids
+        self.assignments = self.assign(self.vectors)
+        self.trained_size = num_vectors
+        self._list_members = None
+
+    def assign(self, vectors: np.ndarray) -> np.ndarray:
+        """
+        Finds the closest centroid for each vector.
+
+        Args:
+            vectors (np.ndarray): Normalized vectors to assign.
+
+        Returns:
+            np.ndarray: The int32 list index of each vector.
+        """
+        assignments = np.empty(len(vectors), dtype=np.int32)
+        for start in range(0, len(vectors), ASSIGNMENT_BLOCK_ROWS):
+            block = vectors[start : start + ASSIGNMENT_BLOCK_ROWS]
+            assignments[start : start + len(block)] = np.argmax(
+                block @ self.centroids.T, axis=1
+            )
+
+        return assignments
+
+    def add(self, ids: list[str], embeddings):
+        """
+        Adds vectors to the index, assigning them to the existing lists. The index is retrained
+        when it has no centroids yet or has grown to twice the size it was trained on.
+
+        Args:
+            ids (list[str]): The id of each new embedding. Ids must not already be indexed.
+            embeddings (array-like): A 2D array with one embedding per id.
+
+        Returns:
+            None
+        """
+        if len(ids) == 0:
+            return
+
+        embeddings = np.asarray(embeddings, dtype=np.float32).reshape(
+            -1, self.dimensions
+        )
+        vectors = normalize(embeddings)
+        self.ids.extend(ids)
+        self.vectors = np.concatenate([self.vectors, vectors])
+        self.fingerprints = np.concatenate([self.fingerprints, fingerprint(embeddings)])
+
+        if len(self.centroids) == 0 or len(self.vectors) > 2 * self.trained_size:
+            self.train()
+        else:
+            self.assignments = np.concatenate([self.assignments, self.assign(vectors)])
+            self._list_members = None
+
+    def remove(self, ids: list[str]):
+        """
+        Removes vectors from the index. Ids that are not indexed are ignored.
+
+        Args:
+            ids (list[str]): The ids to remove.
+
+        Returns:
+            None
+        """
+        removed = set(ids)
+        keep = np.array([item not in removed for item in self.ids], dtype=bool)
+
+        self.ids = [item for item in self.ids if item not in removed]
+        self.vectors = self.vectors[keep]
+        self.fingerprints = self.fingerprints[keep]
+        self.assignments = self.assignments[keep]
+        self._list_members = None
+
+    def update(self, ids: list[str], embeddings):
+        """
+        Brings the index in line with the given notes by removing ids that are gone or whose
+        embedding changed, and adding ids that are new or changed. A loaded index takes the
+        vectors of its unchanged ids from `embeddings`.
+
+        Args:
+            ids (list[str]): The id of every note that should be indexed.
+            embeddings (array-like): A 2D array with the current embedding of each id.
+
+        Returns:
+            tuple[int, int]: The number of vectors removed and added.
+        """
+        embeddings = np.asarray(embeddings, dtype=np.float32).reshape(
+            -1, self.dimensions
+        )
+        vectors = normalize(embeddings)
+        fingerprints = fingerprint(embeddings)
+        positions = {item: position for position, item in enumerate(self.ids)}
+        indexed = np.array([positions.get(item, -1) for item in ids], dtype=np.int64)
+
+        # compare the fingerprint of every known id with that of its current embedding at once
+        known = np.nonzero(indexed >= 0)[0]
+        changed = known[self.fingerprints[indexed[known]] != fingerprints[known]]
+        if len(self.vectors) != len(self.ids):
+            # a loaded index, whose ids that are gone or changed are removed below
+            self.vectors = np.zeros((len(self.ids), self.dimensions), dtype=np.float32)
+            self.vectors[indexed[known]] = vectors[known]
+        new_positions = np.concatenate([np.nonzero(indexed < 0)[0], changed])
+
+        stale = set(self.ids) - set(ids)
+        stale.update(ids[position] for position in changed)
+
+        self.remove(list(stale))
+        self.add(
+            [ids[position] for position in new_positions], embeddings[new_positions]
+        )
+
+        return len(stale), len(new_positions)
+
+    def get_list_members(self) -> list[np.ndarray]:
+        """
+        Returns the positions of the vectors belonging to each list.
+        """
+        if self._list_members is None:
+            order = np.argsort(self.assignments, kind="stable")
+            boundaries = np.searchsorted(
+                self.assignments[order], np.arange(len(self.centroids) + 1)
+            )
+            self._list_members = [
+                order[boundaries[i] : boundaries[i + 1]]
+                for i in range(len(self.centroids))
+            ]
+
+        return self._list_members
+
+    def search(self, queries, k: int, exclude=None) -> TopKSimilarities:
+        """
+        Finds the approximate k most similar indexed vectors for each query.
+
+        Queries are grouped by the lists they probe, so each list is scored against all of its
+        queries in one matrix product and merged into the running top k.
+
+        Args:
+            queries (array-like): A 2D array with one embedding per query.
+            k (int): The number of results per query. It is capped at the number of vectors - 1.
+            exclude (array-like, optional): For each query, the index position to leave out of
+                its results (such as the query's own note), or -1 to exclude nothing.
+
+        Returns:
+            TopKSimilarities: The index positions and cosine similarity scores of the results,
+                ordered from most to least similar.
+        """
+        queries = normalize(queries).reshape(-1, self.dimensions)
+        num_queries = len(queries)
+        k = max(0, min(k, len(self.vectors) - 1))
+
+        best_indexes = np.full((num_queries, k), -1, dtype=np.int32)
+        best_scores = np.full((num_queries, k), -np.inf, dtype=np.float32)
+        if k == 0 or num_queries == 0:
+            return TopKSimilarities(best_indexes, best_scores)
+
+        if exclude is None:
+            exclude = np.full(num_queries, -1)
+        exclude = np.asarray(exclude)
+
+        num_probes = min(self.num_probes, len(self.centroids))
+        centroid_scores = queries @ self.centroids.T
+        probes = np.argpartition(-centroid_scores, num_probes - 1, axis=1)[
+            :, :num_probes
+        ]
+
+        # group the queries by the lists they probe
+        probed_lists = probes.ravel()
+        probing_queries = np.repeat(np.arange(num_queries), num_probes)
+        order = np.argsort(probed_lists, kind="stable")
+        boundaries = np.searchsorted(
+            probed_lists[order], np.arange(len(self.centroids) + 1)
+        )
+
+        for list_id, members in enumerate(self.get_list_members()):
+            query_rows = probing_queries[
+                order[boundaries[list_id] : boundaries[list_id + 1]]
+            ]
+            if len(query_rows) == 0 or len(members) == 0:
+                continue
+
+            scores = queries[query_rows] @ self.vectors[members].T
+            scores[exclude[query_rows, None] == members[None, :]] = -np.inf
+
+            # merge the list's candidates with the best results found so far
+            merged_scores = np.concatenate([best_scores[query_rows], scores], axis=1)
+            merged_indexes = np.concatenate(
+                [
+                    best_indexes[query_rows],
+                    np.broadcast_to(members, scores.shape).astype(np.int32),
+                ],
+                axis=1,
+            )
+            top = np.argpartition(-merged_scores, k - 1, axis=1)[:, :k]
+            best_scores[query_rows] = np.take_along_axis(merged_scores, top, axis=1)
+            best_indexes[query_rows] = np.take_along_axis(merged_indexes, top, axis=1)
+
+        order = np.argsort(-best_scores, axis=1, kind="stable")
+        best_indexes = np.take_along_axis(best_indexes, order, axis=1)
+        best_scores = np.take_along_axis(best_scores, order, axis=1)
+
+        # queries whose probed lists held fewer than k candidates fall back to an exact scan
+        incomplete = np.nonzero(np.isneginf(best_scores).any(axis=1))[0]
+        if len(incomplete):
+            best_indexes[incomplete], best_scores[incomplete] = select_top_k(
+                queries[incomplete] @ self.vectors.T,
+                k,
+                self_columns=exclude[incomplete],
+            )
+
+        return TopKSimilarities(best_indexes, best_scores)
+
+    def measure_recall(self, k: int, sample_size: int = 100, seed: int = 0) -> float:
+        """
+        Estimates the recall of the index against an exact search, using a random sample of the
+        indexed vectors as queries.
+
+        Args:
+            k (int): The number of results per query to compare.
+            sample_size (int): The number of queries to sample.
+            seed (int): Seed for the random sample.
+
+        Returns:
+            float: The average fraction of the exact top k results that the index also returned.
+        """
+        num_vectors = len(self.vectors)
+        if num_vectors < 2 or sample_size <= 0:
+            return 1.0
+
+        rng = np.random.default_rng(seed)
+        sample = rng.choice(num_vectors, min(sample_size, num_vectors), replace=False)
+
+        approximate = self.search(self.vectors[sample], k, exclude=sample)
+        exact = select_top_k(
+            self.vectors[sample] @ self.vectors.T, k, self_columns=sample
+        )
+
+        return recall_at_k(approximate, exact)
+
+    def save(self, path, embedding_tag: str = ""):
+        """
+        Saves the index to a `.npz` file, replacing any previous file atomically. The vectors are
+        left out, `update` supplies them after loading.
+
+        Args:
+            path (str | Path): Where to save the index.
+            embedding_tag (str): Names the model and settings the vectors were produced with, so
+                `load` can discard an index built from other embeddings.
+
+        Returns:
+            None
+        """
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+
+        temp_path = path.with_suffix(".tmp.npz")
+        np.savez(
+            temp_path,
+            ids=np.array(self.ids, dtype=str),
+            fingerprints=self.fingerprints,
+            assignments=self.assignments,
+            centroids=self.centroids,
+            settings=np.array([self.num_lists, self.num_probes, self.trained_size]),
+            embedding_tag=np.array(embedding_tag),
+        )
+        os.replace(temp_path, path)
+
+    @classmethod
+    def load(cls, path, dimensions: int, embedding_tag: str = ""):
+        """
+        Loads an index saved with `save`. It holds no vectors, so `update` has to be called with
+        the current embeddings before searching it.
+
+        Args:
+            path (str | Path): The saved index file.
+            dimensions (int): The embedding size the index is expected to have.
+            embedding_tag (str): The tag of the embeddings the index is expected to hold.
+
+        Returns:
+            IVFIndex | None: The index, or None if the file is missing, unreadable, or was built
+                from vectors of a different size or from different embeddings.
+        """
+        try:
+            with np.load(path) as data:
+                # the centroids and lists are only meaningful in the space they were trained in
+                if str(data["embedding_tag"]) != embedding_tag:
+                    return None
+                num_lists, num_probes, trained_size = data["settings"].tolist()
+                index = cls(dimensions, num_lists, num_probes)
+                index.ids = data["ids"].tolist()
+                index.fingerprints = data["fingerprints"]
+                index.assignments = data["assignments"]
+                index.centroids = data["centroids"]
+                index.trained_size = trained_size
+        except (OSError, ValueError, KeyError):
+            return None
+
+        if index.centroids.ndim != 2 or index.centroids.shape[1] != dimensions:
+            return None
+        if len(index.fingerprints) != len(index.ids):
+            return None
+
+        return index
+
+
+def fingerprint(embeddings: np.ndarray) -> np.ndarray:
+    """
+    Hashes each embedding, so a changed embedding can be spotted without keeping the old one.
+
+    Args:
+        embeddings (np.ndarray): A 2D float32 array with one embedding per row.
+
+    Returns:
+        np.ndarray: The uint64 hash of each row.
+    """
+    rows = np.ascontiguousarray(embeddings, dtype=np.float32)
+
+    return np.array(
+        [
+            int.from_bytes(
+                hashlib.blake2b(row.tobytes(), digest_size=8).digest(), "little"
+            )
+            for row in rows
+        ],
+        dtype=np.uint64,
+    )
+
+
+def recall_at_k(approximate: TopKSimilarities, exact: TopKSimilarities) -> float:
+    """
+    Measures how many of the exact nearest neighbours an approximate search found.
+
+    Args:
+        approximate (TopKSimilarities): The approximate results.
+        exact (TopKSimilarities): The exact results for the same queries.
+
+    Returns:
+        float: The average fraction of each row of `exact` that also appears in `approximate`.
+    """
+    if exact.indexes.size == 0:
+        return 1.0
+
+    found = [
+        len(set(approximate_row) & set(exact_row)) / len(exact_row)
+        for approximate_row, exact_row in zip(
+            approximate.indexes.tolist(), exact.indexes.tolist()
+        )
+    ]
+
+    return float(np.mean(found))
@@ -0,0 +1,563 @@
+import asyncio
+import json
+import os
+from time import perf_counter
+from typing import TYPE_CHECKING, Type
+
+from src.constants import ASSISTANT_CONCURRENCY, NOTE_EXTENSION, OLLAMA_HOST
+from src.smart_assistant import SmartAssistant
+
+if TYPE_CHECKING:
+    from pydantic import BaseModel
+
+
+class AsyncSmartAssistant(SmartAssistant):
+    """
+    An asyncio version of the smart assistant, whose requests are made with the async clients of
+    the AI providers so several can be waited on at once.
+
+    The prompts, the response cache and the note handling are shared with `SmartAssistant`, only
+    the waiting changes. Reading notes runs in worker threads while requests are in flight, the
+    neighbours of a note are parsed concurrently, and `create_many` creates a batch of notes with
+    up to `max_concurrency` requests sent at a time. The embedding model isn't safe to call from
+    several threads, so it is used by one task at a time.
+
+    Attributes:
+        client (AsyncOpenAI | ollama.AsyncClient): The async client for the AI provider, created
+            on first use.
+        max_concurrency (int): The most notes `create_many` creates at once.
+    """
+
+    def __init__(self, notes_directory, max_concurrency: int = ASSISTANT_CONCURRENCY):
+        super().__init__(notes_directory)
+        self.max_concurrency = max_concurrency
+        # held while the embedding model runs in a worker thread
+        self._model_lock = asyncio.Lock()
+
+    @property
+    def client(self):
+        """
+        Returns the async client for the AI provider, importing the provider's library and
+        creating the client on first use.
+
+        Returns:
+            AsyncOpenAI | ollama.AsyncClient: The client used to make requests.
+        """
+        if self._client is None:
+            if self.ai_provider == "ollama":
+                import ollama
+
+                self._client = ollama.AsyncClient(host=OLLAMA_HOST)
+            else:
+                from openai import AsyncOpenAI
+
+                self._client = AsyncOpenAI(api_key=os.getenv("OPENAI_KEY"))
+
+        return self._client
+
+    @client.setter
+    def client(self, client):
+        self._client = client
+
+    async def run_model(self, function, *args):
+        """
+        Runs a function using the embedding model in a worker thread, one at a time.
+
+        Args:
+            function (Callable): The function to run.
+            *args: The arguments passed to it.
+
+        Returns:
+            The function's result.
+        """
+        async with self._model_lock:
+            return await asyncio.to_thread(function, *args)
+
+    async def make_openai_request(
+        self,
+        system: str,
+        user: str,
+        temp: float,
+        structure: Type["BaseModel"] = None,
+        stream: bool = False,
+    ):
+        """
+        Makes a chat completion request to OpenAI's API, as `SmartAssistant.make_openai_request`
+        does, without blocking the event loop.
+
+        Args:
+            system: The system prompt.
+            user: The user prompt.
+            temp: The sampling temperature.
+            structure: The pydantic model the response should be parsed into.
+            stream: Whether to return the response's text piece by piece as it is generated.
+                Structured responses can't be streamed.
+
+        Returns:
+            The response's text, the parsed `structure`, or with `stream`, an async iterator over
+            the pieces of the response's text.
+
+        Raises:
+            ValueError: If both `structure` and `stream` are given.
+        """
+        messages = [
+            {"role": "system", "content": system},
+            {"role": "user", "content": user},
+        ]
+
+        if stream:
+            if structure is not None:
+                raise ValueError("Structured responses can't be streamed")
+
+            chunks = await self.client.chat.completions.create(
+                model=self.model, temperature=temp, messages=messages, stream=True
+            )
+            return (
+                chunk.choices[0].delta.content
+                async for chunk in chunks
+                if chunk.choices and chunk.choices[0].delta.content
+            )
+
+        if structure is None:
+            completion = await self.client.beta.chat.completions.parse(
+                model=self.model, temperature=temp, messages=messages
+            )
+            return completion.choices[0].message.content
+
+        completion = await self.client.beta.chat.completions.parse(
+            model=self.model,
+            temperature=temp,
+            messages=messages,
+            response_format=structure,
+        )
+        return completion.choices[0].message.parsed
+
+    async def make_ollama_request(
+        self,
+        system: str,
+        user: str,
+        temp: float,
+        structure: Type["BaseModel"] = None,
+        stream: bool = False,
+    ):
+        """
+        Makes a chat request to the Ollama server, as `SmartAssistant.make_ollama_request` does,
+        without blocking the event loop.
+
+        Args:
+            system: The system prompt.
+            user: The user prompt.
+            temp: The sampling temperature.
+            structure: The pydantic model the response should be parsed into.
+            stream: Whether to return the response's text piece by piece as it is generated.
+                Structured responses can't be streamed.
+
+        Returns:
+            The response's text, the parsed `structure`, or with `stream`, an async iterator over
+            the pieces of the response's text.
+
+        Raises:
+            ValueError: If both `structure` and `stream` are given.
+        """
+        messages = [
+            {"role": "system", "content": system},
+            {"role": "user", "content": user},
+        ]
+        options = {"temperature": temp}
+
+        if stream:
+            if structure is not None:
+                raise ValueError("Structured responses can't be streamed")
+
+            parts = await self.client.chat(
+                model=self.model, messages=messages, options=options, stream=True
+            )
+            return (
+                part["message"]["content"]
+                async for part in parts
+                if part["message"]["content"]
+            )
+
+        if structure:
+            response = await self.client.chat(
+                model=self.model, messages=messages, format="json", options=options
+            )
+            return structure.model_validate(json.loads(response["message"]["content"]))
+
+        response = await self.client.chat(
+            model=self.model, messages=messages, options=options
+        )
+        return response["message"]["content"]
+
+    async def make_ai_request(
+        self,
+        system: str,
+        user: str,
+        temp: float,
+        structure: Type["BaseModel"] = None,
+        stream: bool = False,
+        use_cache: bool = None,
+    ):
+        """
+        Makes a request to the configured AI provider, answering it from the response cache when
+        the same request was made before, as `SmartAssistant.make_ai_request` does. The cache is
+        read and written on a worker thread, so its disk access doesn't hold up other requests.
+
+        Args:
+            system: The system prompt.
+            user: The user prompt.
+            temp: The sampling temperature.
+            structure: The pydantic model the response should be parsed into.
+            stream: Whether to return the response's text piece by piece as it is generated. A
+                cached response is returned as a single piece.
+            use_cache: True to use the response cache whatever the temperature, False to skip
+                it. By default, only requests with a temperature up to `max_cache_temperature`
+                use it.
+
+        Returns:
+            The response's text, the parsed `structure`, or with `stream`, an async iterator over
+            the pieces of the response's text.
+        """
+        cache = self.response_cache
+        if cache is None:
+            return await self.send_ai_request(system, user, temp, structure, stream)
+        if use_cache is None:
+            use_cache = temp <= self.max_cache_temperature
+        if not use_cache:
+            cache.bypassed += 1
+            return await self.send_ai_request(system, user, temp, structure, stream)
+
+        key = cache.make_key(
+            self.ai_provider,
+            self.model,
+            temp,
+            None if structure is None else structure.model_json_schema(),
+            system,
+            user,
+        )
+        cached = await asyncio.to_thread(cache.get, key)
+        if cached is not None:
+            if structure is not None:
+                return structure.model_validate_json(cached)
+            return self.cache_stream(None, [cached]) if stream else cached
+
+        response = await self.send_ai_request(system, user, temp, structure, stream)
+        if stream:
+            return self.cache_stream(key, response)
+
+        await asyncio.to_thread(
+            cache.put,
+            key,
+            response if structure is None else response.model_dump_json(),
+        )
+
+        return response
+
+    async def cache_stream(self, key: str, pieces):
+        """
+        Passes on the pieces of a streamed response, storing the whole response in the response
+        cache once the stream has ended. A stream that isn't read to the end isn't stored.
+
+        Args:
+            key (str | None): The request's cache key, or None to store nothing.
+            pieces (AsyncIterator[str] | Iterable[str]): The streamed response.
+
+        Yields:
+            str: Each piece of the response.
+        """
+        if not hasattr(pieces, "__aiter__"):
+            for piece in pieces:
+                yield piece
+            return
+
+        received = []
+        async for piece in pieces:
+            received.append(piece)
+            yield piece
+
+        if key is not None:
+            await asyncio.to_thread(self.response_cache.put, key, "".join(received))
+
+    async def print_response(self, system: str, user: str, temp: float) -> str:
+        """
+        Requests a plain text response and prints it, printing each piece as soon as it arrives
+        with `stream`, as `SmartAssistant.print_response` does.
+
+        Args:
+            system: The system prompt.
+            user: The user prompt.
+            temp: The sampling temperature.
+
+        Returns:
+            str: The full response.
+        """
+        if not self.stream:
+            response = await self.make_ai_request(system, user, temp)
+            print(response)
+            return response
+
+        start_time = perf_counter()
+        self.time_to_first_token = None
+        pieces = []
+        async for piece in await self.make_ai_request(system, user, temp, stream=True):
+            if self.time_to_first_token is None:
+                self.time_to_first_token = perf_counter() - start_time
+            print(piece, end="", flush=True)
+            pieces.append(piece)
+        print()
+
+        return "".join(pieces)
+
+    async def ask_for_note(self, prompt: str, note_names: list[str]) -> str:
+        """
+        Asks the AI model which of the given notes is the most relevant to a prompt.
+
+        Args:
+            prompt (str): The user's input or query.
+            note_names (list[str]): The names, without extension, of the notes to pick from.
+
+        Returns:
+            str: The name of the note the model picked.
+        """
+        system_prompt, user_prompt, structure = self.get_note_request(
+            prompt, note_names
+        )
+        suggestion = await self.make_ai_request(
+            system_prompt, user_prompt, 0.1, structure
+        )
+
+        return suggestion.file_name.removesuffix(NOTE_EXTENSION)
+
+    async def recommend_note(self, prompt: str) -> str:
+        """
+        Suggests the most relevant file for a prompt, as `SmartAssistant.recommend_note` does,
+        embedding the prompt in a worker thread.
+
+        Args:
+            prompt (str): The user's input or query.
+
+        Returns:
+            str: The file name of the suggested note.
+        """
+        print("Looking for relevant file...")
+
+        candidates = await self.run_model(
+            self.find_relevant_notes, prompt, self.num_candidates if self.rerank else 1
+        )
+        if not candidates:
+            print(
+                "No note embeddings found, run the lightning links creator to speed this up"
+            )
+            return self.find_note_file(
+                await self.ask_for_note(prompt, self.file_handler.note_names)
+            )
+
+        if not self.rerank or len(candidates) == 1:
+            return candidates[0][0]
+
+        note_names = [
+            os.path.basename(file_name).removesuffix(NOTE_EXTENSION)
+            for file_name, _ in candidates
+        ]
+
+        return self.find_note_file(
+            await self.ask_for_note(prompt, note_names), candidates
+        )
+
+    async def get_similar_notes_contents(
+        self, note_name: str, prompt: str = None
+    ) -> str:
+        """
+        Retrieves and formats the contents of a note and its similar notes, as
+        `SmartAssistant.get_similar_notes_contents` does, parsing the notes concurrently in
+        worker threads.
+
+        Args:
+            note_name (str): The note's file name, with or without the vault path.
+            prompt (str, optional): The prompt the notes are given as context for.
+
+        Returns:
+            str: The formatted notes.
+        """
+        similar_notes = self.get_similar_note_names(note_name)
+        parsed = await asyncio.gather(
+            *(
+                asyncio.to_thread(self.file_handler.parse_note, note)
+                for note in similar_notes
+            )
+        )
+
+        # ranking passages against the prompt embeds them
+        return await self.run_model(
+            self.build_context, list(zip(similar_notes, parsed)), prompt
+        )
+
+    async def create(self, prompt: str) -> str:
+        """
+        Creates a new note on a topic, as `SmartAssistant.create` does.
+
+        Args:
+            prompt (str): The topic the new note should cover.
+
+        Returns:
+            str: The new note's file name.
+        """
+        print(f"Creating new note: {prompt}")
+
+        file_name = await self.recommend_note(prompt)
+        similar_notes_parsed = await self.get_similar_notes_contents(file_name, prompt)
+
+        system_prompt, user_prompt, structure = self.get_create_request(
+            prompt, similar_notes_parsed
+        )
+        # skip the response cache so the same topic, even within one batch, gives a new note
+        request = await self.make_ai_request(
+            system_prompt, user_prompt, 0.5, structure, use_cache=False
+        )
+
+        return await asyncio.to_thread(self.save_new_note, request)
+
+    async def create_many(
+        self, prompts: list[str], max_concurrency: int = None
+    ) -> list:
+        """
+        Creates a note for each prompt, working on up to `max_concurrency` notes at once so their
+        requests overlap. A prompt whose note can't be created doesn't stop the others.
+
+        Args:
+            prompts (list[str]): The topics of the new notes.
+            max_concurrency (int, optional): The most notes created at once. Defaults to
+                `max_concurrency`.
+
+        Returns:
+            list[str | Exception]: For each prompt, in order, the new note's file name or the
+                error that stopped it from being created.
+        """
+        semaphore = asyncio.Semaphore(max_concurrency or self.max_concurrency)
+
+        async def create_one(prompt):
+            async with semaphore:
+                return await self.create(prompt)
+
+        results = await asyncio.gather(
+            *(create_one(prompt) for prompt in prompts), return_exceptions=True
+        )
+        for prompt, result in zip(prompts, results):
+            if isinstance(result, Exception):
+                print(f"Couldn't create a note for {prompt!r}: {result}")
+
+        return results
+
+    async def suggest_topics(self, num_suggestions: int = 1) -> list:
+        """
+        Asks the AI model for topics missing from the vault that relate to the current note,
+        sending the requests for every suggestion at once. The current note is read while the
+        AI provider's client is being created.
+
+        Args:
+            num_suggestions (int): The number of suggestions to ask for. The requests skip the
+                response cache, as `SmartAssistant.suggest` does, so the suggestions differ.
+
+        Returns:
+            list[Suggestion]: The suggested topics along with the reasoning for each.
+        """
+        current_note, _ = await asyncio.gather(
+            asyncio.to_thread(self.file_handler.get_current_note),
+            # importing the provider's library is slow enough to be worth overlapping
+            asyncio.to_thread(lambda: self.client),
+        )
+        similar_notes_parsed = await self.get_similar_notes_contents(current_note)
+
+        system_prompt, user_prompt, structure = self.get_suggest_request(
+            similar_notes_parsed
+        )
+
+        return list(
+            await asyncio.gather(
+                *(
+                    self.make_ai_request(
+                        system_prompt, user_prompt, 0.5, structure, use_cache=False
+                    )
+                    for _ in range(num_suggestions)
+                )
+            )
+        )
+
+    async def suggest(self, num_suggestions: int = 1):
+        """
+        Suggests new note topics based on the current note and its similar notes, and offers to
+        create a note for each, creating the accepted ones concurrently.
+
+        Args:
+            num_suggestions (int): The number of topics to suggest.
+        """
+        prompts = []
+        for response in await self.suggest_topics(num_suggestions):
+            print(
+                f"Looking at your notes it seems best to create a note about {response.suggestion}"
+            )
+            print("Here's why I think you should: \n" + response.reasoning + "\n")
+
+            while True:
+                print("Would you like to create this note? (y/n)")
+                user_input = (await asyncio.to_thread(input)).lower()
+                if user_input == "y" or user_input == "n":
+                    break
+                print("Please enter y or n")
+
+            if user_input == "y":
+                prompts.append(f"create a note about {response.suggestion}")
+
+        if prompts:
+            await self.create_many(prompts)
+
+    async def ask_yourself(self, prompt: str) -> str:
+        """
+        Answers a question from the notes most relevant to it, as `SmartAssistant.ask_yourself`
+        does.
+
+        Args:
+            prompt (str): The user's question.
+
+        Returns:
+            str: The answer.
+        """
+        recommended_note = await self.recommend_note(prompt)
+        extracted_references = await self.get_similar_notes_contents(
+            recommended_note, prompt
+        )
+
+        return await self.print_response(
+            *self.get_ask_request(prompt, extracted_references), 0.4
+        )
+
+    async def summarize(self, prompt: str) -> str:
+        """
+        Summarizes a topic from the notes most relevant to it, as `SmartAssistant.summarize`
+        does.
+
+        Args:
+            prompt (str): The topic to summarize.
+
+        Returns:
+            str: The summary.
+        """
+        recommended_note = await self.recommend_note(prompt)
+        sources = await self.get_similar_notes_contents(recommended_note, prompt)
+
+        return await self.print_response(
+            *self.get_summarize_request(prompt, sources), 0.7
+        )
+
+
+if __name__ == "__main__":
+    # creates a note for every topic given after the vault directory, several at a time
+    arguments = os.sys.argv
+    if len(arguments) < 3:
+        print("Usage: python -m src.async_smart_assistant <notes directory> <topic>...")
+        os.sys.exit(1)
+
+    assistant = AsyncSmartAssistant(arguments[1])
+    asyncio.run(assistant.create_many(arguments[2:]))
+    if assistant.response_cache is not None:
+        print(f"Response cache: {assistant.response_cache.stats()}")
@@ -10,6 +10,29 @@ NOTE_EXTENSION = ".md"
 EXCLUSIVE_EXTENSION = ".excalidraw.md"
 ENCODING = "utf-8"
 
+# Folders and files skipped when searching the vault for notes, as comma separated glob patterns
+# matched against both the name and the path relative to the vault. `.obsidian` is always skipped
+IGNORE_PATTERNS = [
+    pattern.strip()
+    for pattern in os.getenv("IGNORE_PATTERNS", ".trash,.git").split(",")
+    if pattern.strip()
+]
+OBSIDIAN_DIRECTORY = ".obsidian"
+
+# Note loading: "serial", "process" (CPU bound parsing) or "thread" (slow or network mounted vaults)
+NOTE_LOADER = os.getenv("NOTE_LOADER", "serial")
+NOTE_LOADER_WORKERS = int(os.getenv("NOTE_LOADER_WORKERS", os.cpu_count() or 1))
+NOTE_LOADER_CHUNK_SIZE = int(os.getenv("NOTE_LOADER_CHUNK_SIZE", 64))
+
+# Lightning links are written back by WRITE_BACK_WORKERS threads, each note through a temporary
+# file replacing it atomically. WRITE_BACK_FSYNC also flushes every written note to disk
+WRITE_BACK_WORKERS = int(os.getenv("WRITE_BACK_WORKERS", min(8, os.cpu_count() or 1)))
+WRITE_BACK_FSYNC = os.getenv("WRITE_BACK_FSYNC", "false").lower() == "true"
+
+# Memory allowed for parsed notes kept in memory, so unchanged notes are never parsed twice in a
+# process, 0 disables the parse cache
+PARSE_CACHE_MB = int(os.getenv("PARSE_CACHE_MB", 64))
+
 # File Pattern Indicators
 LIGHTNING_LINKS_HEADER = "### Lightning Links"
 LINK_START = "[["
@@ -24,6 +47,73 @@ EMBEDDING_MODEL = os.getenv(
     "EMBEDDING_MODEL", "sentence-transformers/all-mpnet-base-v2"
 )
 
+# Inference backend for the embedding model: "torch", or "onnx" to run an ONNX export of the model
+# through ONNX Runtime. The export is cached in ONNX_CACHE_DIRECTORY and, when ONNX_QUANTIZATION
+# names a config ("arm64", "avx2", "avx512" or "avx512_vnni"), quantized to int8
+EMBEDDING_BACKEND = os.getenv("EMBEDDING_BACKEND", "torch")
+ONNX_QUANTIZATION = os.getenv("ONNX_QUANTIZATION", "")
+ONNX_CACHE_DIRECTORY = os.getenv(
+    "ONNX_CACHE_DIRECTORY", "~/.cache/lightning_links/onnx"
+)
+
+# Encoding: notes are sorted by token length and batched so each batch holds at most
+# ENCODE_BATCH_SIZE * ENCODE_MAX_SEQ_LENGTH padded tokens. A max sequence length or torch thread
+# count of 0 keeps the model's and torch's defaults, and an empty device lets the model pick one
+ENCODE_DEVICE = os.getenv("ENCODE_DEVICE", "") or None
+ENCODE_BATCH_SIZE = int(os.getenv("ENCODE_BATCH_SIZE", 32))
+ENCODE_MAX_SEQ_LENGTH = int(os.getenv("ENCODE_MAX_SEQ_LENGTH", 0))
+ENCODE_WORKERS = int(os.getenv("ENCODE_WORKERS", os.cpu_count() or 1))
+ENCODE_TORCH_THREADS = int(os.getenv("ENCODE_TORCH_THREADS", 0))
+
+# Number of CPU worker processes that share the encoding, 0 or 1 encodes in the main process
+ENCODE_PROCESSES = int(os.getenv("ENCODE_PROCESSES", 0))
+
+# Notes longer than the max sequence length are split at headings or into token windows that
+# overlap by CHUNK_OVERLAP tokens, and the chunk vectors are pooled with "mean" or "max". "none"
+# truncates long notes instead
+CHUNK_POOLING = os.getenv("CHUNK_POOLING", "mean")
+CHUNK_OVERLAP = int(os.getenv("CHUNK_OVERLAP", 32))
+KEEP_CHUNK_EMBEDDINGS = os.getenv("KEEP_CHUNK_EMBEDDINGS", "false").lower() == "true"
+
+# Similar notes scoring below MIN_SIMILARITY_SCORE, or below MIN_RELATIVE_SCORE times the score of
+# the note's best match, are dropped instead of being written as lightning links
+MIN_SIMILARITY_SCORE = float(os.getenv("MIN_SIMILARITY_SCORE", -1.0))
+MIN_RELATIVE_SCORE = float(os.getenv("MIN_RELATIVE_SCORE", 0.0))
+
+# Memory allowed for each tile of similarity scores when searching for the top similar notes
+SIMILARITY_MEMORY_BUDGET_MB = int(os.getenv("SIMILARITY_MEMORY_BUDGET_MB", 256))
+
+# Precision the embeddings are held in while searching for similar notes: "float32", or "float16"
+# and "int8" to use a half or a quarter of the memory. Quantized searches rescore
+# SIMILARITY_RESCORE_FACTOR candidates per similar note in float32
+SIMILARITY_PRECISION = os.getenv("SIMILARITY_PRECISION", "float32")
+SIMILARITY_RESCORE_FACTOR = int(os.getenv("SIMILARITY_RESCORE_FACTOR", 4))
+
+# Similar note search backend: "exact" compares every pair of notes, "ivf" uses an approximate
+# inverted file index that is persisted next to similar_notes.json
+SIMILARITY_BACKEND = os.getenv("SIMILARITY_BACKEND", "exact")
+IVF_NUM_LISTS = int(
+    os.getenv("IVF_NUM_LISTS", 0)
+)  # 0 picks roughly sqrt(number of notes)
+IVF_NUM_PROBES = int(os.getenv("IVF_NUM_PROBES", 8))
+IVF_RECALL_SAMPLE = int(os.getenv("IVF_RECALL_SAMPLE", 100))
+
+# Watch mode: seconds between checks for saved notes, and how long a note must stay unchanged
+# before it is processed
+WATCH_POLL_INTERVAL = float(os.getenv("WATCH_POLL_INTERVAL", 2.0))
+WATCH_DEBOUNCE = float(os.getenv("WATCH_DEBOUNCE", 0.3))
+
+# Embedding cache (stored inside the vault's .obsidian folder)
+CACHE_DIRECTORY = "lightning_links"
+USE_EMBEDDING_CACHE = os.getenv("USE_EMBEDDING_CACHE", "true").lower() == "true"
+
+# Similar notes are saved to a binary store in the cache directory, also export the old
+# .obsidian/similar_notes.json when this is true
+SIMILAR_NOTES_JSON = os.getenv("SIMILAR_NOTES_JSON", "false").lower() == "true"
+
+# Only re-read notes whose modification time or size changed since the last refresh
+INCREMENTAL_REFRESH = os.getenv("INCREMENTAL_REFRESH", "false").lower() == "true"
+
 # AI Provider
 AI_PROVIDER = os.getenv("AI_PROVIDER", "ollama")
 
@@ -34,3 +124,28 @@ OPENAI_MODEL = os.getenv("OPENAI_MODEL", "gpt-4o")
 # Ollama Configuration
 OLLAMA_HOST = os.getenv("OLLAMA_HOST", "http://localhost:11434")
 OLLAMA_MODEL = os.getenv("OLLAMA_MODEL", "llama3")
+
+# The assistant recommends the note closest to a prompt by comparing their embeddings. With
+# RECOMMEND_RERANK the AI model instead picks from the RECOMMEND_CANDIDATES closest notes
+RECOMMEND_RERANK = os.getenv("RECOMMEND_RERANK", "false").lower() == "true"
+RECOMMEND_CANDIDATES = int(os.getenv("RECOMMEND_CANDIDATES", 20))
+
+# Notes given to the AI model as context are cut down to CONTEXT_TOKEN_BUDGET tokens, keeping the
+# passages, of at most CONTEXT_PASSAGE_TOKENS tokens each, most relevant to the prompt
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", 6000))
+CONTEXT_PASSAGE_TOKENS = int(os.getenv("CONTEXT_PASSAGE_TOKENS", 200))
+
+# Print answers from the AI model as they are generated instead of once they are complete
+STREAM_RESPONSES = os.getenv("STREAM_RESPONSES", "true").lower() == "true"
+
+# Responses from the AI model are stored in `.obsidian` and reused for identical requests for
+# RESPONSE_CACHE_TTL_HOURS, keeping at most RESPONSE_CACHE_MB of responses. Requests with a
+# temperature above RESPONSE_CACHE_MAX_TEMPERATURE are meant to vary and skip the cache, as do
+# the requests creating and suggesting notes, which should give a new note each time
+USE_RESPONSE_CACHE = os.getenv("USE_RESPONSE_CACHE", "true").lower() == "true"
+RESPONSE_CACHE_TTL_HOURS = float(os.getenv("RESPONSE_CACHE_TTL_HOURS", 168))
+RESPONSE_CACHE_MB = int(os.getenv("RESPONSE_CACHE_MB", 32))
+RESPONSE_CACHE_MAX_TEMPERATURE = float(os.getenv("RESPONSE_CACHE_MAX_TEMPERATURE", 0.7))
+
+# Most requests the async assistant has in flight at once when creating a batch of notes
+ASSISTANT_CONCURRENCY = int(os.getenv("ASSISTANT_CONCURRENCY", 4))
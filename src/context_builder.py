@@ -0,0 +1,247 @@
+import re
+from collections.abc import Mapping
+from typing import Callable, NamedTuple
+
+from src.constants import CONTEXT_PASSAGE_TOKENS, CONTEXT_TOKEN_BUDGET
+
+# a word, or a single punctuation character, roughly one token each for most tokenizers
+TOKEN_PATTERN = re.compile(r"\w+|[^\w\s]")
+# paragraphs are separated by one or more blank lines
+PARAGRAPH_PATTERN = re.compile(r"\n[^\S\n]*\n\s*")
+# placed after every passage kept
+SEPARATOR = "\n\n"
+
+
+def count_tokens(text: str) -> int:
+    """
+    Estimates the number of tokens in a text by counting words and punctuation, which is close
+    to the count of most subword tokenizers without loading one.
+
+    Args:
+        text (str): The text to count.
+
+    Returns:
+        int: The estimated number of tokens.
+    """
+    return len(TOKEN_PATTERN.findall(text))
+
+
+def overlap_scores(prompt: str, passages: list[str]) -> list[float]:
+    """
+    Scores passages by the fraction of the prompt's distinct words they contain.
+
+    Args:
+        prompt (str): The text the passages should be relevant to.
+        passages (list[str]): The passages to score.
+
+    Returns:
+        list[float]: A score between 0 and 1 for each passage.
+    """
+    prompt_words = set(re.findall(r"\w+", prompt.lower()))
+    if not prompt_words:
+        return [0.0] * len(passages)
+
+    return [
+        len(prompt_words & set(re.findall(r"\w+", passage.lower()))) / len(prompt_words)
+        for passage in passages
+    ]
+
+
+class Context(NamedTuple):
+    """
+    The notes assembled into a prompt by `ContextBuilder.build`.
+
+    Attributes:
+        text (str): The formatted notes.
+        tokens (int): The number of tokens in `text`.
+        dropped_tokens (int): The number of tokens of passages left out to fit the budget.
+        dropped_passages (int): The number of passages left out, in whole or in part.
+    """
+
+    text: str
+    tokens: int
+    dropped_tokens: int
+    dropped_passages: int
+
+
+class ContextBuilder:
+    def __init__(
+        self,
+        max_tokens: int = CONTEXT_TOKEN_BUDGET,
+        tokenizer: Callable[[str], int] = count_tokens,
+        score_function: Callable[[str, list[str]], list[float]] = overlap_scores,
+        passage_tokens: int = CONTEXT_PASSAGE_TOKENS,
+    ):
+        """
+        Assembles the contents of several notes into prompt context that fits a token budget.
+
+        Every note is formatted with its file name, links, tags and body. When the notes fit the
+        budget they are included in full. Otherwise each body is split into passages, one per
+        paragraph with long paragraphs split further, the passages are ranked by their
+        relevance to the prompt, and the best passages that fit are kept in their original
+        order. Without a prompt, earlier notes and earlier passages are preferred. The last
+        passage that doesn't fit whole is truncated to fill the remaining budget.
+
+        Attributes:
+            max_tokens (int): The most tokens the assembled context may hold.
+            tokenizer (Callable[[str], int]): Counts the tokens in a text.
+            score_function (Callable[[str, list[str]], list[float]]): Scores the relevance of
+                each passage to the prompt, higher is more relevant.
+            passage_tokens (int): The most tokens per passage when splitting long paragraphs.
+
+        Args:
+            max_tokens: The most tokens the assembled context may hold.
+            tokenizer: Counts the tokens in a text, such as the embedding model's or the AI
+                provider's tokenizer. Defaults to `count_tokens`.
+            score_function: Scores passages against the prompt. Defaults to `overlap_scores`.
+            passage_tokens: The most tokens per passage when splitting long paragraphs.
+        """
+        self.max_tokens = max_tokens
+        self.tokenizer = tokenizer
+        self.score_function = score_function
+        self.passage_tokens = passage_tokens
+
+    @staticmethod
+    def format_header(file_name: str, note: Mapping) -> str:
+        """
+        Formats everything about a note except its body.
+        """
+        return (
+            f"file_name: {file_name}\n"
+            f"links: {note['links']}\n"
+            f"tags: {note['tags']}\n"
+            "body: "
+        )
+
+    def split_passages(self, body: str) -> list[str]:
+        """
+        Splits a note body into paragraphs, splitting paragraphs longer than `passage_tokens`
+        into runs of whole words.
+
+        Args:
+            body (str): The note body.
+
+        Returns:
+            list[str]: The passages, in order.
+        """
+        passages = []
+        for paragraph in PARAGRAPH_PATTERN.split(body.strip()):
+            if not paragraph:
+                continue
+            if self.tokenizer(paragraph) <= self.passage_tokens:
+                passages.append(paragraph)
+                continue
+
+            words = paragraph.split(" ")
+            start = 0
+            while start < len(words):
+                # grow the run one word at a time, counting only the new word
+                stop, tokens = start, 0
+                while stop < len(words):
+                    word_tokens = self.tokenizer(words[stop])
+                    if stop > start and tokens + word_tokens > self.passage_tokens:
+                        break
+                    tokens += word_tokens
+                    stop += 1
+                passages.append(" ".join(words[start:stop]))
+                start = stop
+
+        return passages
+
+    def truncate(self, text: str, max_tokens: int) -> str:
+        """
+        Cuts a text down to its longest run of leading words that fits `max_tokens`.
+        """
+        words = text.split(" ")
+        tokens = 0
+        for index, word in enumerate(words):
+            tokens += self.tokenizer(word)
+            if tokens > max_tokens:
+                return " ".join(words[:index])
+
+        return text
+
+    def build(self, notes: list[tuple[str, Mapping]], prompt: str = None) -> Context:
+        """
+        Formats notes into context that fits within `max_tokens`.
+
+        Args:
+            notes (list[tuple[str, Note]]): The file name and parsed note of each note, the most
+                important first.
+            prompt (str, optional): The prompt the context is for, used to rank passages.
+
+        Returns:
+            Context: The formatted notes along with how much had to be dropped.
+        """
+        full_text = "".join(
+            self.format_header(file_name, note) + note["body"] + "\n\n"
+            for file_name, note in notes
+        )
+        full_tokens = self.tokenizer(full_text)
+        if full_tokens <= self.max_tokens:
+            return Context(full_text, full_tokens, 0, 0)
+
+        headers = [self.format_header(file_name, note) for file_name, note in notes]
+        note_passages = [self.split_passages(note["body"]) for _, note in notes]
+        # (note position, passage position, text) of every passage
+        passages = [
+            (note_index, passage_index, passage)
+            for note_index, note_passage_list in enumerate(note_passages)
+            for passage_index, passage in enumerate(note_passage_list)
+        ]
+
+        if prompt:
+            scores = self.score_function(prompt, [passage for *_, passage in passages])
+        else:
+            scores = [0.0] * len(passages)
+        # the most relevant first, ties broken by note and then passage order
+        ranking = sorted(
+            range(len(passages)),
+            key=lambda index: (-scores[index], passages[index][0], passages[index][1]),
+        )
+
+        budget = self.max_tokens
+        header_tokens = [self.tokenizer(header) for header in headers]
+        chosen = {}
+        chosen_notes = set()
+        truncated = False
+        for index in ranking:
+            note_index, passage_index, passage = passages[index]
+            # each passage is followed by a blank line, and a note's header is paid for by its
+            # first chosen passage
+            overhead = self.tokenizer(SEPARATOR)
+            if note_index not in chosen_notes:
+                overhead += header_tokens[note_index]
+            cost = overhead + self.tokenizer(passage)
+
+            if cost <= budget:
+                chosen[(note_index, passage_index)] = passage
+                chosen_notes.add(note_index)
+                budget -= cost
+            elif not truncated:
+                # fill what is left of the budget with the start of the best passage left out
+                shortened = self.truncate(passage, budget - overhead)
+                if shortened:
+                    chosen[(note_index, passage_index)] = shortened
+                    chosen_notes.add(note_index)
+                    budget -= overhead + self.tokenizer(shortened)
+                truncated = True
+
+        text = ""
+        for note_index, header in enumerate(headers):
+            kept = [
+                chosen[(note_index, passage_index)]
+                for passage_index in range(len(note_passages[note_index]))
+                if (note_index, passage_index) in chosen
+            ]
+            if kept:
+                text += header + SEPARATOR.join(kept) + SEPARATOR
+
+        tokens = self.tokenizer(text)
+        dropped_passages = sum(
+            1
+            for note_index, passage_index, passage in passages
+            if chosen.get((note_index, passage_index)) != passage
+        )
+
+        return Context(text, tokens, max(0, full_tokens - tokens), dropped_passages)
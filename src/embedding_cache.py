@@ -0,0 +1,331 @@
+import hashlib
+import json
+import os
+import uuid
+from pathlib import Path
+
+import numpy as np
+
+from src.constants import CACHE_DIRECTORY, ENCODING
+
+
+class EmbeddingCache:
+    def __init__(self, notes_directory: str, model_name: str, dimensions: int):
+        """
+        An on-disk store of note embeddings that lets a refresh skip re-encoding notes whose
+        content has not changed since the last run.
+
+        The embeddings are kept as a float32 matrix, which is memory-mapped on load, alongside a
+        JSON manifest that maps each file path to the hash of the content it was encoded from and
+        the matrix row holding its vector. The manifest is tagged with the model name and
+        embedding dimensions, and the whole cache is discarded whenever either of them no longer
+        matches. Every save writes the matrix to a new file and then replaces the manifest, which
+        names that file and its number of rows, so a save interrupted at any point leaves the
+        previous manifest and matrix together.
+
+        Attributes:
+            cache_directory (Path): Folder inside `.obsidian` holding the cache files.
+            matrix_path (Path | None): The matrix file named by the manifest, or None if empty.
+            model_name (str): Name of the embedding model the vectors were produced with.
+            dimensions (int): Size of each embedding vector.
+            entries (dict): Maps a file path to a dictionary with its content "hash" and "row".
+            matrix (np.memmap | None): The memory-mapped embedding matrix, or None if empty.
+            hits (int): Number of embeddings served from the cache during the last encode.
+            misses (int): Number of embeddings that had to be encoded during the last encode.
+
+        Args:
+            notes_directory: The vault directory whose `.obsidian` folder holds the cache.
+            model_name: Name of the embedding model currently in use.
+            dimensions: Embedding size produced by the current model.
+        """
+        self.cache_directory = Path(notes_directory) / ".obsidian" / CACHE_DIRECTORY
+        self.matrix_path = None
+        self.manifest_path = self.cache_directory / "embeddings.json"
+
+        self.model_name = model_name
+        self.dimensions = dimensions
+
+        self.entries = {}
+        self.matrix = None
+        self.hits = 0
+        self.misses = 0
+
+        # secondary index so renamed or duplicated notes can still reuse a vector
+        self._rows_by_hash = {}
+
+        self.load()
+
+    @staticmethod
+    def content_hash(text: str) -> str:
+        """
+        Hashes the text a note is encoded from.
+
+        Args:
+            text (str): The note content passed to the embedding model.
+
+        Returns:
+            str: A hex digest identifying the content.
+        """
+        return hashlib.blake2b(text.encode(ENCODING), digest_size=16).hexdigest()
+
+    def load(self):
+        """
+        Loads the manifest and memory-maps the embedding matrix it names from disk. The cache is
+        left empty if the files are missing, unreadable, don't belong together, or were produced
+        by a different model or with different dimensions.
+
+        Returns:
+            None
+        """
+        self.entries = {}
+        self.matrix = None
+        self.matrix_path = None
+        self._rows_by_hash = {}
+
+        try:
+            with open(self.manifest_path, "r", encoding=ENCODING) as file:
+                manifest = json.load(file)
+            matrix_path = self.cache_directory / manifest["matrix"]
+            matrix = np.load(matrix_path, mmap_mode="r")
+        except (OSError, ValueError, KeyError, TypeError):
+            return
+
+        # invalidate the cache when the model or its output shape has changed, or the matrix
+        # isn't the one the manifest was written with
+        if (
+            manifest.get("model") != self.model_name
+            or manifest.get("dimensions") != self.dimensions
+            or matrix.dtype != np.float32
+            or matrix.ndim != 2
+            or matrix.shape != (manifest.get("rows"), self.dimensions)
+        ):
+            return
+
+        num_rows = matrix.shape[0]
+        entries = manifest.get("entries", {})
+        for file_name, entry in entries.items():
+            if 0 <= entry["row"] < num_rows:
+                self.entries[file_name] = entry
+                self._rows_by_hash[entry["hash"]] = entry["row"]
+
+        self.matrix = matrix
+        self.matrix_path = matrix_path
+
+    def lookup(self, file_name: str, content_hash: str):
+        """
+        Finds the matrix row holding the embedding of a note with the given content.
+
+        Args:
+            file_name (str): Path of the note.
+            content_hash (str): Hash of the note's current content.
+
+        Returns:
+            int | None: The row index, or None if the content has not been encoded before.
+        """
+        entry = self.entries.get(file_name)
+        if entry is not None and entry["hash"] == content_hash:
+            return entry["row"]
+
+        return self._rows_by_hash.get(content_hash)
+
+    def encode(
+        self,
+        file_names: list[str],
+        texts: list[str],
+        encode_function,
+        hashes: list[str] = None,
+    ):
+        """
+        Returns embeddings for every note, only calling `encode_function` for notes that are
+        new or whose content changed, and then saves the result as the new cache contents.
+
+        Args:
+            file_names (list[str]): Paths of the notes, used as cache keys.
+            texts (list[str]): Content to encode for each note, in the same order. An entry may
+                be None when its hash is given and already cached, so unchanged notes don't
+                have to be read.
+            encode_function (Callable): Takes a list of strings and returns their embeddings.
+            hashes (list[str], optional): Known content hashes for the notes. Missing entries
+                are computed from `texts`.
+
+        Returns:
+            np.ndarray: A float32 matrix of shape (len(texts), dimensions).
+
+        Raises:
+            ValueError: If the encoder returns vectors of an unexpected size, or a note without
+                text is not in the cache.
+        """
+        if hashes is None:
+            hashes = [None] * len(texts)
+        hashes = [
+            self.content_hash(text) if content_hash is None else content_hash
+            for text, content_hash in zip(texts, hashes)
+        ]
+        embeddings = np.empty((len(texts), self.dimensions), dtype=np.float32)
+
+        cached_positions = []
+        cached_rows = []
+        missing_positions = []
+        for position, (file_name, content_hash) in enumerate(zip(file_names, hashes)):
+            row = self.lookup(file_name, content_hash)
+            if row is None:
+                missing_positions.append(position)
+            else:
+                cached_positions.append(position)
+                cached_rows.append(row)
+
+        # gather all cached vectors in one read from the memory map
+        if cached_positions:
+            embeddings[cached_positions] = self.matrix[cached_rows]
+
+        if any(texts[position] is None for position in missing_positions):
+            raise ValueError("Cannot encode a note without text that is not cached")
+
+        if missing_positions:
+            encoded = np.asarray(
+                encode_function([texts[position] for position in missing_positions]),
+                dtype=np.float32,
+            )
+            if encoded.shape != (len(missing_positions), self.dimensions):
+                raise ValueError(
+                    f"Expected embeddings of shape {(len(missing_positions), self.dimensions)}, "
+                    f"got {encoded.shape}"
+                )
+            embeddings[missing_positions] = encoded
+
+        self.hits = len(cached_positions)
+        self.misses = len(missing_positions)
+
+        new_entries = {
+            file_name: {"hash": content_hash, "row": row}
+            for row, (file_name, content_hash) in enumerate(zip(file_names, hashes))
+        }
+        # nothing new was encoded and the layout is unchanged, so the files on disk are current
+        if self.misses or new_entries != self.entries:
+            self.save(new_entries, embeddings)
+
+        return embeddings
+
+    def save(self, entries: dict, embeddings: np.ndarray):
+        """
+        Replaces the cache contents with the given entries and embedding matrix. The matrix is
+        written to a file of its own, and the manifest naming it is then written to a temporary
+        path and moved into place, so the switch to the new contents is a single replace. Matrix
+        files no longer named by the manifest are removed afterwards.
+
+        Args:
+            entries (dict): Maps each file path to its content "hash" and matrix "row".
+            embeddings (np.ndarray): Matrix whose rows are referenced by `entries`.
+
+        Returns:
+            None
+        """
+        self.cache_directory.mkdir(parents=True, exist_ok=True)
+
+        # release the memory map before the file underneath it is removed
+        self.matrix = None
+
+        embeddings = np.asarray(embeddings, dtype=np.float32)
+        matrix_name = f"embeddings.{uuid.uuid4().hex}.npy"
+        np.save(self.cache_directory / matrix_name, embeddings)
+        self.write_manifest(matrix_name, len(embeddings), entries)
+
+        # matrices of earlier saves, and of saves that were interrupted
+        for path in self.cache_directory.glob("embeddings*.npy"):
+            if path.name != matrix_name:
+                try:
+                    os.remove(path)
+                except OSError:
+                    # still mapped by another process on some platforms, removed next save
+                    pass
+
+        self.load()
+
+    def write_manifest(self, matrix_name: str, num_rows: int, entries: dict):
+        """
+        Replaces the manifest atomically.
+
+        Args:
+            matrix_name (str): Name of the matrix file the entries refer to.
+            num_rows (int): The number of rows in the matrix.
+            entries (dict): Maps each file path to its content "hash" and matrix "row".
+
+        Returns:
+            None
+        """
+        manifest = {
+            "model": self.model_name,
+            "dimensions": self.dimensions,
+            "matrix": matrix_name,
+            "rows": num_rows,
+            "entries": entries,
+        }
+        temp_manifest_path = self.manifest_path.with_suffix(".tmp")
+        with open(temp_manifest_path, "w", encoding=ENCODING) as file:
+            json.dump(manifest, file)
+        os.replace(temp_manifest_path, self.manifest_path)
+
+    def update(self, file_names: list[str], hashes: list[str], embeddings: np.ndarray):
+        """
+        Stores new embeddings for a few notes and keeps every other entry. The rows of notes
+        already in the cache are overwritten in place, so saving an edited note doesn't rewrite
+        the whole matrix. A new matrix is only written when a note isn't in the cache yet.
+
+        The entries being overwritten are removed from the manifest before their rows change,
+        and added back with their new hashes afterwards, so an interrupted update can lose
+        those entries but never pairs a hash with the vector of other content.
+
+        Args:
+            file_names (list[str]): Paths of the notes.
+            hashes (list[str]): Hash of the content each embedding was computed from.
+            embeddings (np.ndarray): One embedding per note.
+
+        Returns:
+            None
+        """
+        embeddings = np.asarray(embeddings, dtype=np.float32)
+        entries = dict(self.entries)
+
+        if self.matrix is None or any(
+            file_name not in entries for file_name in file_names
+        ):
+            matrix = np.empty((0, self.dimensions), dtype=np.float32)
+            if self.matrix is not None:
+                matrix = np.array(self.matrix)
+            else:
+                entries = {}
+            new_rows = []
+            for file_name, content_hash, vector in zip(file_names, hashes, embeddings):
+                if file_name in entries:
+                    matrix[entries[file_name]["row"]] = vector
+                    entries[file_name] = {
+                        "hash": content_hash,
+                        "row": entries[file_name]["row"],
+                    }
+                else:
+                    entries[file_name] = {
+                        "hash": content_hash,
+                        "row": len(matrix) + len(new_rows),
+                    }
+                    new_rows.append(vector)
+            if new_rows:
+                matrix = np.vstack([matrix, new_rows])
+            self.save(entries, matrix)
+            return
+
+        rows = [entries.pop(file_name)["row"] for file_name in file_names]
+        matrix_name = self.matrix_path.name
+        num_rows = len(self.matrix)
+        self.write_manifest(matrix_name, num_rows, entries)
+
+        self.matrix = None
+        matrix = np.load(self.matrix_path, mmap_mode="r+")
+        matrix[rows] = embeddings
+        matrix.flush()
+        del matrix
+
+        for file_name, content_hash, row in zip(file_names, hashes, rows):
+            entries[file_name] = {"hash": content_hash, "row": row}
+        self.write_manifest(matrix_name, num_rows, entries)
+
+        self.load()
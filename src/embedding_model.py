@@ -0,0 +1,130 @@
+from pathlib import Path
+
+from src.constants import (
+    EMBEDDING_BACKEND,
+    EMBEDDING_MODEL,
+    ENCODE_DEVICE,
+    ONNX_CACHE_DIRECTORY,
+    ONNX_QUANTIZATION,
+)
+
+EMBEDDING_BACKENDS = ("torch", "onnx")
+ONNX_FILE_NAME = "onnx/model.onnx"
+
+
+def get_onnx_directory(model_name: str, cache_directory: str) -> Path:
+    """
+    Returns the folder the ONNX export of a model is cached in.
+
+    Args:
+        model_name (str): The name or path of the SentenceTransformer model.
+        cache_directory (str): The folder holding every exported model.
+
+    Returns:
+        Path: A folder named after the model inside `cache_directory`.
+    """
+    return Path(cache_directory).expanduser() / model_name.replace("/", "__")
+
+
+def get_onnx_file_name(quantization: str) -> str:
+    """
+    Returns the path, relative to the export folder, of the ONNX file used for a quantization.
+
+    Args:
+        quantization (str): The dynamic int8 quantization config, such as "avx2", or an empty
+            string for the float32 model.
+
+    Returns:
+        str: The ONNX file name sentence-transformers uses for that export.
+    """
+    if not quantization:
+        return ONNX_FILE_NAME
+
+    return f"onnx/model_qint8_{quantization}.onnx"
+
+
+def export_onnx_model(model_name: str, export_directory: Path, quantization: str = ""):
+    """
+    Exports a SentenceTransformer model to ONNX, and optionally to a dynamically quantized int8
+    ONNX model, and saves the result along with the tokenizer and pooling settings.
+
+    Args:
+        model_name (str): The name or path of the SentenceTransformer model.
+        export_directory (Path): The folder the export is saved to.
+        quantization (str): The dynamic int8 quantization config ("arm64", "avx2", "avx512" or
+            "avx512_vnni"), or an empty string to only export the float32 model.
+
+    Returns:
+        None
+    """
+    from sentence_transformers import (
+        SentenceTransformer,
+        export_dynamic_quantized_onnx_model,
+    )
+
+    export_directory = Path(export_directory)
+    if not (export_directory / ONNX_FILE_NAME).exists():
+        # loading with the onnx backend converts the PyTorch weights when no export exists
+        model = SentenceTransformer(model_name, backend="onnx", device="cpu")
+        model.save_pretrained(export_directory.as_posix())
+
+    if (
+        quantization
+        and not (export_directory / get_onnx_file_name(quantization)).exists()
+    ):
+        model = SentenceTransformer(
+            export_directory.as_posix(), backend="onnx", device="cpu"
+        )
+        export_dynamic_quantized_onnx_model(
+            model, quantization, export_directory.as_posix()
+        )
+
+
+def load_embedding_model(
+    model_name: str = EMBEDDING_MODEL,
+    backend: str = EMBEDDING_BACKEND,
+    device: str = ENCODE_DEVICE,
+    quantization: str = ONNX_QUANTIZATION,
+    cache_directory: str = ONNX_CACHE_DIRECTORY,
+):
+    """
+    Loads the embedding model with the requested inference backend.
+
+    The "torch" backend runs the model through PyTorch. The "onnx" backend runs it through ONNX
+    Runtime, exporting the model to ONNX the first time it is used and caching the export in
+    `cache_directory`, so later runs load the exported model directly. With a quantization config
+    the export is also quantized to int8, which is usually faster still on CPUs.
+
+    Args:
+        model_name (str): The name or path of the SentenceTransformer model.
+        backend (str): "torch" or "onnx".
+        device (str | None): The device to run on, None picks one automatically.
+        quantization (str): For the onnx backend, the dynamic int8 quantization config, or an
+            empty string for the float32 export.
+        cache_directory (str): The folder ONNX exports are cached in.
+
+    Returns:
+        SentenceTransformer: The loaded model.
+
+    Raises:
+        ValueError: If `backend` is not a known backend.
+    """
+    if backend not in EMBEDDING_BACKENDS:
+        raise ValueError(
+            f"Unknown embedding backend {backend!r}, expected one of {EMBEDDING_BACKENDS}"
+        )
+
+    from sentence_transformers import SentenceTransformer
+
+    if backend == "torch":
+        return SentenceTransformer(model_name, device=device)
+
+    export_directory = get_onnx_directory(model_name, cache_directory)
+    export_onnx_model(model_name, export_directory, quantization)
+
+    return SentenceTransformer(
+        export_directory.as_posix(),
+        backend="onnx",
+        device=device,
+        model_kwargs={"file_name": get_onnx_file_name(quantization)},
+    )
@@ -1,15 +1,40 @@
+import os
 import sys
 from pathlib import Path
 from time import time
 
 import numpy as np
-from sentence_transformers import SentenceTransformer
 
+from src.ann_index import IVFIndex
+from src.embedding_cache import EmbeddingCache
+from src.embedding_model import load_embedding_model
+from src.note_encoder import NoteEncoder
 from src.note_handler import FileParser
+from src.refresh_state import RefreshState
+from src.similarity_search import (
+    TopKSimilarities,
+    count_above_threshold,
+    select_top_k,
+    top_k_similarities,
+)
+from src.vault_watcher import VaultWatcher
 from src.constants import (
     NUM_LIGHTNING_LINKS,
     NUM_REFERENCE_NOTES,
     EMBEDDING_MODEL,
+    EMBEDDING_BACKEND,
+    ONNX_QUANTIZATION,
+    USE_EMBEDDING_CACHE,
+    SIMILARITY_MEMORY_BUDGET_MB,
+    SIMILARITY_PRECISION,
+    SIMILARITY_RESCORE_FACTOR,
+    MIN_SIMILARITY_SCORE,
+    MIN_RELATIVE_SCORE,
+    INCREMENTAL_REFRESH,
+    SIMILARITY_BACKEND,
+    IVF_NUM_LISTS,
+    IVF_NUM_PROBES,
+    IVF_RECALL_SAMPLE,
 )
 
 
@@ -24,37 +49,242 @@ class LightningLinksCreator:
         similarity computation, and updating processes for efficient management of
         lightning links in a given vault.
 
+        The embedding model is only loaded, and sentence-transformers and torch only imported,
+        the first time the model or encoder is used, so commands that don't need embeddings start
+        quickly.
+
         Attributes:
             model (SentenceTransformer): The pre-trained SentenceTransformer model used
-                for encoding sentences and calculating similarities.
+                for encoding sentences and calculating similarities, loaded on first use.
+            encoder (NoteEncoder): Encodes note bodies with the model in length-sorted batches,
+                created on first use.
             file_handler (FileParser): An instance of the `FileParser` class responsible
                 for file reading, note management, and file updates.
             num_lightning_links (int): The maximum number of lightning links to be
                 added to each note.
             num_similar_notes (int): The number of top similar notes to consider
                 for updates.
+            min_similarity_score (float): Similar notes scoring below this are dropped.
+            min_relative_score (float): Similar notes scoring below this fraction of the score of
+                the note's best match are dropped, 0 disables the relative threshold.
+            similarity_memory_budget (int): The maximum number of bytes used by each tile
+                of similarity scores while searching for the top similar notes.
+            embedding_cache (EmbeddingCache | None): The on-disk embedding cache, created on
+                first use.
+            write_back_report (WriteBackReport | None): The notes and bytes written by the last
+                lightning links update.
         """
 
-        # load model Source: https://huggingface.co/sentence-transformers/all-mpnet-base-v2
-        self.model = SentenceTransformer(EMBEDDING_MODEL)
+        self._model = None
+        self._encoder = None
         self.file_handler = FileParser(vault_path)
         self.num_lightning_links = NUM_LIGHTNING_LINKS
         self.num_similar_notes = NUM_REFERENCE_NOTES
+        self.min_similarity_score = MIN_SIMILARITY_SCORE
+        self.min_relative_score = MIN_RELATIVE_SCORE
+        self.similarity_memory_budget = SIMILARITY_MEMORY_BUDGET_MB * 1024 * 1024
+        self.embedding_cache = None
+        self.write_back_report = None
+
+    @property
+    def model(self):
+        """
+        Returns the embedding model, loading it with the configured backend on first use.
+
+        Returns:
+            SentenceTransformer: The model used to encode notes.
+        """
+        if self._model is None:
+            # load model Source: https://huggingface.co/sentence-transformers/all-mpnet-base-v2
+            # using the backend selected by EMBEDDING_BACKEND
+            self._model = load_embedding_model()
+
+        return self._model
+
+    @model.setter
+    def model(self, model):
+        self._model = model
+        self._encoder = None
+
+    @property
+    def encoder(self):
+        """
+        Returns the note encoder, creating it and loading the model on first use.
+
+        Returns:
+            NoteEncoder: The encoder wrapping the model.
+        """
+        if self._encoder is None:
+            self._encoder = NoteEncoder(self.model)
+
+        return self._encoder
+
+    def close(self):
+        """
+        Shuts down the encoding worker processes, if any were started. The model is not loaded if
+        it hasn't been used.
+
+        Returns:
+            None
+        """
+        if self._encoder is not None:
+            self._encoder.stop_pool()
+
+    def get_embedding_cache(self):
+        """
+        Returns the embedding cache for the vault, loading it from disk on first use.
+
+        Returns:
+            EmbeddingCache: The cache tagged with the current embedding tag and dimensions.
+        """
+        if self.embedding_cache is None:
+            self.embedding_cache = EmbeddingCache(
+                self.file_handler.notes_directory,
+                self.get_embedding_tag(),
+                self.model.get_sentence_embedding_dimension(),
+            )
+
+        return self.embedding_cache
+
+    def get_embedding_tag(self):
+        """
+        Returns a name for the embeddings produced with the current model, backend and encoder
+        settings, such as the chunk pooling, so stored embeddings are discarded when any of them
+        changes.
+
+        Returns:
+            str: The model name followed by the backend and encoder settings.
+        """
+        backend = EMBEDDING_BACKEND
+        if backend == "onnx" and ONNX_QUANTIZATION:
+            backend += f"-qint8-{ONNX_QUANTIZATION}"
+
+        return f"{EMBEDDING_MODEL}|{backend}|{self.encoder.settings_tag}"
 
-    def find_similarities(self, sentences):
+    def encode_sentences(self, sentences, file_names=None, hashes=None):
         """
-        Computes the similarity scores between all pairs of given sentences using the provided model.
+        Encodes the given sentences into embeddings. When the file names the sentences belong to
+        are provided, the on-disk embedding cache is used so only new or edited notes are passed
+        through the model.
+
+        Args:
+            sentences (list): A list of strings to encode.
+            file_names (list, optional): The file name of the note each sentence was taken from.
+            hashes (list, optional): Known content hashes of the sentences. A sentence may be None
+                if its hash is given and already cached.
+
+        Returns:
+            ndarray: A float32 matrix with one embedding per sentence.
+        """
+        if file_names is None or not USE_EMBEDDING_CACHE:
+            return self.encoder.encode(sentences)
+
+        cache = self.get_embedding_cache()
+        embedding = cache.encode(
+            file_names,
+            sentences,
+            self.encoder.encode,
+            hashes,
+        )
+        print(f"\rEmbeddings reused: {cache.hits}, encoded: {cache.misses}")
+
+        return embedding
+
+    def find_similarities(self, sentences, file_names=None, hashes=None):
+        """
+        Finds the most similar sentences for every sentence using the provided model.
+
+        The similarities are computed in tiles that never exceed `similarity_memory_budget`,
+        so the full N x N similarity matrix is never held in memory. When `SIMILARITY_BACKEND` is
+        "ivf" and the file names are known, the approximate index is used instead.
+
+        With a `SIMILARITY_PRECISION` of "float16" or "int8" the search runs on quantized
+        embeddings, and the candidates are rescored against the float32 embeddings memory-mapped
+        from the embedding cache when it is in use.
 
         Args:
             sentences (list): A list of strings representing the sentences to be compared.
+            file_names (list, optional): The file name of the note each sentence was taken from,
+                enabling reuse of cached embeddings.
+            hashes (list, optional): Known content hashes of the sentences, see `encode_sentences`.
+
+        Returns:
+            TopKSimilarities: The indexes and scores of the top `num_similar_notes` most similar
+                sentences for each sentence.
+        """
+        embedding = self.encode_sentences(sentences, file_names, hashes)
+
+        if SIMILARITY_BACKEND == "ivf" and file_names is not None:
+            return self.search_ann_index(embedding, file_names)
+
+        if (
+            SIMILARITY_PRECISION != "float32"
+            and file_names is not None
+            and USE_EMBEDDING_CACHE
+        ):
+            cache = self.get_embedding_cache()
+            # the cache was just written with one row per note in the same order, so the
+            # in-memory float32 copy can be dropped in favour of the memory map
+            if cache.matrix is not None and len(cache.matrix) == len(embedding):
+                embedding = cache.matrix
+
+        return top_k_similarities(
+            embedding,
+            self.num_similar_notes,
+            self.similarity_memory_budget,
+            SIMILARITY_PRECISION,
+            SIMILARITY_RESCORE_FACTOR,
+        )
+
+    def search_ann_index(self, embedding, file_names):
+        """
+        Finds the most similar notes for every note with the approximate IVF index stored next
+        to `similar_notes.json`. An index saved for embeddings with a different tag is rebuilt.
+
+        The saved index is brought up to date by removing deleted or edited notes and adding new
+        or edited ones, then saved again if anything changed. The estimated recall against an exact search is
+        reported for `IVF_RECALL_SAMPLE` sampled notes.
+
+        Args:
+            embedding (ndarray): One embedding per note.
+            file_names (list): The file name of each note, used as its id in the index.
 
         Returns:
-            ndarray: A similarity matrix where each element represents the similarity between two sentences.
+            TopKSimilarities: The indexes into `file_names` and scores of the top
+                `num_similar_notes` most similar notes for each note.
         """
-        embedding = self.model.encode(sentences, show_progress_bar=True)
+        index_path = (
+            Path(self.file_handler.notes_directory)
+            / ".obsidian"
+            / "similar_notes_index.npz"
+        )
+        dimensions = embedding.shape[1]
+        embedding_tag = self.get_embedding_tag()
+
+        index = IVFIndex.load(index_path, dimensions, embedding_tag)
+        if index is None:
+            index = IVFIndex(dimensions, IVF_NUM_LISTS)
+        index.num_probes = IVF_NUM_PROBES
+
+        removed, added = index.update(file_names, embedding)
+        if removed or added:
+            index.save(index_path, embedding_tag)
+        print(f"\rIndex Updated! {removed} removed, {added} added")
 
-        similarities = self.model.similarity(embedding, embedding)
-        return similarities
+        if IVF_RECALL_SAMPLE > 0:
+            recall = index.measure_recall(self.num_similar_notes, IVF_RECALL_SAMPLE)
+            print(f"Estimated recall@{self.num_similar_notes}: {recall:.3f}")
+
+        # each note leaves its own index position out of its results
+        positions = {item: position for position, item in enumerate(index.ids)}
+        own_positions = np.array([positions[file_name] for file_name in file_names])
+        result = index.search(embedding, self.num_similar_notes, exclude=own_positions)
+
+        # translate index positions back into positions in file_names
+        file_positions = np.empty(len(index.ids), dtype=np.int32)
+        file_positions[own_positions] = np.arange(len(file_names), dtype=np.int32)
+
+        return TopKSimilarities(file_positions[result.indexes], result.scores)
 
     def extract_bodies(self, notes_list):
         """
@@ -78,112 +308,301 @@ class LightningLinksCreator:
 
         return notes_sentences
 
-    def get_top_n_similarities_from_row(self, row):
+    def get_top_n_similarities_from_row(self, row, row_id):
         """
         Retrieves the indexes of the top 'num_similarities' of highest values in a given row.
 
         Args:
             row (list): A list of numeric values.
+            row_id (int): The position of the row's own note, which is excluded from the results.
 
         Returns:
-            list: A list of indexes corresponding to the top 'num_similarities' of the highest values in the row.
+            ndarray: An int32 array of indexes corresponding to the top 'num_similarities' of the highest values
+                in the row.
         """
+        row = np.array(row, dtype=np.float32, ndmin=2)
 
-        if self.num_similar_notes >= len(row):
-            return list(range(0, len(row)))
-
-        if self.num_similar_notes == 0:
-            return []
-
-        top_n_indexes = np.argsort(row)[::-1][1 : self.num_similar_notes + 1]
-
-        return top_n_indexes
+        return select_top_k(row, self.num_similar_notes, row_id).indexes[0]
 
     def get_all_top_n_similarities(self, similarities):
         """
         Retrieves the top n similarity indexes for each row in a similarity matrix.
 
+        A dense matrix is reduced in a single batched selection rather than row by row, with each
+        note's own entry on the diagonal masked out.
+
         Args:
-            similarities (ndarray): A 2D array or matrix where each element represents a similarity score.
+            similarities (TopKSimilarities | ndarray): The result of `find_similarities`, or a 2D
+                array, tensor or matrix where each element represents a similarity score.
 
         Returns:
-            list: A list of lists where each sublist contains the indexes of the top n similarities for a row.
+            TopKSimilarities: An (N, n) int32 array of the indexes of the top n similarities for each row,
+                along with their scores.
         """
+        # the blocked search has already selected and ordered the top n for every row
+        if isinstance(similarities, TopKSimilarities):
+            return similarities
 
-        top_n_indexes_table = []
+        # tensors are converted to NumPy once for the whole matrix, and copied so masking is safe
+        if hasattr(similarities, "numpy"):
+            similarities = similarities.numpy()
+        similarities = np.array(similarities, dtype=np.float32, ndmin=2)
 
-        for row_id in range(len(similarities)):
-            # find the rows top n indexes
-            row = similarities[row_id]
-            top_n_indexes = self.get_top_n_similarities_from_row(row.numpy())
-            # add to the table
-            top_n_indexes_table.append(top_n_indexes)
+        return select_top_k(similarities, self.num_similar_notes)
 
-        return top_n_indexes_table
+    def count_strong_similarities(self, scores):
+        """
+        Counts, for each note, how many of its top similar notes pass the `min_similarity_score`
+        and `min_relative_score` thresholds. The notes that pass are always the first ones.
+
+        Args:
+            scores (ndarray): The (N, n) scores of the top similar notes of each note.
+
+        Returns:
+            list[int]: The number of similar notes to keep for each note.
+        """
+        return count_above_threshold(
+            scores, self.min_similarity_score, self.min_relative_score
+        ).tolist()
 
     def update_notes_with_similarities(
-        self, notes, top_n_similarities_indexes: list[list]
+        self, notes, top_n_similarities_indexes: TopKSimilarities | list[list]
     ):
         """
         Updates notes with a list of the most similar notes based on their indexes and optionally
         updates associated files with lighting links.
 
         This function assigns similar notes' filenames to the "similar_notes" key in each note from
-        the input list of notes, using the provided list of similarity indexes. If the file handler
-        updates the note with lighting links, the counter for total notes updated is incremented.
+        the input list of notes, using the provided list of similarity indexes. When the scores are
+        known, they are stored under "similarity_scores" and similar notes below the score
+        thresholds are dropped, so a note without good matches gets fewer lightning links. The
+        lightning links of every note are then written back in one batch, skipping notes that are
+        already up to date.
 
         Args:
             notes (list): A list of dictionaries, where each dictionary represents a note. Each note
                 must include the key "file_name" to identify its associated filename.
-            top_n_similarities_indexes (list): A list of lists containing indexes of similar notes for
+            top_n_similarities_indexes (TopKSimilarities | list): The top similar notes found by
+                `get_all_top_n_similarities`, or a list of lists containing indexes of similar notes for
                 each note in the `notes` list.
 
         Returns:
             int: The total count of notes successfully updated with lighting links.
         """
-        total_notes_updated = 0
+        scores = None
+        if isinstance(top_n_similarities_indexes, TopKSimilarities):
+            scores = top_n_similarities_indexes.scores
+            counts = self.count_strong_similarities(scores)
+            scores = scores.tolist()
+            top_n_similarities_indexes = [
+                indexes[:count]
+                for indexes, count in zip(
+                    top_n_similarities_indexes.indexes.tolist(), counts
+                )
+            ]
+
         for i, similarity_indexes in enumerate(top_n_similarities_indexes):
             notes[i]["similar_notes"] = [
                 notes[sim_idx]["file_name"] for sim_idx in similarity_indexes
             ]
-            if self.file_handler.update_lighting_links(
-                notes[i]["file_name"],
-                notes[i]["similar_notes"],
-                self.num_lightning_links,
+            if scores is not None:
+                notes[i]["similarity_scores"] = scores[i][: len(similarity_indexes)]
+
+        self.write_back_report = self.file_handler.write_lightning_links(
+            [
+                (note["file_name"], note["similar_notes"])
+                for note in notes[: len(top_n_similarities_indexes)]
+            ],
+            self.num_lightning_links,
+        )
+
+        return len(self.write_back_report.files_written)
+
+    def get_refresh_settings(self):
+        """
+        Returns the settings that determine the lightning links written to each note. A stored
+        refresh state is only reused while these stay the same.
+
+        Returns:
+            dict: The embedding model and encoder settings, the number of similar notes and
+                lightning links, and the score thresholds.
+        """
+        return {
+            "model": self.get_embedding_tag(),
+            "num_similar_notes": self.num_similar_notes,
+            "num_lightning_links": self.num_lightning_links,
+            "min_similarity_score": self.min_similarity_score,
+            "min_relative_score": self.min_relative_score,
+        }
+
+    def save_refresh_state(self, notes, hashes):
+        """
+        Records the current modification time, size, content hash and similar notes of every
+        note so that the next incremental refresh can skip unchanged notes.
+
+        Args:
+            notes (list): Dictionaries with the "file_name" and "similar_notes" of every note.
+            hashes (list): The content hash of each note's embedding, in the same order.
+
+        Returns:
+            None
+        """
+        state = RefreshState(
+            self.file_handler.notes_directory, self.get_refresh_settings()
+        )
+        state.retain([note["file_name"] for note in notes])
+
+        for note, content_hash in zip(notes, hashes):
+            state.record(
+                note["file_name"],
+                os.stat(note["file_name"]),
+                content_hash,
+                note["similar_notes"],
+            )
+
+        state.save()
+
+    def refresh_changed_similarities(self):
+        """
+        Refreshes similarities while only reading the notes that changed since the last refresh.
+
+        Notes whose modification time and size match the stored refresh state reuse their cached
+        embedding without being opened. The top similar notes are then recomputed for the whole
+        vault, but a note is only rewritten if it was edited or the lightning links shown in it
+        changed. Falls back to a full refresh when the embedding cache is disabled.
+
+        Returns:
+            None
+        """
+        if not USE_EMBEDDING_CACHE:
+            print(
+                "Incremental refresh needs the embedding cache, running a full refresh"
+            )
+            self.refresh_similarities(incremental=False)
+            return
+
+        start_time = time()
+        # rescan so the file stats used to skip unchanged notes are current
+        file_names = self.file_handler.scan_vault()
+        state = RefreshState(
+            self.file_handler.notes_directory, self.get_refresh_settings()
+        )
+        cache = self.get_embedding_cache()
+
+        # find notes that need to be read, either because they changed or their vector is missing
+        print("Checking For Changes...", end="")
+        hashes = {}
+        changed_files = []
+        for file_name in file_names:
+            content_hash = state.get_hash(file_name)
+            if (
+                state.is_unchanged(
+                    file_name, self.file_handler.get_file_stat(file_name)
+                )
+                and cache.lookup(file_name, content_hash) is not None
+            ):
+                hashes[file_name] = content_hash
+            else:
+                changed_files.append(file_name)
+        print(
+            f"\rChanged Notes: {len(changed_files)} of {len(file_names)} {time() - start_time}"
+        )
+
+        bodies = {}
+        for note in self.file_handler.load_all_note_files(
+            changed_files, ensure_endings=True
+        ):
+            bodies[note["file_name"]] = note["body"]
+            hashes[note["file_name"]] = cache.content_hash(note["body"])
+
+        print("Finding Top N Similarities...", end="")
+        top_n_similarities = self.find_similarities(
+            [bodies.get(file_name) for file_name in file_names],
+            file_names,
+            [hashes[file_name] for file_name in file_names],
+        )
+        print(f"\rTop N Similarities Found! {time() - start_time}")
+
+        print("Updating Lighting Links...", end="")
+        notes = []
+        updates = []
+        counts = self.count_strong_similarities(top_n_similarities.scores)
+        for i, (similarity_indexes, similarity_scores, count) in enumerate(
+            zip(
+                top_n_similarities.indexes.tolist(),
+                top_n_similarities.scores.tolist(),
+                counts,
+            )
+        ):
+            file_name = file_names[i]
+            similar_notes = [
+                file_names[sim_idx] for sim_idx in similarity_indexes[:count]
+            ]
+            previous_links = state.get_similar_notes(file_name)[
+                : self.num_lightning_links
+            ]
+
+            # only the first few similar notes are written into the note itself
+            if (
+                file_name in bodies
+                or previous_links != similar_notes[: self.num_lightning_links]
             ):
-                total_notes_updated += 1
+                updates.append((file_name, similar_notes))
+
+            notes.append(
+                {
+                    "file_name": file_name,
+                    "similar_notes": similar_notes,
+                    "similarity_scores": similarity_scores[:count],
+                }
+            )
+        self.write_back_report = self.file_handler.write_lightning_links(
+            updates, self.num_lightning_links
+        )
+        print(
+            f"\nTotal Lighting Links Updated: {len(self.write_back_report.files_written)} "
+            f"({self.write_back_report.bytes_written} bytes)\n"
+        )
 
-        return total_notes_updated
+        print("Saving Similarities...", end="")
+        self.file_handler.save_similar_notes(notes)
+        self.save_refresh_state(notes, [hashes[file_name] for file_name in file_names])
+        print(f"\rSimilarities Saved! {time() - start_time}")
 
-    def refresh_similarities(self):
+    def refresh_similarities(self, incremental: bool = INCREMENTAL_REFRESH):
         """
         Refreshes similarities between notes by extracting sentences, encoding them,
         finding top similar sentences for each note, and updating these similarities
         back into the notes.
 
         This method performs the following operations:
-        1. Ensures the file format has proper endings.
-        2. Loads all note files.
-        3. Extracts sentences from the note body content.
-        4. Encodes the sentences for similarity computation.
-        5. Finds top N similar sentences for each note.
-        6. Updates the notes with computed similarities.
-        7. Saves the updated notes back to their respective files.
+        1. Loads all note files, ensuring each has a proper ending as it is read.
+        2. Extracts sentences from the note body content.
+        3. Encodes the sentences for similarity computation.
+        4. Finds top N similar sentences for each note.
+        5. Updates the notes with computed similarities.
+        6. Saves the updated notes back to their respective files.
 
         The process involves multiple stages with time tracking for performance
         monitoring, and it incorporates updates to the existing notes to reflect
         the computed similarities.
 
+        Args:
+            incremental (bool): Only read and rewrite the notes affected by changes since the
+                last refresh. See `refresh_changed_similarities`.
+
         Raises:
             Exception: If an unexpected error occurs during file processing or
             similarity computation.
         """
-        # Ensure correct formatting
-        self.file_handler.ensure_proper_endings()
+        if incremental:
+            self.refresh_changed_similarities()
+            return
 
         start_time = time()
         print("Loading Files...", end="")
-        notes = self.file_handler.load_all_note_files()
+        # endings are fixed while the notes are read, so each note is only opened once
+        notes = self.file_handler.load_all_note_files(ensure_endings=True)
         print(f"\rFiles Loaded! {time() - start_time}")
 
         # get sentences
@@ -193,7 +612,8 @@ class LightningLinksCreator:
 
         # encode sentences
         print("Encoding Sentences...", end="")
-        encoded_sentences = self.find_similarities(bodies)
+        file_names = [note["file_name"] for note in notes]
+        encoded_sentences = self.find_similarities(bodies, file_names)
         print(f"\rSentences Encoded! {time() - start_time}")
         # find top n for each note
         print("Finding Top N Similarities...", end="")
@@ -205,11 +625,17 @@ class LightningLinksCreator:
         notes_updated = self.update_notes_with_similarities(
             notes, top_n_similarities_indexes
         )
-        print(f"\nTotal Lighting Links Updated: {notes_updated}\n")
+        print(
+            f"\nTotal Lighting Links Updated: {notes_updated} "
+            f"({self.write_back_report.bytes_written} bytes)\n"
+        )
 
         print(f"\rLightning Links Updated! {time() - start_time}")
         print("Saving Similarities...", end="")
         self.file_handler.save_similar_notes(notes)
+        self.save_refresh_state(
+            notes, [EmbeddingCache.content_hash(body) for body in bodies]
+        )
         print(f"\rSimilarities Saved! {time() - start_time}")
         print(f"Files Updated! {time() - start_time}")
 
@@ -219,10 +645,31 @@ if __name__ == "__main__":
 
     # get directory
 
+    if "--help" in arguments or "-h" in arguments:
+        # printed before anything is loaded, so this returns immediately
+        print(
+            "Usage: python -m src.lightning_links_creator [dir] [--incremental] [--watch]\n\n"
+            "  dir            the vault to link, asked for if not given\n"
+            "  --incremental  only rewrite notes affected by changes since the last run\n"
+            "  --watch        keep running and update links as notes are saved"
+        )
+        sys.exit(0)
+
     # argument mode
+    # only rewrite notes affected by changes since the last run
+    incremental = INCREMENTAL_REFRESH
+    if "--incremental" in arguments:
+        arguments.remove("--incremental")
+        incremental = True
+
+    # keep running and update links as notes are saved
+    watch = "--watch" in arguments
+    if watch:
+        arguments.remove("--watch")
+
     if len(arguments) > 1:
         # arguments are to be passed in as
-        # python lightning_links_creator.py [dir]
+        # python lightning_links_creator.py [dir] [--incremental] [--watch]
         note_directory = arguments[1]
 
     else:
@@ -239,4 +686,10 @@ if __name__ == "__main__":
     creator = LightningLinksCreator(
         note_directory,
     )
-    creator.refresh_similarities()
+    try:
+        if watch:
+            VaultWatcher(creator).run()
+        else:
+            creator.refresh_similarities(incremental)
+    finally:
+        creator.close()
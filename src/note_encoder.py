@@ -0,0 +1,503 @@
+import os
+import re
+from concurrent.futures import ThreadPoolExecutor
+from time import time
+
+import numpy as np
+
+from src.constants import (
+    CHUNK_OVERLAP,
+    CHUNK_POOLING,
+    ENCODE_BATCH_SIZE,
+    ENCODE_MAX_SEQ_LENGTH,
+    ENCODE_PROCESSES,
+    ENCODE_TORCH_THREADS,
+    ENCODE_WORKERS,
+    KEEP_CHUNK_EMBEDDINGS,
+)
+
+# a Markdown heading, which is where a long note is preferably split into chunks
+HEADING_PATTERN = re.compile(r"^#{1,6}[^\S\n]", re.MULTILINE)
+CHUNK_POOLING_METHODS = ("mean", "max", "none")
+
+
+class NoteEncoder:
+    def __init__(
+        self,
+        model,
+        batch_size: int = ENCODE_BATCH_SIZE,
+        max_seq_length: int = ENCODE_MAX_SEQ_LENGTH,
+        num_workers: int = ENCODE_WORKERS,
+        torch_threads: int = ENCODE_TORCH_THREADS,
+        chunk_pooling: str = CHUNK_POOLING,
+        chunk_overlap: int = CHUNK_OVERLAP,
+        keep_chunk_embeddings: bool = KEEP_CHUNK_EMBEDDINGS,
+        num_processes: int = ENCODE_PROCESSES,
+    ):
+        """
+        Encodes note bodies in batches of similar token length.
+
+        Passing a vault of mixed-length notes straight to `SentenceTransformer.encode` pads every
+        short note in a batch up to the longest one. The encoder instead counts the tokens of every
+        body, sorts the bodies by that count and cuts the sorted list into batches that each hold
+        at most `batch_size * max_seq_length` padded tokens. Batches of short notes therefore hold
+        many notes while batches of long notes hold few, and little time is spent on padding.
+
+        Notes longer than the model's maximum sequence length are split into chunks, preferably at
+        headings and otherwise into overlapping token windows. The chunks of every note are encoded
+        together with all other notes in the same batched pass and pooled back into one vector
+        per note. With pooling turned off, long notes are truncated by the model instead, which is
+        counted and reported rather than happening silently.
+
+        With more than one process, the texts are sorted by length and sharded across a pool of
+        CPU worker processes started with the model's multi-process pool. The pool is started on
+        first use and kept until `stop_pool` is called, so long-running modes reuse it.
+
+        Attributes:
+            model (SentenceTransformer): The model used to encode the bodies.
+            batch_size (int): The number of full-length notes per batch, which sets the token
+                budget of every batch.
+            max_seq_length (int): The number of tokens a note is truncated to.
+            num_workers (int): The number of threads used to count tokens.
+            chunk_pooling (str): How chunk vectors are combined: "mean" (weighted by the tokens in
+                each chunk), "max", or "none" to truncate long notes instead of chunking them.
+            chunk_overlap (int): The number of tokens shared by consecutive token windows, at most
+                half a window.
+            keep_chunk_embeddings (bool): Whether the chunk vectors of the last call to `encode`
+                are kept for finer-grained matching.
+            chunk_embeddings (np.ndarray | None): The vector of every chunk encoded by the last call
+                to `encode`, if kept.
+            chunk_owners (np.ndarray | None): The position of the text each kept chunk belongs to.
+            tokens (int): The number of tokens encoded during the last call to `encode`.
+            truncated (int): The number of notes truncated during the last call to `encode`.
+            chunked (int): The number of notes split into chunks during the last call to `encode`.
+            seconds (float): The time taken by the last call to `encode`.
+            num_processes (int): The number of worker processes used to encode, 1 or less encodes
+                in this process.
+            pool (dict | None): The running multi-process pool, if started.
+
+        Args:
+            model: A loaded SentenceTransformer model.
+            batch_size: The number of full-length notes per batch.
+            max_seq_length: The number of tokens a note is truncated to. 0 keeps the model's own
+                limit, and larger values are capped at it.
+            num_workers: The number of threads used to count tokens.
+            torch_threads: The number of threads torch uses on the CPU. 0 keeps torch's default.
+            chunk_pooling: How chunk vectors are combined, see the attributes.
+            chunk_overlap: The number of tokens shared by consecutive token windows.
+            keep_chunk_embeddings: Whether the chunk vectors are kept after encoding.
+            num_processes: The number of worker processes used to encode.
+
+        Raises:
+            ValueError: If `chunk_pooling` is not a known pooling method.
+        """
+        if chunk_pooling not in CHUNK_POOLING_METHODS:
+            raise ValueError(
+                f"Unknown chunk pooling {chunk_pooling!r}, expected one of {CHUNK_POOLING_METHODS}"
+            )
+
+        self.model = model
+        self.batch_size = max(1, batch_size)
+        self.num_workers = max(1, num_workers)
+
+        model_limit = getattr(model, "max_seq_length", None) or max_seq_length
+        if max_seq_length > 0:
+            model_limit = min(model_limit, max_seq_length)
+            model.max_seq_length = model_limit
+        self.max_seq_length = model_limit
+
+        if torch_threads > 0:
+            # only needed when overriding the default, and torch is loaded with the model anyway
+            import torch
+
+            torch.set_num_threads(torch_threads)
+
+        self.chunk_pooling = chunk_pooling
+        self.chunk_overlap = max(0, chunk_overlap)
+        self.keep_chunk_embeddings = keep_chunk_embeddings
+        self.chunk_embeddings = None
+        self.chunk_owners = None
+
+        self.num_processes = num_processes
+        self.pool = None
+
+        self.tokens = 0
+        self.truncated = 0
+        self.chunked = 0
+        self.seconds = 0.0
+
+    def start_pool(self):
+        """
+        Starts the pool of worker processes if it isn't running yet.
+
+        Every worker runs a copy of the model on the CPU. Unless `OMP_NUM_THREADS` is already set,
+        the workers split the CPU cores between them instead of each using all of them.
+
+        Returns:
+            dict: The running pool.
+        """
+        if self.pool is None:
+            os.environ.setdefault(
+                "OMP_NUM_THREADS",
+                str(max(1, (os.cpu_count() or 1) // self.num_processes)),
+            )
+            self.pool = self.model.start_multi_process_pool(
+                ["cpu"] * self.num_processes
+            )
+
+        return self.pool
+
+    def stop_pool(self):
+        """
+        Stops the pool of worker processes, if it is running.
+
+        Returns:
+            None
+        """
+        if self.pool is not None:
+            self.model.stop_multi_process_pool(self.pool)
+            self.pool = None
+
+    @property
+    def settings_tag(self) -> str:
+        """
+        Describes the settings that change the vector produced for a note, so that stored
+        embeddings can be discarded when they change.
+        """
+        tag = f"max_seq_length={self.max_seq_length}"
+        if self.chunk_pooling != "none":
+            tag += f";chunks={self.chunk_pooling},overlap={self.chunk_overlap}"
+
+        return tag
+
+    @property
+    def tokens_per_second(self) -> float:
+        """
+        Returns the number of tokens encoded per second during the last call to `encode`.
+        """
+        return self.tokens / self.seconds if self.seconds > 0 else 0.0
+
+    def count_tokens(self, texts: list[str]) -> np.ndarray:
+        """
+        Counts the tokens of every text, including the special tokens added by the model, before
+        truncation.
+
+        Args:
+            texts (list[str]): The texts to count.
+
+        Returns:
+            np.ndarray: The int64 token count of each text.
+        """
+
+        def count(group):
+            input_ids = self.model.tokenizer(
+                group,
+                add_special_tokens=True,
+                truncation=False,
+                return_attention_mask=False,
+                verbose=False,
+            )["input_ids"]
+            return [len(ids) for ids in input_ids]
+
+        group_size = max(1, -(-len(texts) // self.num_workers))
+        groups = [
+            texts[start : start + group_size]
+            for start in range(0, len(texts), group_size)
+        ]
+        if len(groups) <= 1:
+            counts = [count(group) for group in groups]
+        else:
+            with ThreadPoolExecutor(max_workers=self.num_workers) as executor:
+                counts = list(executor.map(count, groups))
+
+        return np.array(
+            [length for group in counts for length in group], dtype=np.int64
+        )
+
+    def make_batches(self, lengths: np.ndarray) -> list[np.ndarray]:
+        """
+        Groups texts of similar length into batches that stay within the token budget.
+
+        Args:
+            lengths (np.ndarray): The token count of every text, after truncation.
+
+        Returns:
+            list[np.ndarray]: The positions of the texts in each batch, shortest texts first.
+        """
+        order = np.argsort(lengths, kind="stable")
+        token_budget = self.batch_size * self.max_seq_length
+
+        batches = []
+        start = 0
+        while start < len(order):
+            stop = start + 1
+            # the batch is padded to its last (longest) text, so grow it while that fits
+            while (
+                stop < len(order)
+                and (stop - start + 1) * max(1, lengths[order[stop]]) <= token_budget
+            ):
+                stop += 1
+            batches.append(order[start:stop])
+            start = stop
+
+        return batches
+
+    def split_text(self, text: str, offsets: list, num_special_tokens: int) -> list:
+        """
+        Splits a note that is too long for the model into chunks that each fit in one sequence.
+
+        Consecutive sections between headings are packed into the same chunk while they fit, and
+        sections that are too long on their own are cut into windows that overlap by
+        `chunk_overlap` tokens.
+
+        Args:
+            text (str): The note body.
+            offsets (list): The (start, end) character offsets of every token in the text, without
+                special tokens.
+            num_special_tokens (int): The number of special tokens the model adds to a sequence.
+
+        Returns:
+            list[tuple[str, int]]: The text of every chunk and its token count, including special
+                tokens.
+        """
+        num_tokens = len(offsets)
+        window = max(1, self.max_seq_length - num_special_tokens)
+        # windows overlapping by more than half would encode most tokens several times
+        stride = max(1, window - min(self.chunk_overlap, window // 2))
+
+        # token positions where a section starts
+        token_starts = np.array([start for start, _ in offsets])
+        headings = [match.start() for match in HEADING_PATTERN.finditer(text)]
+        boundaries = sorted(
+            set(np.searchsorted(token_starts, headings).tolist()) | {num_tokens}
+        )
+
+        spans = []
+        chunk_start = 0
+        chunk_end = 0
+        for section_end in boundaries:
+            # the section doesn't fit in the current chunk, so close the chunk before it
+            if section_end - chunk_start > window and chunk_end > chunk_start:
+                spans.append((chunk_start, chunk_end))
+                chunk_start = chunk_end
+
+            # a single section longer than the window is cut into overlapping windows
+            while section_end - chunk_start > window:
+                spans.append((chunk_start, chunk_start + window))
+                chunk_start += stride
+
+            chunk_end = section_end
+        if chunk_end > chunk_start:
+            spans.append((chunk_start, chunk_end))
+
+        return [
+            (
+                text[offsets[start][0] : offsets[end - 1][1]],
+                end - start + num_special_tokens,
+            )
+            for start, end in spans
+        ]
+
+    def split_long_notes(self, texts: list[str], lengths: np.ndarray):
+        """
+        Replaces every text that is too long for the model with its chunks.
+
+        Args:
+            texts (list[str]): The texts to encode.
+            lengths (np.ndarray): The token count of every text, including special tokens.
+
+        Returns:
+            tuple[list[str], np.ndarray, np.ndarray]: The text of every chunk, the position of
+                the text each chunk belongs to, and the token count of every chunk.
+        """
+        long_positions = np.nonzero(lengths > self.max_seq_length)[0].tolist()
+        self.chunked = len(long_positions)
+        if not long_positions:
+            return texts, np.arange(len(texts)), lengths
+
+        # tokenize every long note in one call to find where its tokens are in the text
+        offset_mappings = self.model.tokenizer(
+            [texts[position] for position in long_positions],
+            add_special_tokens=False,
+            truncation=False,
+            return_offsets_mapping=True,
+            return_attention_mask=False,
+            verbose=False,
+        )["offset_mapping"]
+        chunks_by_position = {
+            position: self.split_text(
+                texts[position], offsets, int(lengths[position]) - len(offsets)
+            )
+            for position, offsets in zip(long_positions, offset_mappings)
+        }
+
+        chunk_texts = []
+        owners = []
+        chunk_lengths = []
+        for position, text in enumerate(texts):
+            for chunk_text, length in chunks_by_position.get(
+                position, [(text, lengths[position])]
+            ):
+                chunk_texts.append(chunk_text)
+                owners.append(position)
+                chunk_lengths.append(length)
+
+        return (
+            chunk_texts,
+            np.array(owners, dtype=np.int64),
+            np.array(chunk_lengths, dtype=np.int64),
+        )
+
+    def pool_chunks(
+        self,
+        vectors: np.ndarray,
+        owners: np.ndarray,
+        lengths: np.ndarray,
+        num_texts: int,
+    ) -> np.ndarray:
+        """
+        Combines the vectors of every text's chunks into a single vector per text.
+
+        Args:
+            vectors (np.ndarray): The vector of every chunk.
+            owners (np.ndarray): The position of the text each chunk belongs to.
+            lengths (np.ndarray): The token count of every chunk, used to weight the mean.
+            num_texts (int): The number of texts.
+
+        Returns:
+            np.ndarray: A float32 matrix with one vector per text.
+        """
+        if len(vectors) == num_texts:
+            # no text was split, so every chunk is a whole text
+            return vectors
+
+        if self.chunk_pooling == "max":
+            pooled = np.full((num_texts, vectors.shape[1]), -np.inf, dtype=np.float32)
+            np.maximum.at(pooled, owners, vectors)
+            return pooled
+
+        weights = np.maximum(lengths, 1).astype(np.float32)
+        pooled = np.zeros((num_texts, vectors.shape[1]), dtype=np.float32)
+        np.add.at(pooled, owners, vectors * weights[:, None])
+
+        return pooled / np.bincount(owners, weights, minlength=num_texts)[
+            :, None
+        ].astype(np.float32)
+
+    def encode_batches(
+        self, texts: list[str], lengths: np.ndarray, show_progress_bar: bool
+    ):
+        """
+        Encodes texts in length-sorted batches and returns their embeddings in the original order.
+
+        Args:
+            texts (list[str]): The texts to encode.
+            lengths (np.ndarray): The token count of every text, after truncation.
+            show_progress_bar (bool): Whether to print the progress while encoding.
+
+        Returns:
+            np.ndarray | None: A float32 matrix with one embedding per text, or None if there
+                were no texts.
+        """
+        if self.num_processes > 1 and len(texts) > self.batch_size:
+            return self.encode_with_pool(texts, lengths)
+
+        embeddings = None
+        encoded = 0
+        for batch in self.make_batches(lengths):
+            vectors = np.asarray(
+                self.model.encode(
+                    [texts[position] for position in batch],
+                    batch_size=len(batch),
+                    show_progress_bar=False,
+                ),
+                dtype=np.float32,
+            )
+            if embeddings is None:
+                embeddings = np.empty((len(texts), vectors.shape[1]), dtype=np.float32)
+            embeddings[batch] = vectors
+
+            encoded += len(batch)
+            if show_progress_bar:
+                print(f"\rEncoded {encoded} of {len(texts)} sequences", end="")
+
+        return embeddings
+
+    def encode_with_pool(self, texts: list[str], lengths: np.ndarray) -> np.ndarray:
+        """
+        Encodes texts across the pool of worker processes and returns their embeddings in the
+        original order.
+
+        The texts are sent in order of length, so every shard a worker receives holds texts of
+        similar length and its batches need little padding. Each worker gets several shards to
+        keep the workers busy when some shards take longer than others.
+
+        Args:
+            texts (list[str]): The texts to encode.
+            lengths (np.ndarray): The token count of every text, after truncation.
+
+        Returns:
+            np.ndarray: A float32 matrix with one embedding per text.
+        """
+        order = np.argsort(lengths, kind="stable")
+        shard_size = max(1, -(-len(texts) // (self.num_processes * 4)))
+
+        vectors = np.asarray(
+            self.model.encode_multi_process(
+                [texts[position] for position in order],
+                self.start_pool(),
+                batch_size=self.batch_size,
+                chunk_size=shard_size,
+            ),
+            dtype=np.float32,
+        )
+        embeddings = np.empty_like(vectors)
+        embeddings[order] = vectors
+
+        return embeddings
+
+    def encode(self, texts: list[str], show_progress_bar: bool = True) -> np.ndarray:
+        """
+        Encodes texts in length-sorted batches and returns their embeddings in the original order.
+        Texts that are too long for the model are chunked and pooled unless pooling is "none".
+
+        Args:
+            texts (list[str]): The texts to encode.
+            show_progress_bar (bool): Whether to print the progress and throughput while encoding.
+
+        Returns:
+            np.ndarray: A float32 matrix with one embedding per text.
+        """
+        start_time = time()
+        texts = list(texts)
+        lengths = self.count_tokens(texts)
+
+        if self.chunk_pooling == "none":
+            self.chunked = 0
+            chunk_texts, owners, chunk_lengths = texts, np.arange(len(texts)), lengths
+        else:
+            chunk_texts, owners, chunk_lengths = self.split_long_notes(texts, lengths)
+
+        self.truncated = int(
+            np.unique(owners[chunk_lengths > self.max_seq_length]).size
+        )
+        chunk_lengths = np.minimum(chunk_lengths, self.max_seq_length)
+        self.tokens = int(chunk_lengths.sum())
+
+        vectors = self.encode_batches(chunk_texts, chunk_lengths, show_progress_bar)
+        self.seconds = time() - start_time
+        if vectors is None:
+            dimensions = self.model.get_sentence_embedding_dimension()
+            vectors = np.empty((0, dimensions), dtype=np.float32)
+
+        self.chunk_embeddings = vectors if self.keep_chunk_embeddings else None
+        self.chunk_owners = owners if self.keep_chunk_embeddings else None
+
+        if show_progress_bar and texts:
+            print(
+                f"\rEncoded {len(texts)} notes, {self.tokens} tokens "
+                f"({self.tokens_per_second:.0f} tokens/sec), chunked: {self.chunked}, "
+                f"truncated: {self.truncated}"
+            )
+
+        return self.pool_chunks(vectors, owners, chunk_lengths, len(texts))
@@ -1,7 +1,13 @@
 import json
 import os
 import re
+import tempfile
+from collections.abc import MutableMapping
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from fnmatch import fnmatch
+from functools import partial
 from pathlib import Path
+from typing import NamedTuple
 
 from src.constants import (
     NOTE_EXTENSION,
@@ -12,11 +18,160 @@ from src.constants import (
     LINK_END,
     YAML_INDICATOR,
     TAG_INDICATOR,
+    NOTE_LOADER,
+    NOTE_LOADER_WORKERS,
+    NOTE_LOADER_CHUNK_SIZE,
+    IGNORE_PATTERNS,
+    OBSIDIAN_DIRECTORY,
+    CACHE_DIRECTORY,
+    SIMILAR_NOTES_JSON,
+    WRITE_BACK_WORKERS,
+    WRITE_BACK_FSYNC,
 )
+from src.parse_cache import PARSE_CACHE
+from src.similar_notes_store import SimilarNotesStore
+
+# a line that is the lightning links header once surrounding whitespace is stripped
+LIGHTNING_LINKS_HEADER_PATTERN = re.compile(
+    rf"^[^\S\n]*{re.escape(LIGHTNING_LINKS_HEADER)}[^\S\n]*$", re.MULTILINE
+)
+# a line that is empty once surrounding whitespace is stripped
+BLANK_LINE_PATTERN = re.compile(r"^[^\S\n]*$", re.MULTILINE)
+
+
+class WriteBackReport(NamedTuple):
+    """
+    The outcome of writing lightning links back to a batch of notes.
+
+    Attributes:
+        files_written (list[str]): The notes whose content changed and were rewritten.
+        bytes_written (int): The total size of the rewritten notes.
+        files_unchanged (int): The notes skipped because their content was already up to date.
+    """
+
+    files_written: list[str]
+    bytes_written: int
+    files_unchanged: int
+
+
+class Note(MutableMapping):
+    """
+    A compact record of a parsed note.
+
+    Each section is stored in a slot rather than in a per-note dictionary, which keeps the memory
+    used per note low when a whole vault is loaded. The record also behaves like the dictionary
+    parse_note used to return, so callers can keep using `note["body"]`, add keys such as
+    "file_name" and "similar_notes", and check for keys with `in`.
+
+    Attributes:
+        YAML (str): The YAML frontmatter, including its `---` lines.
+        links (str): The links at the top of the note (as a newline-separated string).
+        tags (str): The tags following the links.
+        body (str): The main content, excluding the lightning links section.
+        smart_links (str): The lightning links section content, if any.
+        file_name (str | None): The file the note was parsed from, once set.
+        similar_notes (list | None): The note's similar notes, once set.
+    """
+
+    __slots__ = (
+        "YAML",
+        "body",
+        "extra",
+        "file_name",
+        "links",
+        "similar_notes",
+        "smart_links",
+        "tags",
+    )
+
+    # fields that only count as present once they have been set
+    OPTIONAL_FIELDS = ("file_name", "similar_notes")
+    FIELDS = ("links", "tags", "body", "smart_links", "YAML") + OPTIONAL_FIELDS
+
+    def __init__(
+        self,
+        YAML: str = "",
+        links: str = "",
+        tags: str = "",
+        body: str = "",
+        smart_links: str = "",
+        file_name: str = None,
+        similar_notes: list = None,
+    ):
+        self.YAML = YAML
+        self.links = links
+        self.tags = tags
+        self.body = body
+        self.smart_links = smart_links
+        self.file_name = file_name
+        self.similar_notes = similar_notes
+        # any other keys a caller stores on the note, created on first use
+        self.extra = None
+
+    def __getitem__(self, key):
+        if key in self.FIELDS:
+            value = getattr(self, key)
+            if value is not None:
+                return value
+        elif self.extra is not None and key in self.extra:
+            return self.extra[key]
+
+        raise KeyError(key)
+
+    def __setitem__(self, key, value):
+        if key in self.FIELDS:
+            setattr(self, key, value)
+        else:
+            if self.extra is None:
+                self.extra = {}
+            self.extra[key] = value
+
+    def __delitem__(self, key):
+        if key in self.OPTIONAL_FIELDS and getattr(self, key) is not None:
+            setattr(self, key, None)
+        elif self.extra is not None and key in self.extra:
+            del self.extra[key]
+        else:
+            raise KeyError(key)
+
+    def __iter__(self):
+        for key in self.FIELDS:
+            if getattr(self, key) is not None:
+                yield key
+        if self.extra is not None:
+            yield from self.extra
+
+    def __len__(self):
+        return sum(1 for _ in self)
+
+    def __repr__(self):
+        return f"Note({dict(self)!r})"
+
+    def copy(self):
+        """
+        Returns a copy of the note whose similar notes and extra keys can be changed without
+        changing this note.
+
+        Returns:
+            Note: The copy.
+        """
+        note = Note(
+            self.YAML,
+            self.links,
+            self.tags,
+            self.body,
+            self.smart_links,
+            self.file_name,
+            None if self.similar_notes is None else list(self.similar_notes),
+        )
+        if self.extra is not None:
+            note.extra = dict(self.extra)
+
+        return note
 
 
 class FileParser:
-    def __init__(self, notes_directory: str):
+    def __init__(self, notes_directory: str, ignore_patterns: list[str] = None):
         """
         Represents a class that initializes and manages note-related attributes like file names,
         note names, and similar notes from a specified directory. It supports loading and maintaining
@@ -26,239 +181,489 @@ class FileParser:
             notes_directory (str): The directory path where note-related files are stored.
             similar_notes: A list or data structure containing similar notes, initialized and
                 populated using the `load_similar_notes` method.
-            file_names: A list containing names of note-related files from the directory,
-                populated using the `load_file_names` method.
+            file_names: A list containing names of note-related files from the directory and its
+                subfolders, populated using the `scan_vault` method.
             note_names: A list of note names intended for uses like embeddings, populated using
-                the `load_note_names` method.
+                the `scan_vault` method.
+            file_stats: Maps each file name to the os.stat_result seen while scanning the vault,
+                so callers can check for changes without statting every note again.
+            folder_mtimes: Maps each folder searched, relative to the vault, to its modification
+                time when it was listed, so `rescan_vault` can tell when notes were added,
+                removed or renamed.
+            ignore_patterns: Glob patterns for folders and files that are not searched for notes.
 
         Args:
             notes_directory: The directory path where note-related files are stored.
+            ignore_patterns: Glob patterns for folders and files to skip, matched against both
+                the name and the path relative to the vault. `.obsidian` is always skipped.
 
         """
         self.notes_directory = Path(notes_directory).as_posix().rstrip("/") + "/"
         self.similar_notes = self.load_similar_notes()
+        self.ignore_patterns = list(
+            IGNORE_PATTERNS if ignore_patterns is None else ignore_patterns
+        )
 
         # these are useful for cases when file data needs to be loaded
         self.file_names = []
-        self.load_file_names()
+        self.file_stats = {}
+        self.folder_mtimes = {}
 
         # Note names are more useful LLM functionality as they are better for embeddings
         self.note_names = []
-        self.load_note_names()
 
-    def load_file_names(self):
+        # both lists come from the same walk over the vault
+        self.scan_vault()
+
+    def is_ignored(self, name: str, relative_path: str) -> bool:
         """
-        Loads file names from the specified notes directory. Filters files based on specific
-        extensions, ensuring that only relevant Markdown files are included.
+        Checks whether a folder or file should be skipped when searching the vault for notes.
 
-        The method clears the existing list of file names, iterates through the content of
-        the directory, and populates the list with eligible file names. Additionally, it
-        supports returning the list of file names directly.
+        Args:
+            name (str): The name of the folder or file.
+            relative_path (str): Its posix-style path relative to the vault.
 
         Returns:
-            list: A list of file names that match the specified criteria.
+            bool: True if it is the `.obsidian` folder or matches one of the ignore patterns.
         """
-        # clear the file names just in case
-        self.file_names = []
-        # loop through the directory and find all notes
-        for filename in os.listdir(self.notes_directory):
-            # Process Markdown files only and exclude similar files that also end with '.md'
-            if filename.endswith(NOTE_EXTENSION) and not filename.endswith(
-                EXCLUSIVE_EXTENSION
-            ):
+        if name == OBSIDIAN_DIRECTORY:
+            return True
+
+        return any(
+            fnmatch(name, pattern) or fnmatch(relative_path, pattern)
+            for pattern in self.ignore_patterns
+        )
+
+    def scan_vault(self):
+        """
+        Walks the notes directory and its subfolders once with `os.scandir`, collecting every
+        Markdown note along with its file status.
+
+        Folders are searched depth first and entries are sorted by name, so notes always come back
+        in the same order. The `.obsidian` folder, anything matching the ignore patterns and
+        symlinked folders are skipped. The file names, note names and file stats of the instance
+        are all replaced with the results of this walk.
+
+        Returns:
+            list: The file names of every note found.
+        """
+        file_names = []
+        note_names = []
+        file_stats = {}
+        folder_mtimes = {}
+
+        # each entry is a folder to search, given as its posix-style path relative to the vault
+        folders = [""]
+        while folders:
+            folder = folders.pop()
+            try:
+                # taken before listing, so a change made while listing is seen by the next rescan
+                folder_mtimes[folder] = os.stat(
+                    f"{self.notes_directory}{folder}"
+                ).st_mtime_ns
+                with os.scandir(f"{self.notes_directory}{folder}") as iterator:
+                    entries = sorted(iterator, key=lambda entry: entry.name)
+            except (FileNotFoundError, NotADirectoryError, PermissionError):
+                continue
+
+            subfolders = []
+            for entry in entries:
+                relative_path = f"{folder}{entry.name}"
+                if self.is_ignored(entry.name, relative_path):
+                    continue
+
+                try:
+                    if entry.is_dir(follow_symlinks=False):
+                        subfolders.append(f"{relative_path}/")
+                        continue
+
+                    # Process Markdown files only and exclude similar files that also end with '.md'
+                    if not entry.name.endswith(NOTE_EXTENSION) or entry.name.endswith(
+                        EXCLUSIVE_EXTENSION
+                    ):
+                        continue
+
+                    stat_result = entry.stat()
+                except FileNotFoundError:
+                    # the file was removed while the vault was being scanned
+                    continue
+
                 # create a stable posix-style relative path string
-                joined = f"{self.notes_directory}{filename}"
-                self.file_names.append(joined)
+                file_name = f"{self.notes_directory}{relative_path}"
+                file_names.append(file_name)
+                note_names.append(entry.name[: -len(NOTE_EXTENSION)])
+                file_stats[file_name] = stat_result
+
+            # search subfolders in name order once this folder is done
+            folders.extend(reversed(subfolders))
+
+        self.file_names = file_names
+        self.note_names = note_names
+        self.file_stats = file_stats
+        self.folder_mtimes = folder_mtimes
 
-        # if called by an outside program, it may be nice to immediately return the file_names
         return self.file_names
 
+    def rescan_vault(self) -> bool:
+        """
+        Brings the file stats up to date, walking the vault again with `scan_vault` only when
+        needed. Adding, removing or renaming a note changes the modification time of its folder,
+        so while no folder has changed, the notes are the same and only need to be statted again.
+        That skips listing every folder, which matters when the vault is checked repeatedly.
+
+        Returns:
+            bool: True if the vault was walked again, False if only the known notes were statted.
+        """
+        try:
+            unchanged = bool(self.folder_mtimes) and all(
+                os.stat(f"{self.notes_directory}{folder}").st_mtime_ns == mtime_ns
+                for folder, mtime_ns in self.folder_mtimes.items()
+            )
+            if unchanged:
+                self.file_stats = {
+                    file_name: os.stat(file_name) for file_name in self.file_names
+                }
+                return False
+        except FileNotFoundError:
+            # a folder or note went away, which the walk will pick up
+            pass
+
+        self.scan_vault()
+
+        return True
+
+    def get_file_stat(self, file_name: str) -> os.stat_result:
+        """
+        Returns the file status of a note as seen by the last scan of the vault, falling back to
+        `os.stat` for files the scan did not see.
+
+        Args:
+            file_name (str): Path of the note.
+
+        Returns:
+            os.stat_result: The note's file status.
+        """
+        stat_result = self.file_stats.get(file_name)
+
+        return os.stat(file_name) if stat_result is None else stat_result
+
+    def load_file_names(self):
+        """
+        Loads file names from the specified notes directory and its subfolders. Filters files
+        based on specific extensions, ensuring that only relevant Markdown files are included.
+
+        The vault is rescanned with `scan_vault`, which also refreshes the note names and file
+        stats. Additionally, it supports returning the list of file names directly.
+
+        Returns:
+            list: A list of file names that match the specified criteria.
+        """
+        # if called by an outside program, it may be nice to immediately return the file_names
+        return self.scan_vault()
+
     def load_note_names(self):
         """
-        Loads all note names from the specified notes directory into the instance.
+        Loads all note names from the specified notes directory and its subfolders into the
+        instance.
 
-        This method iterates through the directory specified by `self.notes_directory`
-        and extracts the names of files with a specific extension defined by
-        `NOTE_EXTENSION`. If a file also ends with `EXCLUSIVE_EXTENSION`, it will
-        be ignored. The extracted note names are added to the `note_names`
-        attribute of the instance. This method also returns the list of
-        note names, enabling its use by external programs.
+        The vault is rescanned with `scan_vault`, and the note names are the file names of the
+        notes found without their folders or the `NOTE_EXTENSION`. This method also returns the
+        list of note names, enabling its use by external programs.
 
         Returns:
             list: A list of note names derived from the valid file names in the
             notes directory.
         """
-        # clear the note names just in case
-        self.note_names = []
-
-        # loop through the notes directory and get all note names
-        for filename in os.listdir(self.notes_directory):
-            # Process Markdown files only and exclude similar files that also end with '.md'
-            if filename.endswith(NOTE_EXTENSION) and not filename.endswith(
-                EXCLUSIVE_EXTENSION
-            ):
-                filename = filename.replace(NOTE_EXTENSION, "")
-                self.note_names.append(filename)
+        self.scan_vault()
 
         # return note names for a case when it's called by an outside program
         return self.note_names
 
-    def ensure_proper_endings(self):
+    @staticmethod
+    def text_has_proper_ending(text: str) -> bool:
         """
-        Ensures proper formatting of Markdown files in the specified notes_directory. This function checks if the Markdown
-        files in the notes_directory end properly with an empty line so that if they don't have existing lightning links
-        sections in the notes, there will be a proper place for them. If the formatting conditions are not met, it appends a
-        trailing empty line to the file.
+        Checks whether a note's text ends properly, so that a lightning links section can be
+        appended to it. A note ends properly if it is empty, ends with a new line, or its last
+        line is the lightning links following the `LIGHTNING_LINKS_HEADER`.
 
+        Args:
+            text (str): The note's text, or the end of it including its last two lines.
 
-        :return: None
+        Returns:
+            bool: True if the note doesn't need a trailing new line.
         """
+        if not text or text.endswith("\n"):
+            return True
 
-        def check_last_two_lines(lines):
-            # helper function that checks the last two lines of a file for proper formatting and returns a boolean
-            # indicating whether they need to be changed.
+        lines = text.split("\n")
 
-            # has header in the first line
-            if lines[0].strip() == LIGHTNING_LINKS_HEADER:
-                return False
+        return len(lines) >= 2 and lines[-2].strip() == LIGHTNING_LINKS_HEADER
 
-            # has new line at the end
-            elif lines[1][-1] == "\n":
-                return False
+    @staticmethod
+    def has_proper_ending(file_path: str) -> bool:
+        """
+        Checks whether a note file ends properly (see `text_has_proper_ending`) by seeking to its
+        end and only reading as much as its last two lines need, instead of the whole note.
 
-            return True
+        Args:
+            file_path (str): Path to the Markdown file to check.
 
-        # loop through all note files
-        for file_path in self.file_names:
-            # Read the file's contents
-            with open(file_path, "r", encoding=ENCODING) as file:
-                lines = file.readlines()
+        Returns:
+            bool: True if the note doesn't need a trailing new line.
+        """
+        with open(file_path, "rb") as file:
+            size = file.seek(0, os.SEEK_END)
+            tail_size = 256
+            while True:
+                tail_size = min(tail_size, size)
+                file.seek(size - tail_size)
+                tail = file.read(tail_size)
+                if tail.endswith((b"\n", b"\r")):
+                    return True
+                # the second to last line is only whole once a new line precedes it
+                if tail_size == size or tail.count(b"\n") >= 2:
+                    break
+                tail_size *= 4
+
+        text = tail.decode(ENCODING, errors="ignore")
+
+        return FileParser.text_has_proper_ending(
+            text.replace("\r\n", "\n").replace("\r", "\n")
+        )
+
+    def ensure_proper_endings(self, file_names: list[str] = None):
+        """
+        Ensures proper formatting of Markdown files in the specified notes_directory. This function checks if the Markdown
+        files in the notes_directory end properly with an empty line so that if they don't have existing lightning links
+        sections in the notes, there will be a proper place for them. If the formatting conditions are not met, it appends a
+        trailing empty line to the file. Only the end of each file is read.
+
+        Refreshes don't need to call this, `load_all_note_files` with `ensure_endings` fixes the
+        endings while parsing, so each note is only read once.
 
-            # Check if the file is not empty and does not end with an empty line, or if it's already formatted
-            if len(lines) != 0 and check_last_two_lines(lines[-2:]):
+        :param file_names: The files to check. Defaults to every file in `file_names`.
+        :type file_names: List[str]
+        :return: None
+        """
+        if file_names is None:
+            file_names = self.file_names
+
+        # loop through all note files
+        for file_path in file_names:
+            if not self.has_proper_ending(file_path):
                 # Append an empty line
                 with open(file_path, "a", encoding=ENCODING) as file:
                     file.write("\n")
 
     @staticmethod
-    def parse_note(file_path: str):
+    def parse_note(file_path: str, ensure_ending: bool = False) -> Note:
         """
         Parses the contents of a Markdown file to extract specific sections: links, tags, body, and smart links.
 
+        Parsed notes are kept in the process wide `PARSE_CACHE`, so a note whose modification time
+        and size haven't changed since it was last parsed is returned without being read again.
+
         Args:
             file_path (str): Path to the Markdown file to be parsed.
+            ensure_ending (bool): Whether to also append a trailing new line to the file if it
+                doesn't end properly, as `ensure_proper_endings` does, while it is being read.
 
         Returns:
-            dict: A dictionary containing the following keys:
+            Note: A note record, usable as a dictionary, with the following keys:
                 - 'links': Links extracted from the header (as a newline-separated string).
                 - 'tags': Tags extracted (prefixed with '#', as a single string).
                 - 'body': Main content of the file (excluding a smart links section).
                 - 'Smart_links': Smart Links section content (if any, otherwise empty string).
+                - 'YAML': YAML frontmatter (if any, otherwise empty string).
         """
+        use_cache = PARSE_CACHE.max_bytes > 0
+        cache_path = os.path.abspath(file_path)
+        if use_cache:
+            note = PARSE_CACHE.get(cache_path, os.stat(file_path))
+            # checking the ending of a cached note only needs the end of the file
+            if note is not None and not (
+                ensure_ending and not FileParser.has_proper_ending(file_path)
+            ):
+                return note
 
-        def is_tag(line):
-            # checks to see if a given line is a tag, this a more complex check, so it is broken into it's function
-            if line.startswith("#"):
-                # check to see if it's a header (which would have a space between the word andor multiple hashtags)
-                if line.startswith(TAG_INDICATOR + " "):  # H1 Header
-                    return False
-                elif line.startswith("##"):
-                    return False
+        with open(file_path, "r", encoding=ENCODING) as file:
+            # the stat of the open file matches the content read, even if it is saved meanwhile
+            stat_result = os.fstat(file.fileno())
+            text = file.read()
 
-                # all tests have been passed.
-                return True
-            else:
-                return False
+        if ensure_ending and not FileParser.text_has_proper_ending(text):
+            with open(file_path, "a", encoding=ENCODING) as file:
+                file.write("\n")
+                file.flush()
+                stat_result = os.fstat(file.fileno())
+            text += "\n"
 
-        # Dictionary to store the parsed note content
-        note_info = {"links": "", "tags": "", "body": "", "smart_links": "", "YAML": ""}
+        note = FileParser.parse_text(text)
+        if use_cache:
+            PARSE_CACHE.put(cache_path, stat_result, note)
 
-        # Open the file and iterate through its contents
-        with open(file_path, "r", encoding=ENCODING) as file:
-            current_line = file.readline()
-            # check for YAML and parse YAML if found
-
-            has_yaml = current_line.startswith(YAML_INDICATOR)
-            if has_yaml:
-                note_info["YAML"] += current_line
-                current_line = file.readline()
-                while current_line:
-                    # add line
-                    note_info["YAML"] += current_line
-                    # YAML is ended by a second YAML indicator
-                    if current_line.startswith(YAML_INDICATOR):
-                        # move to the next line now that YAML has been extracted
-                        current_line = file.readline()
-                        break
-
-                    # move to the next line
-                    current_line = file.readline()
-
-            # Parse links (header section)
-            # check for a links section and add to contents
-            has_links = current_line.startswith(LINK_START) and current_line.endswith(
-                LINK_END + "\n"
+        return note
+
+    @staticmethod
+    def parse_text(text: str) -> Note:
+        """
+        Parses the full text of a note in a single pass.
+
+        The short sections at the top of the note (YAML, links and tags) are walked line by line by
+        offset, while the end of the body and of the lightning links section are found with a single
+        search each. Every section is then taken as one slice of the text instead of being built up a
+        line at a time.
+
+        Args:
+            text (str): The contents of a Markdown note.
+
+        Returns:
+            Note: The parsed note, see parse_note.
+        """
+        note = Note()
+        length = len(text)
+        position = 0
+
+        def line_end(start):
+            # the offset just past the line starting at `start`
+            end = text.find("\n", start)
+            return length if end == -1 else end + 1
+
+        def is_link(start):
+            line = text[start : line_end(start)]
+            return line.startswith(LINK_START) and line.endswith(LINK_END + "\n")
+
+        def is_tag(start):
+            # checks to see if a given line is a tag, headers have a space after the hashtag or multiple hashtags
+            return (
+                text.startswith(TAG_INDICATOR, start)
+                and not text.startswith(TAG_INDICATOR + " ", start)
+                and not text.startswith("##", start)
             )
 
-            if has_links:
-                while current_line:
-                    if current_line.startswith(LINK_START) and current_line.endswith(
-                        LINK_END + "\n"
-                    ):
-                        note_info["links"] += current_line
-                    else:
-                        break  # Exit loop when we encounter a non-link line
-                    current_line = file.readline()
-
-            # if it has top links, skip the blank line kept between the top links and the tags
-            if has_links:
-                current_line = file.readline()
-
-            # Parse Tags
-            if is_tag(current_line):
-                while current_line:
-                    if is_tag(current_line):
-                        note_info["tags"] += current_line
-                    else:
-                        break
-                    current_line = file.readline()
-
-            # Parse body (main content)
-            while current_line:
-                # Stop if we reach the optional Smart Links section
-                if current_line.strip() == LIGHTNING_LINKS_HEADER:
-                    current_line = file.readline()
+        # check for YAML, which is ended by a second YAML indicator
+        if text.startswith(YAML_INDICATOR):
+            position = line_end(0)
+            while position < length:
+                is_end = text.startswith(YAML_INDICATOR, position)
+                position = line_end(position)
+                if is_end:
                     break
-                note_info["body"] += current_line
-                current_line = file.readline()
+            note.YAML = text[:position]
+
+        # Parse links (header section)
+        if is_link(position):
+            start = position
+            while position < length and is_link(position):
+                position = line_end(position)
+            note.links = text[start:position]
+
+            # skip the blank line kept between the top links and the tags
+            position = line_end(position)
+
+        # Parse Tags
+        start = position
+        while position < length and is_tag(position):
+            position = line_end(position)
+        note.tags = text[start:position]
+
+        # Parse body (main content), which stops at the optional Lightning Links section
+        header = LIGHTNING_LINKS_HEADER_PATTERN.search(text, position)
+        if header is None:
+            note.body = text[position:]
+            return note
+        note.body = text[position : header.start()]
+
+        # Parse smart links (optional section at the end), which stops at the first empty line
+        position = line_end(header.start())
+        blank_line = BLANK_LINE_PATTERN.search(text, position)
+        note.smart_links = text[
+            position : length if blank_line is None else blank_line.start()
+        ]
+
+        return note
 
-            # Parse smart links (optional section at the end)
-            while current_line:
-                if not current_line.strip():  # Stop at the first empty line
-                    break
-                note_info["smart_links"] += current_line
-                current_line = file.readline()
+    @staticmethod
+    def load_note_file(file_name: str, ensure_ending: bool = False):
+        """
+        Parses a single note and records the file it came from.
 
-        return note_info
+        Args:
+            file_name (str): Path to the Markdown file to be parsed.
+            ensure_ending (bool): Whether to also fix the note's ending, see `parse_note`.
 
-    def load_all_note_files(self):
+        Returns:
+            Note: The output of parse_note extended with a 'file_name' key.
+        """
+        file_content = FileParser.parse_note(file_name, ensure_ending)
+        file_content["file_name"] = file_name
+
+        return file_content
+
+    def load_all_note_files(
+        self,
+        file_names: list[str] = None,
+        loader: str = NOTE_LOADER,
+        ensure_endings: bool = False,
+    ):
         """
         Iterates through all Markdown (.md) files in a specified notes_directory and parses their contents.
 
+        Parsing can be spread over a pool of worker processes, which suits CPU bound parsing of local
+        vaults, or a pool of threads, which suits vaults on slow or network mounted drives where the time
+        is spent waiting on reads. Process workers receive the files in chunks of `NOTE_LOADER_CHUNK_SIZE`
+        to reduce the cost of sending work between processes. The results are always in the same order as
+        the file names.
+
+        Args:
+            file_names (list[str], optional): The files to parse. Defaults to every file in `file_names`.
+            loader (str): "serial", "process" or "thread". Defaults to `NOTE_LOADER`.
+            ensure_endings (bool): Whether to also append a trailing new line to notes that don't end
+                properly while they are read, replacing a separate `ensure_proper_endings` pass.
 
         Returns:
-            dict: A dictionary where each key is a Markdown file name, and its value is a parsed content
-                  dictionary (output of parse_note) extended with a 'file_name' key.
+            list: A list of parsed content dictionaries (output of parse_note) extended with a 'file_name'
+                key, one for each file name.
         """
 
-        all_files = []
+        if file_names is None:
+            file_names = self.file_names
+
+        load_note_file = partial(self.load_note_file, ensure_ending=ensure_endings)
+
+        # a pool costs more to start than it saves on small batches
+        if len(file_names) <= NOTE_LOADER_CHUNK_SIZE or NOTE_LOADER_WORKERS <= 1:
+            loader = "serial"
+
+        if loader == "process":
+            with ProcessPoolExecutor(max_workers=NOTE_LOADER_WORKERS) as executor:
+                notes = list(
+                    executor.map(
+                        load_note_file,
+                        file_names,
+                        chunksize=NOTE_LOADER_CHUNK_SIZE,
+                    )
+                )
+
+            # the workers filled their own caches, so share the results with this process. The
+            # stat is from before the read, so a note saved meanwhile is simply parsed again
+            if PARSE_CACHE.max_bytes > 0:
+                for file_name, note in zip(file_names, notes):
+                    parsed_note = note.copy()
+                    del parsed_note["file_name"]
+                    PARSE_CACHE.put(
+                        os.path.abspath(file_name),
+                        self.get_file_stat(file_name),
+                        parsed_note,
+                    )
 
-        for file_name in self.file_names:
-            file_content = self.parse_note(file_name)
-            file_content["file_name"] = file_name
-            all_files.append(file_content)
+            return notes
 
-        return all_files
+        if loader == "thread":
+            with ThreadPoolExecutor(max_workers=NOTE_LOADER_WORKERS) as executor:
+                return list(executor.map(load_note_file, file_names))
+
+        return [load_note_file(file_name) for file_name in file_names]
 
     @staticmethod
     def parse_inline_lightning_links(line: str) -> list[str]:
@@ -310,6 +715,10 @@ class FileParser:
             str: A formatted string of inline lightning links created based on the input
                 parameters.
         """
+        # a note without similar notes gets an empty line rather than an empty link
+        if not similar_notes[:num_lightning_links]:
+            return ""
+
         # join a specified number of similar notes into a line
         # format middle
         formatted_links = f"{LINK_END}     {LINK_START}".join(
@@ -406,6 +815,207 @@ class FileParser:
                 # fallback to the provided string
                 self.file_names.append(file_content["file_name"])
 
+    def render_lightning_links(
+        self, text: str, similar_notes: list[str], num_lightning_links: int
+    ) -> str:
+        """
+        Returns a note's text with its lightning links replaced by the given similar notes.
+
+        The line after the `LIGHTNING_LINKS_HEADER` is replaced with the formatted links, or the
+        header and links are appended to the end of the note if it has no lightning links section.
+        The rest of the note, including its line endings, is left as it is.
+
+        Args:
+            text (str): The note's current text.
+            similar_notes (list[str]): A list of similar notes that will be formatted as lightning
+                links.
+            num_lightning_links (int): The number of formatted lightning links to include.
+
+        Returns:
+            str: The note's new text, identical to `text` if the links are already up to date.
+        """
+        formatted_links = self.format_inline_lighting_links(
+            similar_notes, num_lightning_links
+        )
+
+        if not text:
+            return LIGHTNING_LINKS_HEADER + "\n" + formatted_links + "\n"
+
+        # split into lines that keep their line endings
+        lines = [line + "\n" for line in text.split("\n")]
+        lines[-1] = lines[-1][:-1]
+        if not lines[-1]:
+            lines.pop()
+
+        # Locate the Lightning Links header
+        for i, line in enumerate(lines):
+            if line.strip() == LIGHTNING_LINKS_HEADER:
+                if i + 1 < len(lines):  # Check for the next line
+                    if lines[i + 1].strip() == formatted_links:
+                        return text  # No updates required
+                    lines[i + 1] = formatted_links + "\n"
+                else:
+                    # If the Lightning Links header exists but no links line is found
+                    lines.append(formatted_links + "\n")
+                return "".join(lines)
+
+        # Append a Lightning Links section at the end of the file
+        if not lines[-1].endswith("\n"):
+            lines[-1] += "\n"  # Ensure a new line before appending
+        lines.append(LIGHTNING_LINKS_HEADER + "\n")
+        lines.append(formatted_links + "\n")
+
+        return "".join(lines)
+
+    @staticmethod
+    def write_atomically(
+        file_path: str, content: bytes, fsync: bool = WRITE_BACK_FSYNC
+    ):
+        """
+        Replaces a file's content so that a crash leaves either the old or the new content, never
+        a truncated note. The content is written to a temporary file next to the note, which then
+        replaces the note with `os.replace`. The note's permissions are kept. A symlinked note is
+        written through the link, replacing the file it points to and keeping the link.
+
+        Args:
+            file_path (str): The file to replace.
+            content (bytes): The file's new content.
+            fsync (bool): Whether to flush the new content to disk before replacing the note.
+
+        Returns:
+            None
+        """
+        # replace the file a symlink points to rather than the link itself
+        file_path = os.path.realpath(file_path)
+        directory, name = os.path.split(file_path)
+        # hidden, so Obsidian doesn't list it while it exists
+        file_descriptor, temp_path = tempfile.mkstemp(
+            prefix=f".{name}.", suffix=".tmp", dir=directory
+        )
+        try:
+            with os.fdopen(file_descriptor, "wb") as file:
+                file.write(content)
+                if fsync:
+                    file.flush()
+                    os.fsync(file.fileno())
+            os.chmod(temp_path, os.stat(file_path).st_mode)
+            os.replace(temp_path, file_path)
+        except BaseException:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+
+    def prepare_lightning_links(
+        self, file_path: str, similar_notes: list[str], num_lightning_links: int
+    ):
+        """
+        Reads a note and computes its content with updated lightning links, without writing it.
+
+        Args:
+            file_path (str): Path to the file that contains the notes and lightning links.
+            similar_notes (list[str]): A list of similar notes that will be formatted as lightning
+                links.
+            num_lightning_links (int): The number of formatted lightning links to include.
+
+        Returns:
+            bytes | None: The note's new content, or None if the note is already up to date.
+        """
+        try:
+            with open(file_path, "rb") as file:
+                content = file.read()
+        except FileNotFoundError:
+            content = None
+
+        text = "" if content is None else content.decode(ENCODING)
+        new_content = self.render_lightning_links(
+            text, similar_notes, num_lightning_links
+        ).encode(ENCODING)
+
+        # a missing note is always written, so it exists afterwards
+        if new_content == content:
+            return None
+
+        return new_content
+
+    def write_lightning_links(
+        self,
+        updates: list[tuple[str, list[str]]],
+        num_lightning_links: int,
+        max_workers: int = WRITE_BACK_WORKERS,
+        fsync: bool = WRITE_BACK_FSYNC,
+    ) -> WriteBackReport:
+        """
+        Updates or adds the lightning links of a batch of notes.
+
+        Every note's new content is computed first, notes whose content wouldn't change are
+        skipped, and only then are the changed notes written, each atomically with
+        `write_atomically`. Both stages run on a pool of at most `max_workers` threads. With
+        `fsync`, each note is flushed to disk before it replaces the old one, and every folder
+        holding a rewritten note is flushed once at the end so the renames are durable too.
+
+        Args:
+            updates (list[tuple[str, list[str]]]): The path of each note and its similar notes.
+            num_lightning_links (int): The number of formatted lightning links to include.
+            max_workers (int): The most threads used to read and write notes.
+            fsync (bool): Whether to flush the written notes to disk.
+
+        Returns:
+            WriteBackReport: The notes written, the bytes written, and the number of notes skipped.
+        """
+
+        def prepare(update):
+            file_path, similar_notes = update
+            return self.prepare_lightning_links(
+                file_path, similar_notes, num_lightning_links
+            )
+
+        def write(change):
+            file_path, content = change
+            if os.path.exists(file_path):
+                self.write_atomically(file_path, content, fsync)
+                return
+
+            # nothing can be lost by a crash while creating a note
+            Path(file_path).parent.mkdir(parents=True, exist_ok=True)
+            with open(file_path, "wb") as file:
+                file.write(content)
+
+        # a pool costs more to start than it saves on a single note
+        if len(updates) <= 1 or max_workers <= 1:
+            contents = [prepare(update) for update in updates]
+            changes = [
+                (update[0], content)
+                for update, content in zip(updates, contents)
+                if content is not None
+            ]
+            for change in changes:
+                write(change)
+        else:
+            with ThreadPoolExecutor(max_workers=max_workers) as executor:
+                contents = list(executor.map(prepare, updates))
+                changes = [
+                    (update[0], content)
+                    for update, content in zip(updates, contents)
+                    if content is not None
+                ]
+                list(executor.map(write, changes))
+
+        if fsync:
+            for directory in {
+                os.path.dirname(os.path.abspath(file_path)) for file_path, _ in changes
+            }:
+                directory_descriptor = os.open(directory, os.O_RDONLY)
+                try:
+                    os.fsync(directory_descriptor)
+                finally:
+                    os.close(directory_descriptor)
+
+        return WriteBackReport(
+            [file_path for file_path, _ in changes],
+            sum(len(content) for _, content in changes),
+            len(updates) - len(changes),
+        )
+
     def update_lighting_links(
         self, file_path: str, similar_notes: list[str], num_lightning_links: int
     ) -> bool:
@@ -415,7 +1025,8 @@ class FileParser:
         This function takes a file path and updates the list of lightning links if there are any
         changes required. If the `LIGHTNING_LINKS_HEADER` is not found in the file, it appends
         the header along with the appropriate lightning links section at the end of the file. The
-        function overwrites the file when updates are made.
+        file is replaced atomically when updates are made. Use `write_lightning_links` to update
+        many notes at once.
 
         Args:
             file_path (str): Path to the file that contains the notes and lightning links.
@@ -426,76 +1037,45 @@ class FileParser:
         Returns:
             bool: True if the file was updated, False if no updates were required.
         """
-        # takes in a note path and lightning link and adds/updates lightning links if changes have been made.
-
-        formatted_links = self.format_inline_lighting_links(
-            similar_notes, num_lightning_links
+        report = self.write_lightning_links(
+            [(file_path, similar_notes)], num_lightning_links
         )
 
-        # If the file doesn't exist, create it so subsequent operations succeed
-        p = Path(file_path)
-        if not p.exists():
-            parent_dir = p.parent
-            if parent_dir and not parent_dir.exists():
-                parent_dir.mkdir(parents=True, exist_ok=True)
-            # create empty file
-            p.write_text("", encoding=ENCODING)
-
-        with open(file_path, "r+", encoding=ENCODING) as file:
-            # Read the entire content to work with in-memory
-            lines = file.readlines()
-            # If file is empty, write header + links and return
-            if not lines:
-                file.seek(0)
-                file.writelines([LIGHTNING_LINKS_HEADER + "\n", formatted_links + "\n"])
-                file.truncate()
-                return True
-
-            found_section = False
-
-            # Locate the Lightning Links header
-            for i, line in enumerate(lines):
-                if line.strip() == LIGHTNING_LINKS_HEADER:
-                    found_section = True
-                    if i + 1 < len(lines):  # Check for the next line
-                        existing_links = lines[i + 1].strip()
-                        if existing_links == formatted_links:
-                            return False  # No updates required
-                        else:
-                            # Replace the existing line and truncate properly
-                            lines[i + 1] = formatted_links + "\n"
-                    else:
-                        # If the Lightning Links header exists but no links line is found
-                        lines.append(formatted_links + "\n")
-                    break
-
-            if not found_section:
-                # Append a Lightning Links section at the end of the file
-                if not lines[-1].endswith("\n"):
-                    lines[-1] += "\n"  # Ensure a new line before appending
-                lines.append(LIGHTNING_LINKS_HEADER + "\n")
-                lines.append(formatted_links + "\n")
-
-            # Rewind the file pointer, overwrite the content, and truncate the file
-            file.seek(0)
-            file.writelines(lines)
-            file.truncate()  # Ensure the file is truncated to remove leftover content
+        return bool(report.files_written)
 
-            return True  # Indicates content was updated
+    def get_similar_notes_store_path(self) -> Path:
+        """
+        Returns the location of the binary similar notes store inside `.obsidian`.
+        """
+        return (
+            Path(self.notes_directory)
+            / ".obsidian"
+            / CACHE_DIRECTORY
+            / "similar_notes.bin"
+        )
 
-    def save_similar_notes(self, notes):
+    def save_similar_notes(self, notes, export_json: bool = SIMILAR_NOTES_JSON):
         """
-        Saves the mapping of similar notes to a JSON file in the specified notes notes_directory.
-        This function takes a list of notes where each note is expected to have a file name
-        and its corresponding list of similar notes. It then creates a dictionary mapping
-        each note's file name to its similar notes and writes this dictionary into a JSON
-        file named `similar_notes.json` inside a specified notes_directory.
+        Saves the mapping of similar notes to the binary similar notes store in the specified
+        notes_directory. This function takes a list of notes where each note is expected to have
+        a file name and its corresponding list of similar notes, and writes them with
+        `SimilarNotesStore.write`. When requested, the mapping is also exported as a dictionary of
+        each note's file name to its similar notes to a JSON file named `similar_notes.json`,
+        the format used before the binary store.
 
         :param notes: A list of dictionaries, where each dictionary represents a note and
-                      should contain `file_name` (str) and `similar_notes` (list) fields.
+                      should contain `file_name` (str) and `similar_notes` (list) fields, and
+                      optionally the `similarity_scores` (list) of the similar notes.
         :type notes: List[dict]
+        :param export_json: Whether to also write `similar_notes.json`.
+        :type export_json: bool
 
         """
+        SimilarNotesStore.write(self.get_similar_notes_store_path(), notes)
+
+        if not export_json:
+            return
+
         similar_notes_dict = {
             note["file_name"]: note["similar_notes"] for note in notes
         }
@@ -506,16 +1086,42 @@ class FileParser:
         ) as file:
             json.dump(similar_notes_dict, file, indent=4)
 
+    def patch_similar_notes(
+        self, notes, export_json: bool = SIMILAR_NOTES_JSON
+    ) -> bool:
+        """
+        Updates the similar notes of a few notes in the binary similar notes store in place with
+        `SimilarNotesStore.patch`, rather than writing every note again.
+
+        :param notes: Dictionaries with the `file_name`, `similar_notes` and optionally the
+                      `similarity_scores` of each note to update.
+        :type notes: List[dict]
+        :param export_json: Whether `similar_notes.json` is also kept, in which case it has to be
+                            written whole with `save_similar_notes`.
+        :type export_json: bool
+        :return: Whether the store was patched. When False, `save_similar_notes` has to be used.
+        :rtype: bool
+        """
+        if export_json:
+            return False
+
+        return SimilarNotesStore.patch(self.get_similar_notes_store_path(), notes)
+
     def load_similar_notes(self):
         """
-        Loads a JSON file containing similar notes from the given notes notes_directory and
-        returns its content as a dictionary. The file is expected to be located
-        within the `.obsidian` subfolder of the specified notes_directory and named
-        `similar_notes.json`.
+        Loads the similar notes of every note in the given notes notes_directory. The binary
+        store written by `save_similar_notes` is memory-mapped when it exists, so only the notes
+        that are looked up are decoded. Otherwise, the JSON file located within the `.obsidian`
+        subfolder of the specified notes_directory and named `similar_notes.json` is parsed.
 
-        :return: A dictionary representing the contents of the `similar_notes.json` file.
-        :rtype: Dict
+        :return: A mapping from each note's file name to its similar notes.
+        :rtype: SimilarNotesStore | Dict
         """
+        try:
+            return SimilarNotesStore(self.get_similar_notes_store_path())
+        except (FileNotFoundError, ValueError):
+            pass
+
         with open(
             (
                 Path(self.notes_directory) / ".obsidian" / "similar_notes.json"
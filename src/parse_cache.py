@@ -0,0 +1,159 @@
+import os
+import sys
+import threading
+from collections import OrderedDict
+
+from src.constants import PARSE_CACHE_MB
+
+
+class ParseCache:
+    def __init__(self, max_bytes: int):
+        """
+        An in-memory, least recently used cache of parsed notes that lets `FileParser.parse_note`
+        skip reading and parsing notes that haven't changed since they were last parsed.
+
+        A note is cached under its path together with the modification time and size the file
+        had when it was read, and is only served while the file still has the same modification
+        time and size. Once the estimated size of the cached notes exceeds `max_bytes`, the least
+        recently used notes are evicted. Callers always receive copies, so changing a returned
+        note never changes the cached one. The cache is safe to share between threads.
+
+        Attributes:
+            max_bytes (int): The most memory, in bytes, the cached notes may use. 0 disables
+                the cache.
+            size (int): The estimated memory, in bytes, used by the cached notes.
+            hits (int): Number of lookups served from the cache.
+            misses (int): Number of lookups that had to parse the note.
+            evictions (int): Number of notes evicted to stay under `max_bytes`.
+
+        Args:
+            max_bytes: The most memory, in bytes, the cached notes may use.
+        """
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        # path -> (modification time, size, note, estimated bytes), least recently used first
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def get_key(stat_result: os.stat_result) -> tuple[int, int]:
+        """
+        Returns the part of a file's stat that identifies its content.
+
+        Args:
+            stat_result (os.stat_result): The file's stat.
+
+        Returns:
+            tuple[int, int]: The modification time in nanoseconds and the size in bytes.
+        """
+        return stat_result.st_mtime_ns, stat_result.st_size
+
+    @staticmethod
+    def estimate_size(note) -> int:
+        """
+        Estimates the memory used by a parsed note, counting its text sections.
+
+        Args:
+            note (Note): The parsed note.
+
+        Returns:
+            int: The estimated size in bytes.
+        """
+        return sys.getsizeof(note) + sum(
+            sys.getsizeof(value) for value in note.values() if isinstance(value, str)
+        )
+
+    def get(self, file_path: str, stat_result: os.stat_result):
+        """
+        Looks up a parsed note, counting the lookup as a hit or a miss.
+
+        Args:
+            file_path (str): Path of the note.
+            stat_result (os.stat_result): The note's current stat.
+
+        Returns:
+            Note | None: A copy of the cached note, or None if it isn't cached or the file
+                changed since it was parsed.
+        """
+        with self._lock:
+            entry = self._entries.get(file_path)
+            if entry is None or entry[:2] != self.get_key(stat_result):
+                self.misses += 1
+                return None
+
+            self._entries.move_to_end(file_path)
+            self.hits += 1
+
+            return entry[2].copy()
+
+    def put(self, file_path: str, stat_result: os.stat_result, note):
+        """
+        Stores a copy of a parsed note, evicting the least recently used notes if the cache grows
+        beyond `max_bytes`. Notes larger than the whole cache are not stored.
+
+        Args:
+            file_path (str): Path of the note.
+            stat_result (os.stat_result): The stat the note had when it was read.
+            note (Note): The parsed note.
+
+        Returns:
+            None
+        """
+        size = self.estimate_size(note)
+        if size > self.max_bytes:
+            return
+
+        with self._lock:
+            previous = self._entries.pop(file_path, None)
+            if previous is not None:
+                self.size -= previous[3]
+
+            self._entries[file_path] = (*self.get_key(stat_result), note.copy(), size)
+            self.size += size
+
+            while self.size > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self.size -= evicted[3]
+                self.evictions += 1
+
+    def clear(self):
+        """
+        Removes every cached note and resets the counters.
+
+        Returns:
+            None
+        """
+        with self._lock:
+            self._entries.clear()
+            self.size = 0
+            self.hits = 0
+            self.misses = 0
+            self.evictions = 0
+
+    def stats(self) -> dict:
+        """
+        Returns the cache's counters.
+
+        Returns:
+            dict: The number of cached "notes", their estimated "bytes", and the number of
+                "hits", "misses" and "evictions".
+        """
+        with self._lock:
+            return {
+                "notes": len(self._entries),
+                "bytes": self.size,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }
+
+    def __len__(self):
+        return len(self._entries)
+
+
+# shared by every FileParser in the process
+PARSE_CACHE = ParseCache(PARSE_CACHE_MB * 1024 * 1024)
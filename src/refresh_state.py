@@ -0,0 +1,149 @@
+import json
+import os
+from pathlib import Path
+
+from src.constants import CACHE_DIRECTORY, ENCODING
+
+
+class RefreshState:
+    def __init__(self, notes_directory: str, settings: dict):
+        """
+        Remembers what every note looked like at the end of the last refresh, so that an
+        incremental refresh can tell which notes need to be read again and which notes need
+        their lightning links rewritten.
+
+        For each note the modification time and size are stored, along with the hash of the
+        content its embedding was computed from and the similar notes it was given. The state
+        is tied to the settings it was produced with and is discarded when they change.
+
+        Attributes:
+            state_path (Path): Location of the state file inside `.obsidian`.
+            settings (dict): The settings the current refresh runs with.
+            notes (dict): Maps a file path to its recorded "mtime_ns", "size", "hash" and
+                "similar_notes".
+
+        Args:
+            notes_directory: The vault directory whose `.obsidian` folder holds the state file.
+            settings: Values that affect the lightning links written, such as the embedding
+                model and the number of links.
+        """
+        self.state_path = (
+            Path(notes_directory) / ".obsidian" / CACHE_DIRECTORY / "refresh_state.json"
+        )
+        self.settings = settings
+        self.notes = {}
+
+        self.load()
+
+    def load(self):
+        """
+        Loads the state file, leaving the state empty if it is missing, unreadable, or was
+        written with different settings.
+
+        Returns:
+            None
+        """
+        self.notes = {}
+
+        try:
+            with open(self.state_path, "r", encoding=ENCODING) as file:
+                state = json.load(file)
+        except (OSError, ValueError):
+            return
+
+        if state.get("settings") != self.settings:
+            return
+
+        self.notes = state.get("notes", {})
+
+    def is_unchanged(self, file_name: str, stat_result: os.stat_result) -> bool:
+        """
+        Checks whether a note still has the modification time and size recorded for it.
+
+        Args:
+            file_name (str): Path of the note.
+            stat_result (os.stat_result): The note's current file status.
+
+        Returns:
+            bool: True if the note was recorded and has not been modified since.
+        """
+        recorded = self.notes.get(file_name)
+
+        return (
+            recorded is not None
+            and recorded["mtime_ns"] == stat_result.st_mtime_ns
+            and recorded["size"] == stat_result.st_size
+        )
+
+    def get_hash(self, file_name: str):
+        """
+        Returns the recorded content hash of a note, or None if the note was not recorded.
+        """
+        recorded = self.notes.get(file_name)
+
+        return None if recorded is None else recorded["hash"]
+
+    def get_similar_notes(self, file_name: str) -> list[str]:
+        """
+        Returns the similar notes recorded for a note, or an empty list if it was not recorded.
+        """
+        recorded = self.notes.get(file_name)
+
+        return [] if recorded is None else recorded["similar_notes"]
+
+    def record(
+        self,
+        file_name: str,
+        stat_result: os.stat_result,
+        content_hash: str,
+        similar_notes: list[str],
+    ):
+        """
+        Records the current state of a note.
+
+        Args:
+            file_name (str): Path of the note.
+            stat_result (os.stat_result): The note's file status after any links were written.
+            content_hash (str): Hash of the content the note's embedding was computed from.
+            similar_notes (list[str]): The similar notes the note was given.
+
+        Returns:
+            None
+        """
+        self.notes[file_name] = {
+            "mtime_ns": stat_result.st_mtime_ns,
+            "size": stat_result.st_size,
+            "hash": content_hash,
+            "similar_notes": list(similar_notes),
+        }
+
+    def retain(self, file_names: list[str]):
+        """
+        Forgets every note that is not in `file_names`, such as notes that were deleted.
+
+        Args:
+            file_names (list[str]): Paths of the notes that still exist.
+
+        Returns:
+            None
+        """
+        keep = set(file_names)
+        self.notes = {
+            file_name: recorded
+            for file_name, recorded in self.notes.items()
+            if file_name in keep
+        }
+
+    def save(self):
+        """
+        Writes the state file, replacing the previous one atomically.
+
+        Returns:
+            None
+        """
+        self.state_path.parent.mkdir(parents=True, exist_ok=True)
+
+        temp_path = self.state_path.with_suffix(".tmp")
+        with open(temp_path, "w", encoding=ENCODING) as file:
+            json.dump({"settings": self.settings, "notes": self.notes}, file)
+        os.replace(temp_path, self.state_path)
@@ -0,0 +1,235 @@
+import hashlib
+import json
+import sqlite3
+import threading
+from pathlib import Path
+from time import time
+
+from src.constants import (
+    CACHE_DIRECTORY,
+    ENCODING,
+    RESPONSE_CACHE_MB,
+    RESPONSE_CACHE_TTL_HOURS,
+)
+
+
+class ResponseCache:
+    def __init__(
+        self,
+        notes_directory: str,
+        ttl_seconds: float = RESPONSE_CACHE_TTL_HOURS * 3600,
+        max_bytes: int = RESPONSE_CACHE_MB * 1024 * 1024,
+    ):
+        """
+        An on-disk store of AI model responses, so a request identical to an earlier one is
+        answered without contacting the AI provider.
+
+        Responses are kept in an SQLite database inside `.obsidian`, keyed by a hash of
+        everything that determines the response: the provider, model, temperature, the schema of
+        the requested structure, and the system and user prompts. Responses older than
+        `ttl_seconds` are treated as missing, and once the stored responses exceed `max_bytes`
+        the least recently used ones are removed. The database is only opened, and created, once
+        a response is looked up or stored.
+
+        Attributes:
+            database_path (Path): Location of the database file inside `.obsidian`.
+            ttl_seconds (float): How long a response stays valid, 0 keeps responses forever.
+            max_bytes (int): The most bytes of responses kept.
+            hits (int): Number of requests answered from the cache.
+            misses (int): Number of cacheable requests that had to be sent.
+            bypassed (int): Number of requests sent without checking the cache.
+            evictions (int): Number of responses removed to stay under `max_bytes`.
+
+        Args:
+            notes_directory: The vault directory whose `.obsidian` folder holds the database.
+            ttl_seconds: How long a response stays valid.
+            max_bytes: The most bytes of responses kept.
+        """
+        self.database_path = (
+            Path(notes_directory)
+            / ".obsidian"
+            / CACHE_DIRECTORY
+            / "llm_responses.sqlite"
+        )
+        self.ttl_seconds = ttl_seconds
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.bypassed = 0
+        self.evictions = 0
+
+        # requests may be made from several threads, so every query holds the lock
+        self._lock = threading.Lock()
+        self._connection = None
+
+    def _connect(self) -> sqlite3.Connection:
+        """
+        Returns the database connection, creating the database on first use. Must be called
+        while holding the lock.
+        """
+        if self._connection is None:
+            self.database_path.parent.mkdir(parents=True, exist_ok=True)
+            connection = sqlite3.connect(
+                self.database_path.as_posix(), check_same_thread=False
+            )
+            with connection:
+                connection.execute(
+                    "CREATE TABLE IF NOT EXISTS responses ("
+                    "key TEXT PRIMARY KEY, value TEXT NOT NULL, size INTEGER NOT NULL, "
+                    "created_at REAL NOT NULL, accessed_at REAL NOT NULL)"
+                )
+                connection.execute(
+                    "CREATE INDEX IF NOT EXISTS responses_accessed_at "
+                    "ON responses (accessed_at)"
+                )
+            self._connection = connection
+
+        return self._connection
+
+    @staticmethod
+    def make_key(
+        provider: str,
+        model: str,
+        temperature: float,
+        schema: dict,
+        system: str,
+        user: str,
+    ) -> str:
+        """
+        Hashes everything that determines a response into a cache key.
+
+        Args:
+            provider (str): The AI provider.
+            model (str): The model name.
+            temperature (float): The sampling temperature.
+            schema (dict | None): The JSON schema of the requested structure, if any.
+            system (str): The system prompt.
+            user (str): The user prompt.
+
+        Returns:
+            str: A hex digest identifying the request.
+        """
+        request = json.dumps(
+            [provider, model, temperature, schema, system, user], sort_keys=True
+        )
+
+        return hashlib.sha256(request.encode(ENCODING)).hexdigest()
+
+    def get(self, key: str):
+        """
+        Looks up a response, counting the lookup as a hit or a miss. Expired responses are
+        removed.
+
+        Args:
+            key (str): The request's cache key.
+
+        Returns:
+            str | None: The stored response, or None if there is no valid one.
+        """
+        now = time()
+        with self._lock, self._connect() as connection:
+            row = connection.execute(
+                "SELECT value, created_at FROM responses WHERE key = ?", (key,)
+            ).fetchone()
+
+            if row is not None and self.ttl_seconds and now - row[1] > self.ttl_seconds:
+                connection.execute("DELETE FROM responses WHERE key = ?", (key,))
+                row = None
+
+            if row is None:
+                self.misses += 1
+                return None
+
+            connection.execute(
+                "UPDATE responses SET accessed_at = ? WHERE key = ?", (now, key)
+            )
+            self.hits += 1
+
+            return row[0]
+
+    def put(self, key: str, value: str):
+        """
+        Stores a response, then removes the least recently used responses while the cache holds
+        more than `max_bytes`.
+
+        Args:
+            key (str): The request's cache key.
+            value (str): The response.
+
+        Returns:
+            None
+        """
+        now = time()
+        size = len(value.encode(ENCODING))
+        with self._lock, self._connect() as connection:
+            connection.execute(
+                "INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?)",
+                (key, value, size, now, now),
+            )
+
+            total = connection.execute(
+                "SELECT COALESCE(SUM(size), 0) FROM responses"
+            ).fetchone()[0]
+            if total <= self.max_bytes:
+                return
+
+            evicted = []
+            for old_key, old_size in connection.execute(
+                "SELECT key, size FROM responses ORDER BY accessed_at, created_at"
+            ):
+                if total <= self.max_bytes:
+                    break
+                evicted.append((old_key,))
+                total -= old_size
+            connection.executemany("DELETE FROM responses WHERE key = ?", evicted)
+            self.evictions += len(evicted)
+
+    def clear(self):
+        """
+        Removes every stored response and resets the counters.
+
+        Returns:
+            None
+        """
+        with self._lock, self._connect() as connection:
+            connection.execute("DELETE FROM responses")
+        self.hits = 0
+        self.misses = 0
+        self.bypassed = 0
+        self.evictions = 0
+
+    def stats(self) -> dict:
+        """
+        Returns the cache's counters along with its current contents.
+
+        Returns:
+            dict: The number of stored "responses", their total "bytes", and the number of
+                "hits", "misses", "bypassed" requests and "evictions".
+        """
+        with self._lock:
+            responses, size = (
+                self._connect()
+                .execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM responses")
+                .fetchone()
+            )
+
+        return {
+            "responses": responses,
+            "bytes": size,
+            "hits": self.hits,
+            "misses": self.misses,
+            "bypassed": self.bypassed,
+            "evictions": self.evictions,
+        }
+
+    def close(self):
+        """
+        Closes the database connection, if it was opened.
+
+        Returns:
+            None
+        """
+        with self._lock:
+            if self._connection is not None:
+                self._connection.close()
+                self._connection = None
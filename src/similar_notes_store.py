@@ -0,0 +1,334 @@
+import hashlib
+import os
+import struct
+from collections.abc import Mapping
+from pathlib import Path
+
+import numpy as np
+
+from src.constants import ENCODING
+
+# magic, version, notes, strings, neighbours per note, hash table slots, string table bytes
+HEADER = struct.Struct("<4sIIIIIQ")
+MAGIC = b"LLSN"
+VERSION = 1
+# every section starts on a multiple of this many bytes so it can be viewed in place
+ALIGNMENT = 8
+
+
+def name_hash(name: str) -> int:
+    """
+    Hashes a file name to a 64-bit integer that is the same in every process.
+
+    Args:
+        name (str): The file name.
+
+    Returns:
+        int: The hash of the name.
+    """
+    digest = hashlib.blake2b(name.encode(ENCODING), digest_size=8).digest()
+
+    return int.from_bytes(digest, "little")
+
+
+def padding(size: int) -> int:
+    """
+    Returns the number of bytes needed after a section of `size` bytes to reach the alignment.
+    """
+    return -size % ALIGNMENT
+
+
+class SimilarNotesStore(Mapping):
+    def __init__(self, path):
+        """
+        A read-only, memory-mapped store of the similar notes of every note, replacing the
+        indented `similar_notes.json`.
+
+        The file holds a string table with every file name once, an (N, k) int32 array with the
+        string index of each note's similar notes, an (N, k) float32 array with their scores, and
+        an open addressing hash table from a note's file name to its row. Opening the store only
+        reads the header; looking up a note hashes its name, probes the table and decodes only
+        the names of its similar notes. The store behaves like the dictionary `load_similar_notes`
+        used to return, mapping a file name to the list of its similar notes.
+
+        Attributes:
+            path (Path): Location of the store file.
+            num_notes (int): The number of notes with similar notes stored.
+            num_neighbours (int): The number of similar notes stored per note.
+
+        Args:
+            path: Location of the store file.
+
+        Raises:
+            FileNotFoundError: If the file doesn't exist.
+            ValueError: If the file is not a similar notes store of a supported version.
+        """
+        self.path = Path(path)
+        data = np.memmap(self.path, dtype=np.uint8, mode="r")
+
+        if len(data) < HEADER.size:
+            raise ValueError(f"{self.path} is not a similar notes store")
+        (
+            magic,
+            version,
+            self.num_notes,
+            num_strings,
+            self.num_neighbours,
+            table_size,
+            string_bytes,
+        ) = HEADER.unpack(bytes(data[: HEADER.size]))
+        if magic != MAGIC or version != VERSION:
+            raise ValueError(f"{self.path} is not a similar notes store")
+
+        offset = HEADER.size
+
+        def section(count, dtype):
+            nonlocal offset
+            size = count * np.dtype(dtype).itemsize
+            view = data[offset : offset + size].view(dtype)
+            offset += size + padding(size)
+            return view
+
+        self._string_offsets = section(num_strings + 1, np.uint64)
+        self._strings = section(string_bytes, np.uint8)
+        self._neighbours_offset = offset
+        self._neighbours = section(
+            self.num_notes * self.num_neighbours, np.int32
+        ).reshape(self.num_notes, self.num_neighbours)
+        self._scores_offset = offset
+        self._scores = section(
+            self.num_notes * self.num_neighbours, np.float32
+        ).reshape(self.num_notes, self.num_neighbours)
+        self._table = section(table_size, np.int32)
+
+    @staticmethod
+    def write(path, notes):
+        """
+        Writes the similar notes of every note to a store file, replacing it atomically.
+
+        Args:
+            path: Location of the store file.
+            notes (list): Dictionaries with the "file_name" and "similar_notes" of every note, and
+                optionally the "similarity_scores" of the similar notes.
+
+        Returns:
+            None
+        """
+        path = Path(path)
+
+        # a note listed more than once keeps its first entry
+        unique_notes = {}
+        for note in notes:
+            unique_notes.setdefault(note["file_name"], note)
+        notes = list(unique_notes.values())
+
+        # the notes come first in the string table, followed by any other similar note names
+        file_names = [note["file_name"] for note in notes]
+        all_similar_notes = [name for note in notes for name in note["similar_notes"]]
+        string_indexes = {
+            name: index
+            for index, name in enumerate(dict.fromkeys(file_names + all_similar_notes))
+        }
+        strings = [name.encode(ENCODING) for name in string_indexes]
+
+        num_notes = len(notes)
+        lengths = np.array(
+            [len(note["similar_notes"]) for note in notes], dtype=np.int64
+        )
+        num_neighbours = int(lengths.max(initial=0))
+
+        flat_neighbours = np.fromiter(
+            map(string_indexes.__getitem__, all_similar_notes),
+            dtype=np.int32,
+            count=len(all_similar_notes),
+        )
+        flat_scores = []
+        for note, length in zip(notes, lengths.tolist()):
+            note_scores = note.get("similarity_scores")
+            flat_scores.extend(
+                [np.nan] * length if note_scores is None else note_scores
+            )
+
+        # scatter the flat lists into rows padded with -1 and NaN
+        rows = np.repeat(np.arange(num_notes), lengths)
+        columns = np.arange(len(flat_neighbours)) - np.repeat(
+            np.cumsum(lengths) - lengths, lengths
+        )
+        neighbours = np.full((num_notes, num_neighbours), -1, dtype=np.int32)
+        neighbours[rows, columns] = flat_neighbours
+        scores = np.full((num_notes, num_neighbours), np.nan, dtype=np.float32)
+        scores[rows, columns] = flat_scores
+
+        string_offsets = np.zeros(len(strings) + 1, dtype=np.uint64)
+        string_offsets[1:] = np.cumsum([len(string) for string in strings])
+        string_data = b"".join(strings)
+
+        # a power of two at least twice the number of notes keeps probe sequences short
+        table_size = 1 << max(1, (2 * num_notes - 1).bit_length())
+        table = [-1] * table_size
+        mask = table_size - 1
+        for row, file_name in enumerate(file_names):
+            slot = name_hash(file_name) & mask
+            while table[slot] != -1:
+                slot = (slot + 1) & mask
+            table[slot] = row
+        table = np.array(table, dtype=np.int32)
+
+        path.parent.mkdir(parents=True, exist_ok=True)
+        temp_path = path.with_suffix(".tmp")
+        with open(temp_path, "wb") as file:
+            file.write(
+                HEADER.pack(
+                    MAGIC,
+                    VERSION,
+                    num_notes,
+                    len(strings),
+                    num_neighbours,
+                    table_size,
+                    len(string_data),
+                )
+            )
+            for section in (
+                string_offsets.tobytes(),
+                string_data,
+                neighbours.tobytes(),
+                scores.tobytes(),
+                table.tobytes(),
+            ):
+                file.write(section)
+                file.write(b"\0" * padding(len(section)))
+        os.replace(temp_path, path)
+
+    @classmethod
+    def patch(cls, path, notes) -> bool:
+        """
+        Overwrites the similar notes of a few notes in place, without rewriting the file. Stores
+        already open see the change. Only notes that are already stored, with similar notes that
+        are stored notes themselves, can be patched.
+
+        Args:
+            path: Location of the store file.
+            notes (list): Dictionaries with the "file_name" and "similar_notes" of each note to
+                patch, and optionally the "similarity_scores" of the similar notes.
+
+        Returns:
+            bool: Whether the notes were patched. When False nothing was written, and the store
+                has to be rewritten with `write`.
+        """
+        try:
+            store = cls(path)
+        except (FileNotFoundError, ValueError):
+            return False
+
+        rows = []
+        neighbours = np.full((len(notes), store.num_neighbours), -1, dtype=np.int32)
+        scores = np.full((len(notes), store.num_neighbours), np.nan, dtype=np.float32)
+        for position, note in enumerate(notes):
+            row = store.find(note["file_name"])
+            # a note's row is also the index of its name, so similar notes must be stored notes
+            indexes = [store.find(name) for name in note["similar_notes"]]
+            if row is None or None in indexes or len(indexes) > store.num_neighbours:
+                return False
+
+            rows.append(row)
+            neighbours[position, : len(indexes)] = indexes
+            if note.get("similarity_scores") is not None:
+                scores[position, : len(indexes)] = note["similarity_scores"]
+
+        row_bytes = store.num_neighbours * 4
+        with open(path, "r+b") as file:
+            for position, row in enumerate(rows):
+                file.seek(store._neighbours_offset + row * row_bytes)
+                file.write(neighbours[position].tobytes())
+                file.seek(store._scores_offset + row * row_bytes)
+                file.write(scores[position].tobytes())
+
+        return True
+
+    def get_string(self, index: int) -> str:
+        """
+        Decodes one name from the string table.
+
+        Args:
+            index (int): The index of the name in the string table.
+
+        Returns:
+            str: The name.
+        """
+        start = int(self._string_offsets[index])
+        stop = int(self._string_offsets[index + 1])
+
+        return bytes(self._strings[start:stop]).decode(ENCODING)
+
+    def find(self, file_name: str):
+        """
+        Finds the row of a note by probing the hash table.
+
+        Args:
+            file_name (str): The note's file name.
+
+        Returns:
+            int | None: The note's row, or None if it isn't stored.
+        """
+        table_size = len(self._table)
+        if table_size == 0:
+            return None
+
+        mask = table_size - 1
+        slot = name_hash(file_name) & mask
+        for _ in range(table_size):
+            row = int(self._table[slot])
+            if row == -1:
+                return None
+            # the notes are the first strings in the table, so a row is also its name's index
+            if self.get_string(row) == file_name:
+                return row
+            slot = (slot + 1) & mask
+
+        return None
+
+    def get_scores(self, file_name: str) -> list[float]:
+        """
+        Returns the similarity scores of a note's similar notes, in the same order as the notes.
+        Scores that were not recorded are NaN.
+
+        Args:
+            file_name (str): The note's file name.
+
+        Returns:
+            list[float]: The score of each similar note.
+
+        Raises:
+            KeyError: If the note isn't stored.
+        """
+        row = self.find(file_name)
+        if row is None:
+            raise KeyError(file_name)
+
+        valid = self._neighbours[row] >= 0
+
+        return self._scores[row][valid].tolist()
+
+    def __getitem__(self, file_name: str) -> list[str]:
+        row = self.find(file_name)
+        if row is None:
+            raise KeyError(file_name)
+
+        return [self.get_string(index) for index in self._neighbours[row] if index >= 0]
+
+    def __iter__(self):
+        for row in range(self.num_notes):
+            yield self.get_string(row)
+
+    def __len__(self):
+        return self.num_notes
+
+    def to_dict(self) -> dict:
+        """
+        Returns the whole store as a dictionary mapping each note to its similar notes, the format
+        of `similar_notes.json`.
+
+        Returns:
+            dict: The similar notes of every note.
+        """
+        return {file_name: self[file_name] for file_name in self}
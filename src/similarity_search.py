@@ -0,0 +1,352 @@
+from typing import NamedTuple
+
+import numpy as np
+
+
+class TopKSimilarities(NamedTuple):
+    """
+    The most similar notes for every note in a collection.
+
+    Attributes:
+        indexes (np.ndarray): An (N, k) int32 array where row i holds the indexes of the notes
+            most similar to note i, ordered from most to least similar.
+        scores (np.ndarray): An (N, k) float32 array with the cosine similarity of each entry
+            in `indexes`.
+    """
+
+    indexes: np.ndarray
+    scores: np.ndarray
+
+
+class QuantizedEmbeddings(NamedTuple):
+    """
+    Normalized embeddings stored at a reduced precision.
+
+    Attributes:
+        values (np.ndarray): An (N, dimensions) float16 or int8 array of the embeddings.
+        scales (np.ndarray | None): For int8, the (N,) float32 factor that turns each row of
+            `values` back into its normalized embedding. None for float16.
+    """
+
+    values: np.ndarray
+    scales: np.ndarray
+
+    def dequantize(self, start: int = 0, stop: int = None) -> np.ndarray:
+        """
+        Converts a range of rows back into float32 embeddings.
+
+        Args:
+            start (int): The first row to convert.
+            stop (int, optional): The row after the last row to convert, by default the end.
+
+        Returns:
+            np.ndarray: The float32 embeddings of the rows.
+        """
+        vectors = self.values[start:stop].astype(np.float32)
+        if self.scales is not None:
+            vectors *= self.scales[start:stop, None]
+
+        return vectors
+
+
+def normalize(embeddings) -> np.ndarray:
+    """
+    Scales every embedding to unit length so that dot products are cosine similarities.
+
+    Args:
+        embeddings (array-like): A 2D array with one embedding per row.
+
+    Returns:
+        np.ndarray: A float32 array of the normalized embeddings. All-zero rows are left as zeros.
+    """
+    embeddings = np.asarray(embeddings, dtype=np.float32)
+    norms = np.linalg.norm(embeddings, axis=1, keepdims=True)
+    # avoid dividing by zero for empty notes
+    norms[norms == 0] = 1.0
+
+    return embeddings / norms
+
+
+def quantize(embeddings, precision: str, block_rows: int = 4096) -> QuantizedEmbeddings:
+    """
+    Normalizes embeddings and stores them at a reduced precision.
+
+    Embeddings are converted a block of rows at a time, so a memory-mapped float32 matrix is
+    never loaded into memory as a whole. int8 uses symmetric scalar quantisation with one scale
+    per row, chosen so that the largest component of each row maps to 127.
+
+    Args:
+        embeddings (array-like): A 2D array with one embedding per row.
+        precision (str): "float16" or "int8".
+        block_rows (int): The number of rows converted at once.
+
+    Returns:
+        QuantizedEmbeddings: The quantized embeddings.
+
+    Raises:
+        ValueError: If `precision` is not "float16" or "int8".
+    """
+    if precision not in ("float16", "int8"):
+        raise ValueError(f"Unknown precision {precision!r}, expected float16 or int8")
+
+    num_rows, dimensions = np.shape(embeddings)
+    values = np.empty((num_rows, dimensions), dtype=np.dtype(precision))
+    scales = np.empty(num_rows, dtype=np.float32) if precision == "int8" else None
+
+    for start in range(0, num_rows, block_rows):
+        block = normalize(embeddings[start : start + block_rows])
+        if scales is None:
+            values[start : start + len(block)] = block
+            continue
+
+        block_scales = np.abs(block).max(axis=1) / 127
+        # all-zero rows stay zero
+        block_scales[block_scales == 0] = 1.0
+        values[start : start + len(block)] = np.rint(block / block_scales[:, None])
+        scales[start : start + len(block)] = block_scales
+
+    return QuantizedEmbeddings(values, scales)
+
+
+def rows_per_block(num_notes: int, memory_budget_bytes: int) -> int:
+    """
+    Works out how many query rows can be scored at once without exceeding the memory budget.
+
+    Each row of a tile holds `num_notes` float32 scores, plus the int64 indexes produced by
+    `np.argpartition` over that row.
+
+    Args:
+        num_notes (int): The number of notes every query is compared against.
+        memory_budget_bytes (int): The maximum size of a single tile in bytes.
+
+    Returns:
+        int: The number of rows per tile, always at least 1.
+    """
+    bytes_per_row = max(1, num_notes) * (
+        np.dtype(np.float32).itemsize + np.dtype(np.int64).itemsize
+    )
+
+    return max(1, memory_budget_bytes // bytes_per_row)
+
+
+def top_k_similarities(
+    embeddings,
+    k: int,
+    memory_budget_bytes: int,
+    precision: str = "float32",
+    rescore_factor: int = 4,
+) -> TopKSimilarities:
+    """
+    Finds the k most similar notes for every note without building the full N x N similarity
+    matrix.
+
+    Query rows are processed in tiles sized by `rows_per_block`. Each tile is scored against all
+    notes and reduced to its k best entries per row by `select_top_k`. Only the (N, k) results are
+    kept between tiles.
+
+    With a `precision` of "float16" or "int8" the search runs on quantized embeddings instead, see
+    `quantized_top_k_similarities`.
+
+    Args:
+        embeddings (array-like): A 2D array with one embedding per note.
+        k (int): The number of similar notes to keep per note. It is capped at N - 1.
+        memory_budget_bytes (int): The maximum size of a single tile of scores in bytes.
+        precision (str): "float32", "float16" or "int8".
+        rescore_factor (int): For quantized searches, how many candidates per similar note are
+            rescored in float32.
+
+    Returns:
+        TopKSimilarities: The indexes and cosine similarity scores of the top k notes per note.
+    """
+    if precision != "float32":
+        return quantized_top_k_similarities(
+            embeddings, k, memory_budget_bytes, precision, rescore_factor
+        )
+
+    embeddings = normalize(embeddings)
+    num_notes = len(embeddings)
+    k = max(0, min(k, num_notes - 1))
+
+    indexes = np.empty((num_notes, k), dtype=np.int32)
+    scores = np.empty((num_notes, k), dtype=np.float32)
+    if k == 0:
+        return TopKSimilarities(indexes, scores)
+
+    block_rows = rows_per_block(num_notes, memory_budget_bytes)
+
+    for start in range(0, num_notes, block_rows):
+        stop = min(start + block_rows, num_notes)
+        block = embeddings[start:stop] @ embeddings.T
+
+        indexes[start:stop], scores[start:stop] = select_top_k(block, k, start)
+
+    return TopKSimilarities(indexes, scores)
+
+
+def quantized_top_k_similarities(
+    embeddings,
+    k: int,
+    memory_budget_bytes: int,
+    precision: str,
+    rescore_factor: int = 4,
+) -> TopKSimilarities:
+    """
+    Finds the k most similar notes for every note while only holding float16 or int8 embeddings
+    in memory.
+
+    The embeddings are quantized, which takes a half or a quarter of the memory of float32. Each
+    tile of query rows is scored against the quantized notes, which are converted back to float32
+    one panel of rows at a time, and `k * rescore_factor` candidates are kept per row. The
+    candidates are then rescored exactly against the float32 embeddings, which are only read for
+    those rows, so passing a memory-mapped matrix such as the embedding cache keeps the full
+    precision vectors on disk. The rescoring makes the results match a float32 search unless a
+    true neighbour falls outside the candidates.
+
+    Args:
+        embeddings (array-like): A 2D float32 array with one embedding per note, which may be
+            memory-mapped.
+        k (int): The number of similar notes to keep per note. It is capped at N - 1.
+        memory_budget_bytes (int): The maximum size of a single tile of scores in bytes.
+        precision (str): "float16" or "int8".
+        rescore_factor (int): How many candidates per similar note are rescored.
+
+    Returns:
+        TopKSimilarities: The indexes and float32 cosine similarity scores of the top k notes per
+            note.
+    """
+    num_notes = len(embeddings)
+    k = max(0, min(k, num_notes - 1))
+    if k == 0:
+        return TopKSimilarities(
+            np.empty((num_notes, 0), dtype=np.int32),
+            np.empty((num_notes, 0), dtype=np.float32),
+        )
+
+    quantized = quantize(embeddings, precision)
+    num_candidates = min(num_notes - 1, k * max(1, rescore_factor))
+    block_rows = rows_per_block(num_notes, memory_budget_bytes)
+    # rows of float32 vectors that fit in the budget, for the converted panels of notes
+    row_bytes = quantized.values.shape[1] * np.dtype(np.float32).itemsize
+    panel_rows = max(1, memory_budget_bytes // row_bytes)
+    # rows whose gathered candidate vectors fit in the budget while rescoring
+    rescore_rows = max(1, panel_rows // num_candidates)
+
+    indexes = np.empty((num_notes, k), dtype=np.int32)
+    scores = np.empty((num_notes, k), dtype=np.float32)
+    for start in range(0, num_notes, block_rows):
+        stop = min(start + block_rows, num_notes)
+        queries = quantized.dequantize(start, stop)
+
+        if panel_rows >= num_notes:
+            block = queries @ quantized.dequantize().T
+        else:
+            block = np.empty((stop - start, num_notes), dtype=np.float32)
+            for panel_start in range(0, num_notes, panel_rows):
+                panel_stop = min(panel_start + panel_rows, num_notes)
+                block[:, panel_start:panel_stop] = (
+                    queries @ quantized.dequantize(panel_start, panel_stop).T
+                )
+        candidates = select_top_k(block, num_candidates, start).indexes
+        del block
+
+        # rescore the candidates with the full precision embeddings, reading each row once
+        unique_candidates = np.unique(candidates)
+        candidate_vectors = normalize(embeddings[unique_candidates])
+        candidate_rows = np.searchsorted(unique_candidates, candidates)
+        exact_queries = normalize(embeddings[start:stop])
+
+        exact_scores = np.empty(candidates.shape, dtype=np.float32)
+        for row_start in range(0, stop - start, rescore_rows):
+            row_stop = row_start + rescore_rows
+            exact_scores[row_start:row_stop] = np.einsum(
+                "rd,rcd->rc",
+                exact_queries[row_start:row_stop],
+                candidate_vectors[candidate_rows[row_start:row_stop]],
+            )
+
+        order = np.argsort(-exact_scores, axis=1, kind="stable")[:, :k]
+        indexes[start:stop] = np.take_along_axis(candidates, order, axis=1)
+        scores[start:stop] = np.take_along_axis(exact_scores, order, axis=1)
+
+    return TopKSimilarities(indexes, scores)
+
+
+def select_top_k(
+    block: np.ndarray, k: int, row_offset: int = 0, self_columns=None
+) -> TopKSimilarities:
+    """
+    Selects the k highest scores in every row of a block of similarity scores in one batched
+    operation.
+
+    Row i of the block is assumed to hold the scores of note `row_offset + i` against every note,
+    so that entry is masked out in place before selecting. Masking by position rather than
+    dropping the best score keeps duplicate notes, which tie with the self-score, as neighbours.
+    `np.argpartition` finds the k candidates per row and only those are sorted.
+
+    Args:
+        block (np.ndarray): A 2D float array of similarity scores. It is modified in place.
+        k (int): The number of entries to keep per row. It is capped at the number of columns - 1.
+        row_offset (int): The index of the note scored in the first row of the block.
+        self_columns (array-like, optional): The column of each row's own note, for blocks whose
+            rows are not consecutive notes. Negative entries mask nothing. Overrides `row_offset`.
+
+    Returns:
+        TopKSimilarities: The int32 column indexes and the scores of the top k entries per row,
+            ordered from most to least similar.
+    """
+    num_rows, num_columns = block.shape
+    k = max(0, min(k, num_columns - 1))
+    if k == 0:
+        return TopKSimilarities(
+            np.empty((num_rows, 0), dtype=np.int32),
+            np.empty((num_rows, 0), dtype=np.float32),
+        )
+
+    rows = np.arange(num_rows)
+    if self_columns is None:
+        self_columns = rows + row_offset
+    else:
+        self_columns = np.asarray(self_columns)
+        rows, self_columns = rows[self_columns >= 0], self_columns[self_columns >= 0]
+
+    # a note is always most similar to itself, so remove it from its own candidates
+    block[rows, self_columns] = -np.inf
+
+    candidates = np.argpartition(block, -k, axis=1)[:, -k:]
+    candidate_scores = np.take_along_axis(block, candidates, axis=1)
+
+    order = np.argsort(-candidate_scores, axis=1, kind="stable")
+    indexes = np.take_along_axis(candidates, order, axis=1).astype(np.int32)
+    scores = np.take_along_axis(candidate_scores, order, axis=1).astype(np.float32)
+
+    return TopKSimilarities(indexes, scores)
+
+
+def count_above_threshold(
+    scores: np.ndarray, min_score: float, min_relative_score: float = 0.0
+) -> np.ndarray:
+    """
+    Counts how many of each note's similar notes are strong enough to keep.
+
+    A similar note is kept if its score is at least `min_score` and at least `min_relative_score`
+    times the score of the note's best match. Since each row of scores is ordered from most to
+    least similar, the kept notes are always the first ones in the row.
+
+    Args:
+        scores (np.ndarray): An (N, k) array of scores, each row ordered from highest to lowest.
+        min_score (float): The lowest cosine similarity kept.
+        min_relative_score (float): The lowest fraction of the best match's score kept, 0 keeps
+            every score above `min_score`. A note whose best match is not positive keeps nothing
+            when this is above 0.
+
+    Returns:
+        np.ndarray: The number of similar notes kept for each note.
+    """
+    scores = np.asarray(scores, dtype=np.float32)
+    keep = scores >= min_score
+    if min_relative_score > 0 and scores.shape[1]:
+        keep &= scores >= np.maximum(scores[:, :1], 0) * min_relative_score
+        keep &= scores > 0
+
+    # stop at the first score that is too low
+    return np.cumprod(keep, axis=1).sum(axis=1)
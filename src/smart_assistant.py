@@ -1,11 +1,9 @@
 import os
 import json
-from typing import Type
+from time import perf_counter
+from typing import TYPE_CHECKING, Type
 
-import ollama
-import pydantic
-import torch
-from openai import OpenAI
+import numpy as np
 
 from src.constants import (
     NOTE_EXTENSION,
@@ -13,8 +11,21 @@ from src.constants import (
     OPENAI_MODEL,
     OLLAMA_MODEL,
     OLLAMA_HOST,
+    RECOMMEND_CANDIDATES,
+    RECOMMEND_RERANK,
+    RESPONSE_CACHE_MAX_TEMPERATURE,
+    STREAM_RESPONSES,
+    USE_RESPONSE_CACHE,
 )
+from src.context_builder import ContextBuilder
+from src.lightning_links_creator import LightningLinksCreator
 from src.note_handler import FileParser
+from src.response_cache import ResponseCache
+from src.similarity_search import normalize
+
+if TYPE_CHECKING:
+    # pydantic, like the AI clients, is only imported once it is needed so the assistant starts fast
+    from pydantic import BaseModel
 
 
 class SmartAssistant:
@@ -29,9 +40,27 @@ class SmartAssistant:
 
     Attributes:
         file_handler (FileParser): Handles file parsing and operations for the notes directory.
-        similar_notes (list): Preloaded information about the similarities among notes.
+        similar_notes (Mapping): The similar notes of every note, looked up one note at a time.
         model (str): The OpenAI model version used for API interactions.
-        client (OpenAI): The client instance for interacting with OpenAI's API.
+        client (OpenAI | ollama.Client): The client instance for interacting with the AI
+            provider's API, created on first use.
+        creator (LightningLinksCreator): Provides the embedding model and the stored note
+            embeddings used to find the notes relevant to a prompt, created on first use.
+        rerank (bool): Whether `recommend_note` lets the AI model pick from the closest notes
+            rather than taking the closest one.
+        num_candidates (int): The number of closest notes the AI model picks from when reranking.
+        context_builder (ContextBuilder): Fits the notes given to the AI model as context into a
+            token budget, ranking passages with `score_passages`.
+        last_context (Context | None): The context assembled by the last call to
+            `get_similar_notes_contents`, including how much was dropped.
+        stream (bool): Whether `ask_yourself` and `summarize` print the response as it is
+            generated rather than once it is complete.
+        time_to_first_token (float | None): Seconds between sending the last streamed request and
+            receiving the first text of its response.
+        response_cache (ResponseCache | None): Stores responses so identical requests aren't
+            sent again, or None if disabled.
+        max_cache_temperature (float): Requests with a higher temperature skip the response
+            cache unless it is forced.
     """
 
     def __init__(self, notes_directory):
@@ -43,10 +72,220 @@ class SmartAssistant:
         self.ai_provider = AI_PROVIDER
         if self.ai_provider == "ollama":
             self.model = OLLAMA_MODEL
-            self.client = ollama.Client(host=OLLAMA_HOST)
         else:
             self.model = OPENAI_MODEL
-            self.client = OpenAI(api_key=os.getenv("OPENAI_KEY"))
+        self._client = None
+        self._creator = None
+        # the stored embedding of every note, normalized once per session on first use
+        self._note_embeddings = None
+        self.rerank = RECOMMEND_RERANK
+        self.num_candidates = RECOMMEND_CANDIDATES
+        self.context_builder = ContextBuilder(score_function=self.score_passages)
+        self.last_context = None
+        self.stream = STREAM_RESPONSES
+        self.time_to_first_token = None
+        self.response_cache = (
+            ResponseCache(self.notes_directory) if USE_RESPONSE_CACHE else None
+        )
+        self.max_cache_temperature = RESPONSE_CACHE_MAX_TEMPERATURE
+
+    @property
+    def client(self):
+        """
+        Returns the client for the AI provider, importing the provider's library and creating the
+        client on first use.
+
+        Returns:
+            OpenAI | ollama.Client: The client used to make requests.
+        """
+        if self._client is None:
+            if self.ai_provider == "ollama":
+                import ollama
+
+                self._client = ollama.Client(host=OLLAMA_HOST)
+            else:
+                from openai import OpenAI
+
+                self._client = OpenAI(api_key=os.getenv("OPENAI_KEY"))
+
+        return self._client
+
+    @client.setter
+    def client(self, client):
+        self._client = client
+
+    @property
+    def creator(self):
+        """
+        Returns the lightning links creator for the vault, whose embedding model is only loaded
+        once a prompt is embedded.
+
+        Returns:
+            LightningLinksCreator: The creator sharing the embedding model and settings.
+        """
+        if self._creator is None:
+            self._creator = LightningLinksCreator(self.notes_directory)
+
+        return self._creator
+
+    @creator.setter
+    def creator(self, creator):
+        self._creator = creator
+        self._note_embeddings = None
+
+    def get_note_embeddings(self):
+        """
+        Returns the embeddings the lightning links creator stored for the notes in the vault.
+        Notes that weren't encoded by the last refresh are left out.
+
+        Returns:
+            tuple[list[str], np.ndarray]: The file name of each stored note and an (N, d) matrix
+                of their normalized embeddings.
+        """
+        if self._note_embeddings is None:
+            cache = self.creator.get_embedding_cache()
+            file_names = [
+                file_name
+                for file_name in self.file_handler.file_names
+                if file_name in cache.entries
+            ]
+            rows = [cache.entries[file_name]["row"] for file_name in file_names]
+            embeddings = (
+                normalize(cache.matrix[rows])
+                if rows
+                else np.empty((0, 0), dtype=np.float32)
+            )
+            self._note_embeddings = (file_names, embeddings)
+
+        return self._note_embeddings
+
+    def find_relevant_notes(self, prompt: str, k: int) -> list[tuple[str, float]]:
+        """
+        Finds the notes closest to a prompt by embedding the prompt with the model used for the
+        lightning links and comparing it with the stored note embeddings, without contacting the
+        AI provider.
+
+        Args:
+            prompt (str): The user's input or query.
+            k (int): The number of notes to return.
+
+        Returns:
+            list[tuple[str, float]]: The file names and cosine similarities of the k closest
+                notes, from most to least similar. Empty if no note embeddings are stored.
+        """
+        file_names, embeddings = self.get_note_embeddings()
+        k = min(k, len(file_names))
+        if k <= 0:
+            return []
+
+        query = normalize(
+            self.creator.encoder.encode([prompt], show_progress_bar=False)
+        )[0]
+        scores = embeddings @ query
+
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top], kind="stable")]
+
+        return [(file_names[index], float(scores[index])) for index in top]
+
+    def score_passages(self, prompt: str, passages: list[str]) -> list[float]:
+        """
+        Scores passages by the cosine similarity of their embeddings to the prompt's embedding.
+
+        Args:
+            prompt (str): The prompt the passages should be relevant to.
+            passages (list[str]): The passages to score.
+
+        Returns:
+            list[float]: The similarity of each passage to the prompt.
+        """
+        embeddings = normalize(
+            self.creator.encoder.encode([prompt] + passages, show_progress_bar=False)
+        )
+
+        return (embeddings[1:] @ embeddings[0]).tolist()
+
+    @staticmethod
+    def get_note_request(prompt: str, note_names: list[str]):
+        """
+        Builds the request asking the AI model which of the given notes is the most relevant to
+        a prompt.
+
+        Args:
+            prompt (str): The user's input or query.
+            note_names (list[str]): The names, without extension, of the notes to pick from.
+
+        Returns:
+            tuple[str, str, Type[BaseModel]]: The system prompt, the user prompt and the
+                structure of the response.
+        """
+
+        from pydantic import BaseModel
+
+        class FileName(BaseModel):
+            file_name: str
+
+        system_prompt = (
+            "You are a research assistant who's job is to suggest the most relevant file for a given prompt."
+            " and return its name making sure to select one from list of files provided. "
+        )
+
+        all_note_names = ""
+
+        for note_name in note_names:
+            all_note_names += note_name + "\n"
+
+        # remove the links
+        user_prompt = prompt + "\n\n\nFiles:\n" + all_note_names
+
+        return system_prompt, user_prompt, FileName
+
+    def ask_for_note(self, prompt: str, note_names: list[str]) -> str:
+        """
+        Asks the AI model which of the given notes is the most relevant to a prompt.
+
+        Args:
+            prompt (str): The user's input or query.
+            note_names (list[str]): The names, without extension, of the notes to pick from.
+
+        Returns:
+            str: The name of the note the model picked.
+        """
+        system_prompt, user_prompt, structure = self.get_note_request(
+            prompt, note_names
+        )
+        suggestion = self.make_ai_request(system_prompt, user_prompt, 0.1, structure)
+
+        return suggestion.file_name.removesuffix(NOTE_EXTENSION)
+
+    def find_note_file(
+        self, note_name: str, candidates: list[tuple[str, float]] = None
+    ):
+        """
+        Finds the file of a note the AI model picked by name.
+
+        Args:
+            note_name (str): The name, without extension, the model picked.
+            candidates (list[tuple[str, float]], optional): The notes the model picked from, as
+                returned by `find_relevant_notes`. Defaults to every note in the vault.
+
+        Returns:
+            str: The note's file name. For a name that isn't a candidate, the closest candidate,
+                or without candidates, the name with the note extension.
+        """
+        if candidates is None:
+            file_names = dict(
+                zip(self.file_handler.note_names, self.file_handler.file_names)
+            )
+            return file_names.get(note_name, note_name + NOTE_EXTENSION)
+
+        candidate_names = {
+            os.path.basename(file_name).removesuffix(NOTE_EXTENSION): file_name
+            for file_name, _ in candidates
+        }
+
+        # fall back to the closest note if the model picked a note that wasn't offered
+        return candidate_names.get(note_name, candidates[0][0])
 
     def get_core_similar_notes(self, notes):
         # a much simpler version of parse_similar() that only gets the body and file name for each note.
@@ -66,7 +305,12 @@ class SmartAssistant:
         return similar_bodies
 
     def make_openai_request(
-        self, system: str, user: str, temp: float, structure: Type[pydantic.BaseModel] = None
+        self,
+        system: str,
+        user: str,
+        temp: float,
+        structure: Type["BaseModel"] = None,
+        stream: bool = False,
     ):
         """
         Makes a request to OpenAI's API for generating a completion based on the provided
@@ -87,11 +331,36 @@ class SmartAssistant:
                 randomness.
             structure: Specifies how the response from the AI should be
                 structured or parsed.
+            stream: Whether to return the response's text piece by piece as it is generated.
+                Structured responses can't be streamed.
 
         Returns:
-            The parsed content of the AI's response message.
+            The parsed content of the AI's response message, or with `stream`, an iterator over
+            the pieces of its text.
+
+        Raises:
+            ValueError: If both `structure` and `stream` are given.
         """
 
+        if stream:
+            if structure is not None:
+                raise ValueError("Structured responses can't be streamed")
+
+            chunks = self.client.chat.completions.create(
+                model=self.model,
+                temperature=temp,
+                messages=[
+                    {"role": "system", "content": system},
+                    {"role": "user", "content": user},
+                ],
+                stream=True,
+            )
+            return (
+                chunk.choices[0].delta.content
+                for chunk in chunks
+                if chunk.choices and chunk.choices[0].delta.content
+            )
+
         # check for a structured response
         if structure is None:
             completion = self.client.beta.chat.completions.parse(
@@ -117,14 +386,54 @@ class SmartAssistant:
         return completion.choices[0].message.parsed
 
     def make_ollama_request(
-        self, system: str, user: str, temp: float, structure: Type[pydantic.BaseModel] = None
+        self,
+        system: str,
+        user: str,
+        temp: float,
+        structure: Type["BaseModel"] = None,
+        stream: bool = False,
     ):
+        """
+        Makes a chat request to the Ollama server, validating the JSON response against
+        `structure` when one is given.
+
+        Args:
+            system: The system prompt.
+            user: The user prompt.
+            temp: The sampling temperature.
+            structure: The pydantic model the response should be parsed into.
+            stream: Whether to return the response's text piece by piece as it is generated.
+                Structured responses can't be streamed.
+
+        Returns:
+            The response's text, the parsed `structure`, or with `stream`, an iterator over the
+            pieces of the response's text.
+
+        Raises:
+            ValueError: If both `structure` and `stream` are given.
+        """
         messages = [
             {"role": "system", "content": system},
             {"role": "user", "content": user},
         ]
         options = {"temperature": temp}
 
+        if stream:
+            if structure is not None:
+                raise ValueError("Structured responses can't be streamed")
+
+            parts = self.client.chat(
+                model=self.model,
+                messages=messages,
+                options=options,
+                stream=True,
+            )
+            return (
+                part["message"]["content"]
+                for part in parts
+                if part["message"]["content"]
+            )
+
         if structure:
             response = self.client.chat(
                 model=self.model,
@@ -145,54 +454,170 @@ class SmartAssistant:
             )
             return response["message"]["content"]
 
-    def make_ai_request(
-        self, system: str, user: str, temp: float, structure: Type[pydantic.BaseModel] = None
+    def send_ai_request(
+        self,
+        system: str,
+        user: str,
+        temp: float,
+        structure: Type["BaseModel"] = None,
+        stream: bool = False,
     ):
+        # sends the request to the configured provider without checking the response cache
         if self.ai_provider == "ollama":
-            return self.make_ollama_request(system, user, temp, structure)
+            return self.make_ollama_request(system, user, temp, structure, stream)
         else:
-            return self.make_openai_request(system, user, temp, structure)
+            return self.make_openai_request(system, user, temp, structure, stream)
 
-    def recommend_note(self, prompt: str):
+    def make_ai_request(
+        self,
+        system: str,
+        user: str,
+        temp: float,
+        structure: Type["BaseModel"] = None,
+        stream: bool = False,
+        use_cache: bool = None,
+    ):
         """
-        Suggests the most relevant file for a given user prompt based on the provided files list.
-        Utilizes OpenAI to infer the best match by analyzing the given system prompt, user prompt,
-        and available file names. Returns the name of the most relevant file.
+        Makes a request to the configured AI provider, answering it from the response cache when
+        the same request was made before.
 
         Args:
-            prompt: A string containing the user's input or query for which the most relevant file
-                needs to be identified.
+            system: The system prompt.
+            user: The user prompt.
+            temp: The sampling temperature.
+            structure: The pydantic model the response should be parsed into.
+            stream: Whether to return the response's text piece by piece as it is generated. A
+                cached response is returned as a single piece.
+            use_cache: True to use the response cache whatever the temperature, False to skip
+                it. By default, only requests with a temperature up to `max_cache_temperature`
+                use it.
 
         Returns:
-            str: The name of the suggested file from the available list of file names.
+            The response's text, the parsed `structure`, or with `stream`, an iterator over the
+            pieces of the response's text.
         """
+        cache = self.response_cache
+        if cache is None:
+            return self.send_ai_request(system, user, temp, structure, stream)
+        if use_cache is None:
+            use_cache = temp <= self.max_cache_temperature
+        if not use_cache:
+            cache.bypassed += 1
+            return self.send_ai_request(system, user, temp, structure, stream)
+
+        key = cache.make_key(
+            self.ai_provider,
+            self.model,
+            temp,
+            None if structure is None else structure.model_json_schema(),
+            system,
+            user,
+        )
+        cached = cache.get(key)
+        if cached is not None:
+            if structure is not None:
+                return structure.model_validate_json(cached)
+            return iter([cached]) if stream else cached
 
-        class FileName(pydantic.BaseModel):
-            file_name: str
+        response = self.send_ai_request(system, user, temp, structure, stream)
+        if stream:
+            return self.cache_stream(key, response)
 
-        system_prompt = (
-            "You are a research assistant who's job is to suggest the most relevant file for a given prompt."
-            " and return its name making sure to select one from list of files provided. "
-        )
+        cache.put(key, response if structure is None else response.model_dump_json())
 
-        all_note_names = ""
+        return response
 
-        for note_name in self.file_handler.note_names:
-            all_note_names += note_name + "\n"
+    def cache_stream(self, key: str, pieces):
+        """
+        Passes on the pieces of a streamed response, storing the whole response in the response
+        cache once the stream has ended. A stream that isn't read to the end isn't stored.
 
-        # remove the links
-        user_prompt = prompt + "\n\n\nFiles:\n" + all_note_names
-        temperature = 0.1
+        Args:
+            key (str): The request's cache key.
+            pieces (Iterator[str]): The streamed response.
+
+        Yields:
+            str: Each piece of the response.
+        """
+        received = []
+        for piece in pieces:
+            received.append(piece)
+            yield piece
+
+        self.response_cache.put(key, "".join(received))
+
+    def print_response(self, system: str, user: str, temp: float) -> str:
+        """
+        Requests a plain text response and prints it. With `stream`, each piece of the response
+        is printed as soon as it arrives, so the first words show up without waiting for the
+        whole response, and the time until they arrived is kept in `time_to_first_token`.
+
+        Args:
+            system: The system prompt.
+            user: The user prompt.
+            temp: The sampling temperature.
+
+        Returns:
+            str: The full response.
+        """
+        if not self.stream:
+            response = self.make_ai_request(system, user, temp)
+            print(response)
+            return response
+
+        start_time = perf_counter()
+        self.time_to_first_token = None
+        pieces = []
+        for piece in self.make_ai_request(system, user, temp, stream=True):
+            if self.time_to_first_token is None:
+                self.time_to_first_token = perf_counter() - start_time
+            print(piece, end="", flush=True)
+            pieces.append(piece)
+        print()
+
+        return "".join(pieces)
+
+    def recommend_note(self, prompt: str):
+        """
+        Suggests the most relevant file for a given user prompt.
+
+        The prompt is embedded with the same model the lightning links are made with and compared
+        with the stored note embeddings, so the suggestion takes milliseconds whatever the size of
+        the vault. With `rerank`, the AI model picks from only the `num_candidates` closest notes.
+        If no embeddings are stored yet, the AI model picks from every note name instead.
+
+        Args:
+            prompt: A string containing the user's input or query for which the most relevant file
+                needs to be identified.
+
+        Returns:
+            str: The file name of the suggested note.
+        """
 
         print("Looking for relevant file...")
 
-        suggestion = self.make_ai_request(
-            system_prompt, user_prompt, temperature, FileName
+        candidates = self.find_relevant_notes(
+            prompt, self.num_candidates if self.rerank else 1
         )
+        if not candidates:
+            print(
+                "No note embeddings found, run the lightning links creator to speed this up"
+            )
+            return self.find_note_file(
+                self.ask_for_note(prompt, self.file_handler.note_names)
+            )
+
+        if not self.rerank or len(candidates) == 1:
+            return candidates[0][0]
 
-        return suggestion.file_name + NOTE_EXTENSION
+        note_names = [
+            os.path.basename(file_name).removesuffix(NOTE_EXTENSION)
+            for file_name, _ in candidates
+        ]
+
+        return self.find_note_file(self.ask_for_note(prompt, note_names), candidates)
 
-    def get_similar_notes_contents(self, note_name: str):
+    def get_similar_notes_contents(self, note_name: str, prompt: str = None):
         """
         Retrieves and formats the contents of similar notes to the specified note.
 
@@ -200,17 +625,38 @@ class SmartAssistant:
         located, even if not included in the note listing. It then retrieves a list of similar
         notes to the specified note, appending the specified note itself to the list. The contents
         of each similar note are parsed and formatted, including file name, links, tags,
-        and body content.
+        and body content. If the notes don't fit the context builder's token budget, only the
+        passages most relevant to the prompt are kept.
 
         Args:
             note_name (str): The name of the note (without file extension) for which similar notes
             need to be retrieved.
+            prompt (str, optional): The prompt the notes are given as context for, used to pick
+                passages when the notes don't fit the budget.
 
         Returns:
             str: A formatted string containing details of all similar notes, including their file
             names, links, tags, and body content.
         """
 
+        similar_notes = self.get_similar_note_names(note_name)
+
+        return self.build_context(
+            [(note, self.file_handler.parse_note(note)) for note in similar_notes],
+            prompt,
+        )
+
+    def get_similar_note_names(self, note_name: str) -> list[str]:
+        """
+        Returns the file names of a note's similar notes followed by the note itself.
+
+        Args:
+            note_name (str): The note's file name, with or without the vault path.
+
+        Returns:
+            list[str]: The full file names of the similar notes and the note.
+        """
+
         # load similar
 
         print(f"Getting notes related to {note_name}")
@@ -218,21 +664,34 @@ class SmartAssistant:
         # normalize incoming note_name to the posix-style full path key used in similar_notes
         base = self.file_handler.notes_directory
         key = note_name if str(note_name).startswith(base) else f"{base}{note_name}"
-        similar_notes = self.similar_notes[key]
+        # copy the list so appending the note itself doesn't change the loaded similar notes
+        similar_notes = list(self.similar_notes[key])
         # append the canonical key
         similar_notes.append(key)
 
-        similar_notes_parsed = ""
+        return similar_notes
 
-        for note in similar_notes:
-            current_similar = self.file_handler.parse_note(note)
-            similar_notes_parsed += "file_name: " + note + "\n"
-            similar_notes_parsed += "links: " + current_similar["links"] + "\n"
-            similar_notes_parsed += "tags: " + current_similar["tags"] + "\n"
-            similar_notes_parsed += "body: " + current_similar["body"] + "\n"
-            similar_notes_parsed += "\n"
+    def build_context(self, notes: list, prompt: str = None) -> str:
+        """
+        Formats parsed notes as context for the AI model with `context_builder`, reporting what
+        had to be dropped to fit the token budget.
 
-        return similar_notes_parsed
+        Args:
+            notes (list[tuple[str, Note]]): The file name and parsed note of each note.
+            prompt (str, optional): The prompt the notes are given as context for.
+
+        Returns:
+            str: The formatted notes.
+        """
+        self.last_context = self.context_builder.build(notes, prompt)
+        if self.last_context.dropped_passages:
+            print(
+                f"Trimmed {self.last_context.dropped_tokens} tokens from "
+                f"{self.last_context.dropped_passages} passages to fit "
+                f"{self.context_builder.max_tokens} tokens"
+            )
+
+        return self.last_context.text
 
     def create(self, prompt: str):
         """
@@ -251,17 +710,42 @@ class SmartAssistant:
         """
         print("Creating new note: \n")
 
-        class NewFile(pydantic.BaseModel):
+        # get a suggested file that matches the user suggest topic
+        file_name = self.recommend_note(prompt)
+        similar_notes_parsed = self.get_similar_notes_contents(file_name, prompt)
+
+        system_prompt, user_prompt, structure = self.get_create_request(
+            prompt, similar_notes_parsed
+        )
+        # request, skipping the response cache so asking again creates a different note
+        request = self.make_ai_request(
+            system_prompt, user_prompt, 0.5, structure, use_cache=False
+        )
+
+        self.save_new_note(request)
+
+    def get_create_request(self, prompt: str, similar_notes_parsed: str):
+        """
+        Builds the request asking the AI model for a new note on a topic.
+
+        Args:
+            prompt (str): The topic the note should cover.
+            similar_notes_parsed (str): The formatted contents of related notes.
+
+        Returns:
+            tuple[str, str, Type[BaseModel]]: The system prompt, the user prompt and the
+                structure of the new note.
+        """
+
+        from pydantic import BaseModel
+
+        class NewFile(BaseModel):
             file_name: str
             links: str
             tags: str
             body: str
             similar_notes: list[str]
 
-        # get a suggested file that matches the user suggest topic
-        file_name = self.recommend_note(prompt)
-        similar_notes_parsed = self.get_similar_notes_contents(file_name)
-
         # get all note names
         all_note_names = self.file_handler.note_names
 
@@ -282,9 +766,18 @@ class SmartAssistant:
 
         user_prompt = f"""{prompt} \nSimilar Notes: \n{similar_notes_parsed} \n All Available Links\n {all_note_names}"""
 
-        # request
-        request = self.make_ai_request(system_prompt, user_prompt, 0.5, NewFile)
+        return system_prompt, user_prompt, NewFile
+
+    def save_new_note(self, request) -> str:
+        """
+        Writes a note created by the AI model to the vault.
+
+        Args:
+            request (NewFile): The note returned by the AI model.
 
+        Returns:
+            str: The new note's file name.
+        """
         new_note = {
             # store file_name as posix-style full path to be compatible with FileParser.file_names
             "file_name": f"{self.file_handler.notes_directory}{self.clean_up_note_name(request.file_name)}",
@@ -299,6 +792,8 @@ class SmartAssistant:
 
         print(f"Successfully created note: {new_note['file_name']}")
 
+        return new_note["file_name"]
+
     def suggest(self):
         """
         Suggests a new note topic based on analysis of current and similar notes, and provides reasoning for the suggestion.
@@ -318,36 +813,18 @@ class SmartAssistant:
             None
         """
 
-        class Suggestion(pydantic.BaseModel):
-            suggestion: str
-            reasoning: str
-
         current_note = self.file_handler.get_current_note()
 
         # load similar
 
         similar_notes_parsed = self.get_similar_notes_contents(current_note)
-        all_note_names = self.file_handler.note_names
-
-        system_prompt = """
-            You will be provided with the parsed contents of a note, as well as some similar notes that reference the same topic, as well as a list of links to select for the linking process.
-            Your goal is to suggest a topic for a note that is not covered by the overall list of files provided and that covers a similar topic to the example notes
-            Your out put should be structured in a way that aligns with the parameters of the Response class, and provides a reasoning for the suggestion provided
-            - suggestion: a topic that is related to the fields provided, but is not covered in the overall list of all available notes
-            - reasoning: a short reasoning for the suggestion provided
-            
-            The example notes will be structured in this format:
-            - file_name: short title summarizing the main idea of the note
-            - links: a string of links to other notes or resources related to the note seperated by newlines
-            - tags: a string of keywords or tags associated with the note
-            - body: a note on the topic provided in the user prompt that matches the styling of the other bodies provided
-            - similar_notes: array of titles (or identifiers) of related notes or similar entries if present
-            """
-
-        user_prompt = f"""\nSimilar Notes: \n{similar_notes_parsed} \n All Available Notes\n {all_note_names}"""
 
+        system_prompt, user_prompt, structure = self.get_suggest_request(
+            similar_notes_parsed
+        )
+        # skip the response cache so asking again can suggest a different topic
         response = self.make_ai_request(
-            system_prompt, user_prompt, 0.5, Suggestion
+            system_prompt, user_prompt, 0.5, structure, use_cache=False
         )
 
         print(
@@ -367,6 +844,46 @@ class SmartAssistant:
             prompt = f"create a note about {response.suggestion}"
             self.create(prompt)
 
+    def get_suggest_request(self, similar_notes_parsed: str):
+        """
+        Builds the request asking the AI model for a topic missing from the vault.
+
+        Args:
+            similar_notes_parsed (str): The formatted contents of the notes the topic should
+                relate to.
+
+        Returns:
+            tuple[str, str, Type[BaseModel]]: The system prompt, the user prompt and the
+                structure of the suggestion.
+        """
+
+        from pydantic import BaseModel
+
+        class Suggestion(BaseModel):
+            suggestion: str
+            reasoning: str
+
+        all_note_names = self.file_handler.note_names
+
+        system_prompt = """
+            You will be provided with the parsed contents of a note, as well as some similar notes that reference the same topic, as well as a list of links to select for the linking process.
+            Your goal is to suggest a topic for a note that is not covered by the overall list of files provided and that covers a similar topic to the example notes
+            Your out put should be structured in a way that aligns with the parameters of the Response class, and provides a reasoning for the suggestion provided
+            - suggestion: a topic that is related to the fields provided, but is not covered in the overall list of all available notes
+            - reasoning: a short reasoning for the suggestion provided
+            
+            The example notes will be structured in this format:
+            - file_name: short title summarizing the main idea of the note
+            - links: a string of links to other notes or resources related to the note seperated by newlines
+            - tags: a string of keywords or tags associated with the note
+            - body: a note on the topic provided in the user prompt that matches the styling of the other bodies provided
+            - similar_notes: array of titles (or identifiers) of related notes or similar entries if present
+            """
+
+        user_prompt = f"""\nSimilar Notes: \n{similar_notes_parsed} \n All Available Notes\n {all_note_names}"""
+
+        return system_prompt, user_prompt, Suggestion
+
     def ask_yourself(self, prompt: str) -> str:
         """
         Generates a response by leveraging research notes relevant to the input prompt, in accordance
@@ -390,21 +907,35 @@ class SmartAssistant:
 
         # now we get the similar files and ask for a response based on their inputs
 
+        # get the source material
+
+        extracted_references = self.get_similar_notes_contents(recommended_note, prompt)
+
+        return self.print_response(
+            *self.get_ask_request(prompt, extracted_references), 0.4
+        )
+
+    @staticmethod
+    def get_ask_request(prompt: str, extracted_references: str) -> tuple[str, str]:
+        """
+        Builds the request asking the AI model to answer a question from the user's notes.
+
+        Args:
+            prompt (str): The user's question.
+            extracted_references (str): The formatted contents of the relevant notes.
+
+        Returns:
+            tuple[str, str]: The system prompt and the user prompt.
+        """
         system_prompt = (
             "You are a research assistant who's job is to provide a response based on the user's "
             "input using their research notes as the basis for your response. While also making "
             "sure to respond in accordance with the style of the notes you have been given."
         )
-        # get the source material
-
-        extracted_references = self.get_similar_notes_contents(recommended_note)
 
         user_prompt = prompt + "\n\n\nNotes:\n" + extracted_references
 
-        response = self.make_ai_request(system_prompt, user_prompt, 0.4)
-
-        print(response)
-        return response
+        return system_prompt, user_prompt
 
     def summarize(self, prompt: str) -> str:
         """
@@ -420,9 +951,23 @@ class SmartAssistant:
         """
         # get the most relevant note and sources
         reccended_note = self.recommend_note(prompt)
-        sources = self.get_similar_notes_contents(reccended_note)
+        sources = self.get_similar_notes_contents(reccended_note, prompt)
 
         # formulate response and make open ai request
+        return self.print_response(*self.get_summarize_request(prompt, sources), 0.7)
+
+    @staticmethod
+    def get_summarize_request(prompt: str, sources: str) -> tuple[str, str]:
+        """
+        Builds the request asking the AI model to summarize a topic from the user's notes.
+
+        Args:
+            prompt (str): The topic to summarize.
+            sources (str): The formatted contents of the relevant notes.
+
+        Returns:
+            tuple[str, str]: The system prompt and the user prompt.
+        """
         system_prompt = (
             "You are a research assistant who's job is to summarize the user's input using the provided notes as the "
             "basis for your response. The goal is to create a summary that can be interpreted by a random non-expert. "
@@ -433,10 +978,7 @@ class SmartAssistant:
 
         user_prompt = f"Topic Prompt: {prompt}\nSource Material:\n{sources}"
 
-        response = self.make_ai_request(system_prompt, user_prompt, 0.7)
-        print(response)
-
-        return response
+        return system_prompt, user_prompt
 
     @staticmethod
     def clean_up_note_name(note_name: str) -> str:
@@ -459,7 +1001,6 @@ if __name__ == "__main__":
     if len(arguments) > 1:
         directory = arguments[1]
     else:
-        print(torch.cuda.is_available())
         print("Welcome to the Lightning Notes Assistant!")
         print(
             "The best way to find holes in your notes, and automagically create plugs to fill them"
@@ -508,4 +1049,6 @@ if __name__ == "__main__":
                 input("Enter the topic you would like a summary of: ")
             )
         if command == "q":
+            if smart_assistant.response_cache is not None:
+                print(f"Response cache: {smart_assistant.response_cache.stats()}")
             break
@@ -0,0 +1,430 @@
+import os
+from time import monotonic, sleep, time
+
+import numpy as np
+
+from src.constants import USE_EMBEDDING_CACHE, WATCH_DEBOUNCE, WATCH_POLL_INTERVAL
+from src.embedding_cache import EmbeddingCache
+from src.refresh_state import RefreshState
+from src.similarity_search import (
+    normalize,
+    rows_per_block,
+    select_top_k,
+    top_k_similarities,
+)
+
+
+class VaultWatcher:
+    def __init__(
+        self,
+        creator,
+        poll_interval: float = WATCH_POLL_INTERVAL,
+        debounce: float = WATCH_DEBOUNCE,
+    ):
+        """
+        Keeps lightning links up to date while notes are being edited.
+
+        The watcher keeps the creator's model and the normalized embedding of every note in
+        memory. It polls the vault for notes whose modification time or size changed and waits
+        until a note has stayed unchanged for `debounce` seconds, so a burst of saves is handled
+        once. Only the saved notes are re-embedded, and only the notes whose similar notes could
+        have changed (the saved notes, the notes that listed them, and the notes they now beat)
+        are re-ranked and patched with `FileParser.write_lightning_links`. The new embeddings
+        are written to the embedding cache and the patched notes to the refresh state, so the
+        next incremental refresh doesn't encode them again, and only their entries in the similar
+        notes store are rewritten.
+
+        Attributes:
+            creator (LightningLinksCreator): Provides the model, file handler and settings.
+            file_handler (FileParser): The creator's file handler.
+            poll_interval (float): Seconds between checks of the vault.
+            debounce (float): Seconds a note must stay unchanged before it is processed.
+            file_names (list[str]): The notes held in memory, in matrix order.
+            embeddings (np.ndarray): The normalized embedding of each note.
+            neighbour_indexes (np.ndarray): (N, k) indexes of each note's most similar notes.
+            neighbour_scores (np.ndarray): (N, k) scores matching `neighbour_indexes`.
+            content_hashes (dict): The content hash of each note re-embedded while watching.
+            refresh_state (RefreshState): The refresh state, loaded on the first change.
+            snapshot (dict): The (mtime_ns, size) of every note as last processed.
+            pending (dict): Notes seen changing, mapped to their latest (mtime_ns, size) and the
+                time that state was first seen.
+
+        Args:
+            creator: The LightningLinksCreator whose vault should be watched.
+            poll_interval: Seconds between checks of the vault.
+            debounce: Seconds a note must stay unchanged before it is processed.
+        """
+        self.creator = creator
+        self.file_handler = creator.file_handler
+        self.poll_interval = poll_interval
+        self.debounce = debounce
+
+        self.file_names = []
+        self.positions = {}
+        self.embeddings = None
+        self.neighbour_indexes = None
+        self.neighbour_scores = None
+        self.content_hashes = {}
+        self.refresh_state = None
+
+        self.snapshot = {}
+        self.pending = {}
+
+    def load(self):
+        """
+        Brings the vault up to date with an incremental refresh, then loads the embedding of
+        every note into memory, reading them from the embedding cache when it is enabled and
+        holds every note.
+
+        Returns:
+            None
+        """
+        self.creator.refresh_similarities(incremental=True)
+
+        file_names = list(self.file_handler.file_names)
+        cache = self.creator.get_embedding_cache() if USE_EMBEDDING_CACHE else None
+        if (
+            cache is not None
+            and cache.matrix is not None
+            and all(file_name in cache.entries for file_name in file_names)
+        ):
+            rows = [cache.entries[file_name]["row"] for file_name in file_names]
+            embeddings = cache.matrix[rows]
+        else:
+            notes = self.file_handler.load_all_note_files(file_names)
+            embeddings = self.encode(self.creator.extract_bodies(notes))
+
+        self.set_embeddings(file_names, embeddings)
+        self.snapshot = self.scan()
+
+    def encode(self, bodies: list[str]) -> np.ndarray:
+        """
+        Encodes note bodies with the resident model and the creator's encoder.
+
+        Args:
+            bodies (list[str]): The note bodies to encode.
+
+        Returns:
+            np.ndarray: The normalized embedding of each body.
+        """
+        return normalize(self.creator.encoder.encode(bodies, show_progress_bar=False))
+
+    def set_embeddings(self, file_names: list[str], embeddings):
+        """
+        Replaces the notes held in memory and ranks the most similar notes for all of them.
+
+        Args:
+            file_names (list[str]): The notes, in the same order as `embeddings`.
+            embeddings (array-like): One embedding per note.
+
+        Returns:
+            None
+        """
+        self.file_names = list(file_names)
+        self.positions = {
+            file_name: position for position, file_name in enumerate(self.file_names)
+        }
+        self.embeddings = normalize(embeddings)
+
+        self.neighbour_indexes, self.neighbour_scores = top_k_similarities(
+            self.embeddings,
+            self.creator.num_similar_notes,
+            self.creator.similarity_memory_budget,
+        )
+
+    def scan(self) -> dict:
+        """
+        Lists the notes in the vault along with their modification time and size. The vault is
+        only walked again when a folder changed, see `FileParser.rescan_vault`.
+
+        Returns:
+            dict: Maps each note's file name to its (mtime_ns, size).
+        """
+        self.file_handler.rescan_vault()
+
+        return {
+            file_name: (stat_result.st_mtime_ns, stat_result.st_size)
+            for file_name, stat_result in self.file_handler.file_stats.items()
+        }
+
+    def poll(self):
+        """
+        Checks the vault for saved and deleted notes. A saved note is only reported once it has
+        stayed unchanged for `debounce` seconds.
+
+        Returns:
+            tuple[list[str], list[str]]: The notes that were saved and the notes that were deleted.
+        """
+        current = self.scan()
+        now = monotonic()
+
+        for file_name, stats in current.items():
+            if self.snapshot.get(file_name) == stats:
+                self.pending.pop(file_name, None)
+            elif self.pending.get(file_name, (None,))[0] != stats:
+                # the note changed again, so restart its debounce timer
+                self.pending[file_name] = (stats, now)
+
+        changed = [
+            file_name
+            for file_name, (stats, first_seen) in self.pending.items()
+            if now - first_seen >= self.debounce and file_name in current
+        ]
+        for file_name in changed:
+            self.snapshot[file_name] = self.pending.pop(file_name)[0]
+
+        deleted = [file_name for file_name in self.snapshot if file_name not in current]
+        for file_name in deleted:
+            del self.snapshot[file_name]
+            self.pending.pop(file_name, None)
+
+        return changed, deleted
+
+    def remove_notes(self, deleted: list[str]) -> set:
+        """
+        Removes deleted notes from memory.
+
+        Args:
+            deleted (list[str]): The notes that were deleted.
+
+        Returns:
+            set: The positions, after removal, of notes that listed a deleted note.
+        """
+        removed = [
+            self.positions[file_name]
+            for file_name in deleted
+            if file_name in self.positions
+        ]
+        if not removed:
+            return set()
+
+        keep = np.ones(len(self.file_names), dtype=bool)
+        keep[removed] = False
+        referrers = np.isin(self.neighbour_indexes, removed).any(axis=1) & keep
+
+        # every remaining index shifts down by the number of removed rows before it
+        new_positions = (np.cumsum(keep) - 1).astype(np.int32)
+        self.neighbour_indexes = new_positions[self.neighbour_indexes[keep]]
+        self.neighbour_scores = self.neighbour_scores[keep]
+        self.embeddings = self.embeddings[keep]
+        self.file_names = [
+            file_name for file_name, kept in zip(self.file_names, keep) if kept
+        ]
+        self.positions = {
+            file_name: position for position, file_name in enumerate(self.file_names)
+        }
+
+        return set(new_positions[np.nonzero(referrers)[0]].tolist())
+
+    def update_notes(self, changed: list[str]) -> set:
+        """
+        Re-embeds saved notes and adds new notes to memory.
+
+        Args:
+            changed (list[str]): The notes that were saved or created.
+
+        Returns:
+            set: The positions of notes whose similar notes may have changed.
+        """
+        notes = self.file_handler.load_all_note_files(
+            [file_name for file_name in changed if os.path.exists(file_name)]
+        )
+        if not notes:
+            return set()
+
+        bodies = self.creator.extract_bodies(notes)
+        embeddings = self.creator.encoder.encode(bodies, show_progress_bar=False)
+        vectors = normalize(embeddings)
+
+        file_names = [note["file_name"] for note in notes]
+        hashes = [EmbeddingCache.content_hash(body) for body in bodies]
+        self.content_hashes.update(zip(file_names, hashes))
+        if USE_EMBEDDING_CACHE:
+            self.creator.get_embedding_cache().update(file_names, hashes, embeddings)
+
+        rows = []
+        new_vectors = []
+        for note, vector in zip(notes, vectors):
+            row = self.positions.get(note["file_name"])
+            if row is None:
+                # new notes are appended and ranked below
+                row = len(self.file_names) + len(new_vectors)
+                self.positions[note["file_name"]] = row
+                self.file_names.append(note["file_name"])
+                new_vectors.append(vector)
+            else:
+                self.embeddings[row] = vector
+            rows.append(row)
+
+        if new_vectors:
+            k = self.neighbour_indexes.shape[1]
+            self.embeddings = np.vstack([self.embeddings, new_vectors])
+            self.neighbour_indexes = np.vstack(
+                [self.neighbour_indexes, np.zeros((len(new_vectors), k), np.int32)]
+            )
+            self.neighbour_scores = np.vstack(
+                [
+                    self.neighbour_scores,
+                    np.full((len(new_vectors), k), -np.inf, np.float32),
+                ]
+            )
+
+        # notes that listed a saved note, since its score against them has changed
+        affected = np.isin(self.neighbour_indexes, rows).any(axis=1)
+
+        # notes whose weakest similar note is now beaten by a saved note
+        if self.neighbour_scores.shape[1]:
+            scores = self.embeddings @ self.embeddings[rows].T
+            affected |= (scores > self.neighbour_scores[:, -1:]).any(axis=1)
+
+        return set(rows) | set(np.nonzero(affected)[0].tolist())
+
+    def rerank(self, rows: set) -> set:
+        """
+        Recomputes the most similar notes for the given notes against every note in memory.
+
+        Args:
+            rows (set): Positions of the notes to rerank.
+
+        Returns:
+            set: The positions that were reranked, which is every note if the number of similar
+                notes per note had to change.
+        """
+        k = max(0, min(self.creator.num_similar_notes, len(self.file_names) - 1))
+        if k != self.neighbour_indexes.shape[1]:
+            # the vault crossed the size where every note lists every other, so rank everything
+            self.set_embeddings(self.file_names, self.embeddings)
+            return set(range(len(self.file_names)))
+
+        rows = np.array(sorted(rows), dtype=np.int64)
+        block_rows = rows_per_block(
+            len(self.file_names), self.creator.similarity_memory_budget
+        )
+        for start in range(0, len(rows), block_rows):
+            block = rows[start : start + block_rows]
+            result = select_top_k(
+                self.embeddings[block] @ self.embeddings.T, k, self_columns=block
+            )
+            self.neighbour_indexes[block] = result.indexes
+            self.neighbour_scores[block] = result.scores
+
+        return set(rows.tolist())
+
+    def apply_changes(self, changed: list[str], deleted: list[str]) -> int:
+        """
+        Updates the notes held in memory after notes were saved or deleted, and rewrites the
+        lightning links of every note whose similar notes may have changed.
+
+        Args:
+            changed (list[str]): The notes that were saved or created.
+            deleted (list[str]): The notes that were deleted.
+
+        Returns:
+            int: The number of notes whose lightning links were rewritten.
+        """
+        affected = self.remove_notes(deleted)
+        affected |= self.update_notes(changed)
+        if not affected and not deleted:
+            return 0
+
+        affected = self.rerank(affected)
+
+        counts = self.creator.count_strong_similarities(self.neighbour_scores)
+        similar_notes = [
+            [self.file_names[index] for index in indexes[:count]]
+            for indexes, count in zip(self.neighbour_indexes.tolist(), counts)
+        ]
+
+        # a note that lost all its links above the thresholds still has its old ones cleared
+        report = self.file_handler.write_lightning_links(
+            [
+                (self.file_names[row], similar_notes[row])
+                for row in sorted(affected)
+                if self.neighbour_indexes.shape[1]
+            ],
+            self.creator.num_lightning_links,
+        )
+        for file_name in report.files_written:
+            # don't pick up our own write as a change on the next poll
+            stat_result = os.stat(file_name)
+            self.snapshot[file_name] = (
+                stat_result.st_mtime_ns,
+                stat_result.st_size,
+            )
+
+        self.save_refresh_state(affected, similar_notes)
+
+        # deleted notes are still in the store, so they need a full rewrite to be dropped
+        notes = [
+            {
+                "file_name": file_name,
+                "similar_notes": note_similar_notes,
+                "similarity_scores": scores[: len(note_similar_notes)],
+            }
+            for file_name, note_similar_notes, scores in zip(
+                self.file_names, similar_notes, self.neighbour_scores.tolist()
+            )
+        ]
+        if deleted or not self.file_handler.patch_similar_notes(
+            [notes[row] for row in sorted(affected)]
+        ):
+            self.file_handler.save_similar_notes(notes)
+
+        return len(report.files_written)
+
+    def save_refresh_state(self, rows: set, similar_notes: list[list[str]]):
+        """
+        Records the patched notes in the refresh state, so the next incremental refresh skips
+        them, and forgets deleted notes.
+
+        Args:
+            rows (set): Positions of the notes whose lightning links were patched.
+            similar_notes (list[list[str]]): The similar notes of every note in memory.
+
+        Returns:
+            None
+        """
+        if self.refresh_state is None:
+            self.refresh_state = RefreshState(
+                self.file_handler.notes_directory, self.creator.get_refresh_settings()
+            )
+        self.refresh_state.retain(self.file_names)
+
+        for row in sorted(rows):
+            file_name = self.file_names[row]
+            content_hash = self.content_hashes.get(
+                file_name, self.refresh_state.get_hash(file_name)
+            )
+            if content_hash is None:
+                # the note's content isn't known, so the next refresh has to read it
+                continue
+            self.refresh_state.record(
+                file_name, os.stat(file_name), content_hash, similar_notes[row]
+            )
+
+        self.refresh_state.save()
+
+    def run(self):
+        """
+        Loads the vault and then watches it until interrupted with Ctrl+C.
+
+        Returns:
+            None
+        """
+        self.load()
+        print("Watching for changes... (Ctrl+C to stop)")
+
+        try:
+            while True:
+                changed, deleted = self.poll()
+                if changed or deleted:
+                    start_time = time()
+                    notes_updated = self.apply_changes(changed, deleted)
+                    print(
+                        f"Saved: {len(changed)}, deleted: {len(deleted)}, "
+                        f"lightning links updated: {notes_updated} "
+                        f"({time() - start_time:.3f}s)"
+                    )
+                sleep(self.poll_interval)
+        except KeyboardInterrupt:
+            print("Stopped watching")
@@ -1,7 +1,43 @@
+import asyncio
+import importlib.util
+import json
 import os
+import pickle
+import re
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
 import unittest
-
-from src.note_handler import FileParser
+from types import SimpleNamespace
+from unittest import mock
+
+import numpy as np
+
+from src.ann_index import IVFIndex, recall_at_k
+from src.async_smart_assistant import AsyncSmartAssistant
+from src.context_builder import ContextBuilder, count_tokens
+from src.embedding_cache import EmbeddingCache
+from src.embedding_model import get_onnx_directory, load_embedding_model
+from src.lightning_links_creator import LightningLinksCreator
+from src.note_encoder import NoteEncoder
+from src.note_handler import FileParser, Note
+from src.parse_cache import PARSE_CACHE, ParseCache
+from src.refresh_state import RefreshState
+from src.response_cache import ResponseCache
+from src.similar_notes_store import SimilarNotesStore
+from src.similarity_search import (
+    count_above_threshold,
+    normalize,
+    quantize,
+    rows_per_block,
+    select_top_k,
+    top_k_similarities,
+)
+from src.smart_assistant import SmartAssistant
+from src.vault_watcher import VaultWatcher
 
 
 class TestFileParser(unittest.TestCase):
@@ -217,6 +253,40 @@ class TestFileParser(unittest.TestCase):
             self.file_parser.file_names,
         )
 
+    def test_scan_vault_searches_subfolders(self):
+        # notes in subfolders are found, while .obsidian and ignored folders are skipped
+        with tempfile.TemporaryDirectory() as vault:
+            for path in (
+                "top.md",
+                "projects/nested.md",
+                "projects/deeper/deepest.md",
+                "projects/drawing.excalidraw.md",
+                ".obsidian/plugin.md",
+                ".trash/deleted.md",
+                "drafts/draft.md",
+            ):
+                os.makedirs(os.path.dirname(os.path.join(vault, path)), exist_ok=True)
+                with open(os.path.join(vault, path), "w", encoding="utf-8") as file:
+                    file.write("body\n")
+
+            with mock.patch.object(FileParser, "load_similar_notes", return_value={}):
+                file_parser = FileParser(vault, ignore_patterns=[".trash", "drafts/*"])
+
+            root = file_parser.notes_directory
+            self.assertEqual(
+                [
+                    f"{root}top.md",
+                    f"{root}projects/nested.md",
+                    f"{root}projects/deeper/deepest.md",
+                ],
+                sorted(file_parser.file_names, key=lambda name: name.count("/")),
+            )
+            self.assertEqual({"top", "nested", "deepest"}, set(file_parser.note_names))
+            self.assertEqual(
+                os.stat(f"{root}projects/nested.md").st_mtime_ns,
+                file_parser.get_file_stat(f"{root}projects/nested.md").st_mtime_ns,
+            )
+
     def test_ensure_proper_endings(self):
         # A test that ensures that the ensure proper endings method works as intended. This is done by checking
         # that the proper ending newline is only added to the file if it is missing. It also makes sure that
@@ -251,6 +321,45 @@ class TestFileParser(unittest.TestCase):
             self.current_file_lines["invalid ending.md"][-1],
         )
 
+    def test_endings_are_fixed_while_loading(self):
+        # fixing the endings while loading edits the same files as ensure_proper_endings
+        notes = self.file_parser.load_all_note_files(ensure_endings=True)
+        self.reload_files()
+        self.reset_files()
+
+        for file_name, lines in self.original_file_lines.items():
+            expected = list(lines)
+            if file_name == "invalid ending.md":
+                expected[-1] += "\n"
+            self.assertEqual(expected, self.current_file_lines[file_name])
+
+        # the notes are parsed from the fixed text
+        note = next(
+            note for note in notes if note["file_name"].endswith("invalid ending.md")
+        )
+        self.assertTrue(note["body"].endswith("\n"))
+
+    def test_has_proper_ending_only_reads_the_tail(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "note.md")
+            cases = {
+                "": True,
+                "body\n": True,
+                "body": False,
+                "body\n### Lightning Links\n" + "[[note]]" * 100: True,
+                "### Lightning Links\nbody\n" + "x" * 1000: False,
+                "body\r\n": True,
+            }
+            for text, expected in cases.items():
+                with open(path, "w", newline="") as file:
+                    file.write(text)
+                with self.subTest(text=text[:30]):
+                    self.assertEqual(expected, FileParser.has_proper_ending(path))
+                    self.assertEqual(
+                        expected,
+                        FileParser.text_has_proper_ending(text.replace("\r\n", "\n")),
+                    )
+
     def _test_parse_note(self, file_name):
         """
         Helper method to test parse_note for a given file with expected values.
@@ -287,6 +396,29 @@ class TestFileParser(unittest.TestCase):
                 with self.subTest(file_name=file_name):
                     self._test_parse_note(file_name)
 
+    def test_load_selected_note_files(self):
+        # only the requested files are parsed
+        file_name = f"{self.test_vault}example note.md"
+        notes = self.file_parser.load_all_note_files([file_name])
+
+        self.assertEqual(1, len(notes))
+        self.assertEqual(file_name, notes[0]["file_name"])
+        self.assertEqual(self.example_body, notes[0]["body"])
+
+    def test_parallel_loaders_keep_order(self):
+        serial = self.file_parser.load_all_note_files(loader="serial")
+
+        # force the pools to be used despite the small test vault
+        with (
+            mock.patch("src.note_handler.NOTE_LOADER_CHUNK_SIZE", 2),
+            mock.patch("src.note_handler.NOTE_LOADER_WORKERS", 2),
+        ):
+            for loader in ["process", "thread"]:
+                with self.subTest(loader=loader):
+                    self.assertEqual(
+                        serial, self.file_parser.load_all_note_files(loader=loader)
+                    )
+
     def test_valid_parse_note(self):
         # tests parse for the valid note
         self._test_parse_note("example note.md")
@@ -311,6 +443,25 @@ class TestFileParser(unittest.TestCase):
         # tests parse for the note with a valid ending but no lightning links
         self._test_parse_note("valid ending no lightning links.md")
 
+    def test_note_behaves_like_a_dictionary(self):
+        # notes can be read, extended and pickled like the dictionaries they replace
+        note = FileParser.parse_text("[[link]]\n\n#tag\nbody\n")
+        self.assertEqual(
+            {"links": "[[link]]\n", "tags": "#tag\n", "body": "body\n"},
+            {key: note[key] for key in ("links", "tags", "body")},
+        )
+        self.assertNotIn("file_name", note)
+
+        note["file_name"] = "note.md"
+        note["note_name"] = "note"
+        self.assertEqual("note.md", note["file_name"])
+        self.assertEqual("note", note.get("note_name"))
+        self.assertEqual(7, len(note))
+
+        copy = pickle.loads(pickle.dumps(note))
+        self.assertIsInstance(copy, Note)
+        self.assertEqual(dict(note), dict(copy))
+
     def test_format_inline_lightning_links(self):
         similar_notes = [
             "science.md",
@@ -457,20 +608,96 @@ class TestFileParser(unittest.TestCase):
         # cleanup
         os.remove(temp_path)
 
-    def test_save_and_load_similar_notes(self):
-        # write a mapping and verify load_similar_notes reads it back
-        notes = [
-            {"file_name": f"{self.test_vault}a.md", "similar_notes": ["b.md"]},
-            {"file_name": f"{self.test_vault}b.md", "similar_notes": ["a.md"]},
-        ]
-        # save using FileParser method
-        self.file_parser.save_similar_notes(notes)
+    def test_write_lightning_links_batch(self):
+        # one note needs new links, one is already up to date and one is created
+        paths = [f"{self.test_vault}temp_batch_{index}.md" for index in range(3)]
+        formatted = self.file_parser.format_inline_lighting_links(["science.md"], 1)
+        with open(paths[0], "w") as f:
+            f.write("body\r\n")
+        with open(paths[1], "w") as f:
+            f.write(f"body\n### Lightning Links\n{formatted}\n")
+        os.chmod(paths[0], 0o640)
+
+        report = self.file_parser.write_lightning_links(
+            [(path, ["science.md"]) for path in paths], 1, max_workers=2, fsync=True
+        )
+
+        self.assertEqual([paths[0], paths[2]], report.files_written)
+        self.assertEqual(1, report.files_unchanged)
+        with open(paths[0], "rb") as f:
+            contents = f.read()
+        # the rest of the note, line endings included, is untouched
+        self.assertEqual(
+            f"body\r\n### Lightning Links\n{formatted}\n".encode(), contents
+        )
+        self.assertEqual(
+            len(contents) + os.path.getsize(paths[2]), report.bytes_written
+        )
+        self.assertEqual(0o640, os.stat(paths[0]).st_mode & 0o777)
+        # no temporary files are left behind
+        self.assertEqual(
+            [], [name for name in os.listdir(self.test_vault) if name.endswith(".tmp")]
+        )
+
+        for path in paths:
+            os.remove(path)
 
-        # ensure file exists and load_similar_notes returns mapping containing our entries
-        loaded = self.file_parser.load_similar_notes()
-        # keys in saved file are the full paths as used in save_similar_notes
-        expected_key = f"{self.test_vault}a.md"
-        self.assertIn(expected_key, loaded)
+    def test_failed_write_keeps_the_note(self):
+        temp_path = f"{self.test_vault}temp_failed_write.md"
+        with open(temp_path, "w") as f:
+            f.write("body\n")
+
+        with mock.patch("os.replace", side_effect=OSError("disk full")):
+            with self.assertRaises(OSError):
+                self.file_parser.update_lighting_links(temp_path, ["science.md"], 1)
+
+        with open(temp_path) as f:
+            self.assertEqual("body\n", f.read())
+        self.assertEqual(
+            [], [name for name in os.listdir(self.test_vault) if name.endswith(".tmp")]
+        )
+        os.remove(temp_path)
+
+    def test_write_through_symlinked_note(self):
+        with tempfile.TemporaryDirectory() as temp_directory:
+            target = os.path.join(temp_directory, "target.md")
+            link = os.path.join(temp_directory, "vault", "link.md")
+            os.makedirs(os.path.dirname(link))
+            with open(target, "w") as f:
+                f.write("body\n")
+            os.symlink(target, link)
+
+            self.file_parser.write_atomically(link, b"new body\n")
+
+            # the link is kept and the note it points to holds the new content
+            self.assertTrue(os.path.islink(link))
+            with open(target) as f:
+                self.assertEqual("new body\n", f.read())
+            self.assertEqual(["target.md", "vault"], sorted(os.listdir(temp_directory)))
+            self.assertEqual(["link.md"], os.listdir(os.path.dirname(link)))
+
+    def test_save_and_load_similar_notes(self):
+        # saving writes a store that would shadow the fixture's similar_notes.json, so use a
+        # vault of its own
+        with tempfile.TemporaryDirectory() as temp_directory:
+            vault = temp_directory + "/"
+            os.makedirs(f"{vault}.obsidian")
+            with open(f"{vault}.obsidian/similar_notes.json", "w") as file:
+                file.write("{}")
+            file_parser = FileParser(vault)
+            # write a mapping and verify load_similar_notes reads it back
+            notes = [
+                {"file_name": f"{vault}a.md", "similar_notes": ["b.md"]},
+                {"file_name": f"{vault}b.md", "similar_notes": ["a.md"]},
+            ]
+            # save using FileParser method
+            file_parser.save_similar_notes(notes)
+
+            # ensure file exists and load_similar_notes returns mapping containing our entries
+            loaded = file_parser.load_similar_notes()
+            # keys in saved file are the full paths as used in save_similar_notes
+            expected_key = f"{vault}a.md"
+            self.assertIn(expected_key, loaded)
 
     def test_write_to_file_registers_filename(self):
         temp_path = f"{self.test_vault}temp_register.md"
@@ -494,5 +721,1315 @@ class TestFileParser(unittest.TestCase):
         os.remove(temp_path)
 
 
+class TestParseCache(unittest.TestCase):
+    def setUp(self):
+        self.temp_directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.temp_directory.name, "note.md")
+        with open(self.path, "w") as file:
+            file.write("#tag\nfirst body\n")
+        PARSE_CACHE.clear()
+
+    def tearDown(self):
+        PARSE_CACHE.clear()
+        self.temp_directory.cleanup()
+
+    def test_unchanged_notes_are_not_read_again(self):
+        note = FileParser.parse_note(self.path)
+        # changing a returned note doesn't change the cached one
+        note["body"] = "changed"
+
+        with mock.patch("builtins.open", side_effect=AssertionError("read again")):
+            self.assertEqual("first body\n", FileParser.parse_note(self.path)["body"])
+        self.assertEqual(1, PARSE_CACHE.hits)
+        self.assertEqual(1, PARSE_CACHE.misses)
+
+    def test_changed_notes_are_parsed_again(self):
+        FileParser.parse_note(self.path)
+        with open(self.path, "w") as file:
+            file.write("#tag\nsecond body\n")
+        stat_result = os.stat(self.path)
+        os.utime(self.path, ns=(stat_result.st_atime_ns, stat_result.st_mtime_ns + 1))
+
+        self.assertEqual("second body\n", FileParser.parse_note(self.path)["body"])
+        self.assertEqual(2, PARSE_CACHE.misses)
+
+    def test_least_recently_used_notes_are_evicted(self):
+        stat_result = os.stat(self.path)
+        note = Note(body="x" * 100)
+        cache = ParseCache(int(2.5 * ParseCache.estimate_size(note)))
+        cache.put("a.md", stat_result, note)
+        cache.put("b.md", stat_result, note)
+        cache.get("a.md", stat_result)
+        cache.put("c.md", stat_result, note)
+
+        self.assertIsNotNone(cache.get("a.md", stat_result))
+        self.assertIsNone(cache.get("b.md", stat_result))
+        self.assertEqual(
+            {"notes": 2, "hits": 2, "misses": 1, "evictions": 1},
+            {key: value for key, value in cache.stats().items() if key != "bytes"},
+        )
+
+
+class TestEmbeddingCache(unittest.TestCase):
+    def setUp(self):
+        # each test gets its own throwaway vault so the cache files never touch the fixtures
+        self.temp_directory = tempfile.TemporaryDirectory()
+        self.vault = self.temp_directory.name
+        self.encoded_batches = []
+
+    def tearDown(self):
+        self.temp_directory.cleanup()
+
+    def fake_encode(self, texts):
+        # deterministic stand-in for the embedding model that records what it was asked to encode
+        self.encoded_batches.append(list(texts))
+        return np.array([[len(text), text.count("a"), 1.0] for text in texts])
+
+    def test_only_changed_notes_are_encoded(self):
+        file_names = ["a.md", "b.md", "c.md"]
+        cache = EmbeddingCache(self.vault, "model", 3)
+        first = cache.encode(file_names, ["alpha", "beta", "gamma"], self.fake_encode)
+        self.assertEqual(3, cache.misses)
+
+        # a fresh instance reads the cache back from disk
+        cache = EmbeddingCache(self.vault, "model", 3)
+        second = cache.encode(file_names, ["alpha", "beta!", "gamma"], self.fake_encode)
+
+        self.assertEqual(["beta!"], self.encoded_batches[-1])
+        self.assertEqual(2, cache.hits)
+        np.testing.assert_array_equal(first[[0, 2]], second[[0, 2]])
+        np.testing.assert_array_equal(self.fake_encode(["beta!"])[0], second[1])
+
+    def test_renamed_note_reuses_embedding(self):
+        EmbeddingCache(self.vault, "model", 3).encode(
+            ["old.md"], ["alpha"], self.fake_encode
+        )
+        cache = EmbeddingCache(self.vault, "model", 3)
+        cache.encode(["new.md"], ["alpha"], self.fake_encode)
+
+        self.assertEqual(1, len(self.encoded_batches))
+        self.assertEqual(1, cache.hits)
+
+    def test_model_change_invalidates_cache(self):
+        EmbeddingCache(self.vault, "model", 3).encode(
+            ["a.md"], ["alpha"], self.fake_encode
+        )
+
+        cache = EmbeddingCache(self.vault, "other model", 3)
+        self.assertEqual({}, cache.entries)
+        cache.encode(["a.md"], ["alpha"], self.fake_encode)
+        self.assertEqual(1, cache.misses)
+
+    def test_known_hash_skips_text(self):
+        cache = EmbeddingCache(self.vault, "model", 3)
+        cache.encode(["a.md"], ["alpha"], self.fake_encode)
+        content_hash = cache.content_hash("alpha")
+
+        # an unchanged note can be served from its hash alone
+        cache = EmbeddingCache(self.vault, "model", 3)
+        embeddings = cache.encode(["a.md"], [None], self.fake_encode, [content_hash])
+        np.testing.assert_array_equal(self.fake_encode(["alpha"]), embeddings)
+
+        with self.assertRaises(ValueError):
+            cache.encode(["a.md"], [None], self.fake_encode, ["unknown"])
+
+    def test_dimension_change_invalidates_cache(self):
+        EmbeddingCache(self.vault, "model", 3).encode(
+            ["a.md"], ["alpha"], self.fake_encode
+        )
+
+        cache = EmbeddingCache(self.vault, "model", 4)
+        self.assertEqual({}, cache.entries)
+        with self.assertRaises(ValueError):
+            cache.encode(["a.md"], ["alpha"], self.fake_encode)
+
+    def test_interrupted_save_keeps_previous_contents(self):
+        file_names = ["a.md", "b.md"]
+        first = EmbeddingCache(self.vault, "model", 3).encode(
+            file_names, ["alpha", "beta"], self.fake_encode
+        )
+
+        # the new matrix is written but the manifest is never replaced
+        cache = EmbeddingCache(self.vault, "model", 3)
+        with mock.patch("os.replace", side_effect=OSError("killed")):
+            with self.assertRaises(OSError):
+                cache.encode(file_names, ["beta", "alpha"], self.fake_encode)
+
+        cache = EmbeddingCache(self.vault, "model", 3)
+        np.testing.assert_array_equal(first, cache.matrix)
+        self.assertEqual(file_names, list(cache.entries))
+
+    def test_matrix_not_matching_the_manifest_invalidates_cache(self):
+        cache = EmbeddingCache(self.vault, "model", 3)
+        cache.encode(["a.md", "b.md"], ["alpha", "beta"], self.fake_encode)
+        np.save(cache.matrix_path, np.zeros((1, 3), dtype=np.float32))
+
+        self.assertEqual({}, EmbeddingCache(self.vault, "model", 3).entries)
+
+
+class TestRefreshState(unittest.TestCase):
+    def setUp(self):
+        self.temp_directory = tempfile.TemporaryDirectory()
+        self.vault = self.temp_directory.name
+        self.settings = {"model": "model", "num_similar_notes": 10}
+
+        self.note_path = os.path.join(self.vault, "note.md")
+        with open(self.note_path, "w") as file:
+            file.write("body\n")
+
+    def tearDown(self):
+        self.temp_directory.cleanup()
+
+    def test_record_and_reload(self):
+        state = RefreshState(self.vault, self.settings)
+        state.record(self.note_path, os.stat(self.note_path), "hash", ["other.md"])
+        state.save()
+
+        state = RefreshState(self.vault, self.settings)
+        self.assertTrue(state.is_unchanged(self.note_path, os.stat(self.note_path)))
+        self.assertEqual("hash", state.get_hash(self.note_path))
+        self.assertEqual(["other.md"], state.get_similar_notes(self.note_path))
+
+    def test_modified_note_is_detected(self):
+        state = RefreshState(self.vault, self.settings)
+        state.record(self.note_path, os.stat(self.note_path), "hash", [])
+
+        with open(self.note_path, "a") as file:
+            file.write("more body\n")
+
+        self.assertFalse(state.is_unchanged(self.note_path, os.stat(self.note_path)))
+        self.assertFalse(state.is_unchanged("missing.md", os.stat(self.note_path)))
+
+    def test_settings_change_discards_state(self):
+        state = RefreshState(self.vault, self.settings)
+        state.record(self.note_path, os.stat(self.note_path), "hash", [])
+        state.save()
+
+        state = RefreshState(self.vault, {"model": "other model"})
+        self.assertEqual({}, state.notes)
+
+    def test_retain_forgets_deleted_notes(self):
+        state = RefreshState(self.vault, self.settings)
+        state.record(self.note_path, os.stat(self.note_path), "hash", [])
+        state.record("deleted.md", os.stat(self.note_path), "hash", [])
+
+        state.retain([self.note_path])
+        self.assertEqual([self.note_path], list(state.notes))
+
+
+class TestIncrementalRefresh(unittest.TestCase):
+    def setUp(self):
+        # a copy of the fixture, so the refreshes don't rewrite the fixture notes
+        self.temp_directory = tempfile.TemporaryDirectory()
+        self.vault = os.path.join(self.temp_directory.name, "vault") + "/"
+        shutil.copytree("testNoteDirectory", self.vault)
+
+        self.model = FakeSentenceModel(max_seq_length=512)
+        self.creator = LightningLinksCreator(self.vault)
+        self.creator.model = self.model
+        self.creator.num_similar_notes = 4
+        self.creator.num_lightning_links = 2
+
+    def tearDown(self):
+        self.temp_directory.cleanup()
+
+    def test_only_the_edited_note_and_its_neighbours_are_refreshed(self):
+        self.creator.refresh_similarities(incremental=True)
+        before = self.creator.file_handler.load_similar_notes()
+        old_links = {
+            file_name: before[file_name][: self.creator.num_lightning_links]
+            for file_name in self.creator.file_handler.file_names
+        }
+
+        edited_note = f"{self.vault}no headers.md"
+        with open(edited_note, "r+") as file:
+            body = file.read()
+            file.seek(0)
+            file.write("zebra " * 40 + body)
+        self.model.batches = []
+
+        file_handler = self.creator.file_handler
+        with mock.patch.object(
+            file_handler,
+            "write_lightning_links",
+            wraps=file_handler.write_lightning_links,
+        ) as write_lightning_links:
+            self.creator.refresh_similarities(incremental=True)
+
+        # only the edited note is encoded again
+        encoded = [text for batch in self.model.batches for text in batch]
+        self.assertEqual(1, len(encoded))
+        self.assertTrue(encoded[0].startswith("zebra"))
+
+        # only the edited note and the notes whose lightning links changed are rewritten
+        after = file_handler.load_similar_notes()
+        changed_links = {
+            file_name
+            for file_name, links in old_links.items()
+            if after[file_name][: self.creator.num_lightning_links] != links
+        }
+        rewritten = {
+            file_name for file_name, _ in write_lightning_links.call_args.args[0]
+        }
+        self.assertTrue(changed_links - {edited_note})
+        self.assertEqual({edited_note} | changed_links, rewritten)
+        self.assertLess(len(rewritten), len(old_links))
+
+
+class TestSimilarNotesStore(unittest.TestCase):
+    def setUp(self):
+        self.temp_directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.temp_directory.name, "similar_notes.bin")
+        self.notes = [
+            {
+                "file_name": f"vault/note {index}.md",
+                "similar_notes": [
+                    f"vault/note {(index + 1) % 50}.md",
+                    "vault/ünïcode.md",
+                ],
+                "similarity_scores": [0.9, 0.5],
+            }
+            for index in range(50)
+        ]
+        self.notes[3] = {"file_name": "vault/note 3.md", "similar_notes": []}
+        SimilarNotesStore.write(self.path, self.notes)
+
+    def tearDown(self):
+        self.temp_directory.cleanup()
+
+    def test_lookup_matches_written_notes(self):
+        store = SimilarNotesStore(self.path)
+
+        self.assertEqual(50, len(store))
+        self.assertEqual(
+            {note["file_name"]: note["similar_notes"] for note in self.notes},
+            store.to_dict(),
+        )
+        self.assertEqual(
+            ["vault/note 8.md", "vault/ünïcode.md"], store["vault/note 7.md"]
+        )
+        np.testing.assert_allclose([0.9, 0.5], store.get_scores("vault/note 7.md"))
+        self.assertEqual([], store["vault/note 3.md"])
+
+        # similar notes that aren't notes themselves can't be looked up
+        self.assertNotIn("vault/ünïcode.md", store)
+        with self.assertRaises(KeyError):
+            store.get_scores("vault/missing.md")
+
+    def test_rejects_other_files(self):
+        with open(self.path, "wb") as file:
+            file.write(b"{}" * 20)
+
+        with self.assertRaises(ValueError):
+            SimilarNotesStore(self.path)
+
+    def test_file_parser_prefers_the_store(self):
+        vault = self.temp_directory.name + "/"
+        os.makedirs(f"{vault}.obsidian")
+        with open(f"{vault}.obsidian/similar_notes.json", "w") as file:
+            file.write('{"old.md": []}')
+        file_parser = FileParser(vault)
+        self.assertEqual({"old.md": []}, file_parser.load_similar_notes())
+
+        file_parser.save_similar_notes(self.notes[:2], export_json=True)
+        loaded = file_parser.load_similar_notes()
+        self.assertIsInstance(loaded, SimilarNotesStore)
+        self.assertEqual(self.notes[1]["similar_notes"], loaded["vault/note 1.md"])
+
+        # the JSON export holds the same mapping
+        with open(f"{vault}.obsidian/similar_notes.json") as file:
+            self.assertEqual(loaded.to_dict(), json.load(file))
+
+
+class TestSimilaritySearch(unittest.TestCase):
+    def setUp(self):
+        self.embeddings = np.random.default_rng(0).normal(size=(50, 8))
+
+    def brute_force_top_k(self, k):
+        # reference implementation using the full similarity matrix
+        normalized = normalize(self.embeddings)
+        similarities = normalized @ normalized.T
+        np.fill_diagonal(similarities, -np.inf)
+        return np.argsort(-similarities, axis=1)[:, :k]
+
+    def test_matches_full_matrix(self):
+        # a budget this small forces the search to run in many tiles
+        result = top_k_similarities(self.embeddings, 5, 2 * 50 * 12)
+
+        np.testing.assert_array_equal(self.brute_force_top_k(5), result.indexes)
+        self.assertEqual(np.int32, result.indexes.dtype)
+        self.assertEqual((50, 5), result.scores.shape)
+        # scores are ordered from most to least similar
+        self.assertTrue(np.all(np.diff(result.scores, axis=1) <= 0))
+
+    def test_excludes_self(self):
+        result = top_k_similarities(self.embeddings, 10, 1024)
+
+        for row_id, row in enumerate(result.indexes):
+            self.assertNotIn(row_id, row)
+
+    def test_k_is_capped(self):
+        result = top_k_similarities(self.embeddings[:3], 10, 1024)
+        self.assertEqual((3, 2), result.indexes.shape)
+
+        result = top_k_similarities(self.embeddings[:1], 10, 1024)
+        self.assertEqual((1, 0), result.indexes.shape)
+
+    def test_select_top_k_keeps_duplicate_notes(self):
+        # notes 0 and 1 are duplicates, so they tie with each other's self-score
+        similarities = np.array(
+            [
+                [1.0, 1.0, 0.2, 0.5],
+                [1.0, 1.0, 0.2, 0.5],
+                [0.2, 0.1, 1.0, 0.3],
+                [0.5, 0.4, 0.3, 1.0],
+            ]
+        )
+        result = select_top_k(similarities.copy(), 2)
+
+        np.testing.assert_array_equal([[1, 3], [0, 3], [3, 0], [0, 1]], result.indexes)
+        np.testing.assert_allclose(
+            [[1.0, 0.5], [1.0, 0.5], [0.3, 0.2], [0.5, 0.4]], result.scores
+        )
+
+    def test_select_top_k_row_offset(self):
+        # a single row belonging to note 2 must not list note 2
+        result = select_top_k(np.array([[0.1, 0.4, 1.0, 0.3]]), 2, row_offset=2)
+        np.testing.assert_array_equal([[1, 3]], result.indexes)
+
+    def test_count_above_threshold(self):
+        scores = np.array([[0.9, 0.6, 0.3], [0.4, 0.35, 0.1], [-0.1, -0.2, -0.3]])
+
+        np.testing.assert_array_equal([3, 3, 3], count_above_threshold(scores, -1.0))
+        np.testing.assert_array_equal([2, 1, 0], count_above_threshold(scores, 0.4))
+        # relative to each note's best match, a note without a positive match keeps nothing
+        np.testing.assert_array_equal(
+            [2, 2, 0], count_above_threshold(scores, -1.0, 0.5)
+        )
+
+    def test_quantize_reduces_memory(self):
+        embeddings = self.embeddings
+
+        for precision, itemsize in (("float16", 2), ("int8", 1)):
+            quantized = quantize(embeddings, precision, block_rows=7)
+            self.assertEqual(itemsize, quantized.values.itemsize)
+            np.testing.assert_allclose(
+                normalize(embeddings), quantized.dequantize(), atol=0.01
+            )
+
+        with self.assertRaises(ValueError):
+            quantize(embeddings, "int4")
+
+    def test_quantized_search_matches_float32(self):
+        embeddings = self.embeddings
+        exact = top_k_similarities(embeddings, 5, 1 << 20)
+
+        for precision in ("float16", "int8"):
+            # a small budget forces several tiles and rescoring blocks
+            result = top_k_similarities(
+                embeddings, 5, 4096, precision=precision, rescore_factor=4
+            )
+            np.testing.assert_array_equal(exact.indexes, result.indexes)
+            np.testing.assert_allclose(exact.scores, result.scores, rtol=1e-5)
+
+    def test_rows_per_block_respects_budget(self):
+        self.assertEqual(10, rows_per_block(100, 100 * 12 * 10))
+        self.assertEqual(1, rows_per_block(100, 1))
+
+
+class TestIVFIndex(unittest.TestCase):
+    def setUp(self):
+        # clustered vectors, the kind of data the index is designed for
+        rng = np.random.default_rng(0)
+        centers = rng.normal(size=(10, 16))
+        self.embeddings = centers[rng.integers(0, 10, 500)] + 0.2 * rng.normal(
+            size=(500, 16)
+        )
+        self.ids = [f"{i}.md" for i in range(500)]
+
+        self.index = IVFIndex(16, num_lists=20, num_probes=20)
+        self.index.build(self.ids, self.embeddings)
+
+    def test_probing_every_list_is_exact(self):
+        result = self.index.search(self.embeddings, 5, exclude=np.arange(500))
+        exact = top_k_similarities(self.embeddings, 5, 1 << 20)
+
+        self.assertEqual(1.0, recall_at_k(result, exact))
+        self.assertEqual(1.0, self.index.measure_recall(5, 50))
+
+    def test_search_excludes_self(self):
+        self.index.num_probes = 2
+        result = self.index.search(self.embeddings, 5, exclude=np.arange(500))
+
+        for row_id, row in enumerate(result.indexes):
+            self.assertNotIn(row_id, row)
+        self.assertTrue(np.all(result.indexes >= 0))
+
+    def test_update_adds_and_removes(self):
+        changed = self.embeddings.copy()
+        changed[0] += 1.0
+        ids = self.ids[:-10] + ["new.md"]
+        embeddings = np.vstack([changed[:-10], self.embeddings[:1]])
+
+        removed, added = self.index.update(ids, embeddings)
+
+        self.assertEqual((11, 2), (removed, added))
+        self.assertEqual(sorted(ids), sorted(self.index.ids))
+        self.assertEqual((0, 0), self.index.update(ids, embeddings))
+
+    def test_save_and_load(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "index.npz")
+            self.index.save(path, "model|torch")
+
+            loaded = IVFIndex.load(path, 16, "model|torch")
+            self.assertEqual(self.ids, loaded.ids)
+            np.testing.assert_array_equal(self.index.centroids, loaded.centroids)
+            # the vectors are left to the embedding cache and supplied by update
+            with np.load(path) as data:
+                self.assertNotIn("vectors", data.files)
+            self.assertEqual((0, 0), loaded.update(self.ids, self.embeddings))
+            np.testing.assert_array_equal(self.index.vectors, loaded.vectors)
+            changed = self.embeddings.copy()
+            changed[3] += 1.0
+            self.assertEqual((1, 1), loaded.update(self.ids, changed))
+            self.assertIsNone(IVFIndex.load(path, 8, "model|torch"))
+            # an index trained on another model's embeddings is discarded
+            self.assertIsNone(IVFIndex.load(path, 16, "other model|torch"))
+            self.assertIsNone(IVFIndex.load(os.path.join(directory, "missing.npz"), 16))
+
+
+class TestVaultWatcher(unittest.TestCase):
+    def setUp(self):
+        self.temp_directory = tempfile.TemporaryDirectory()
+        self.vault = self.temp_directory.name + "/"
+        os.makedirs(f"{self.vault}.obsidian")
+        with open(f"{self.vault}.obsidian/similar_notes.json", "w") as file:
+            file.write("{}")
+
+        self.bodies = {
+            "apple.md": "apple fruit\n",
+            "banana.md": "banana fruit\n",
+            "car.md": "car engine\n",
+            "truck.md": "truck engine\n",
+        }
+        for file_name, body in self.bodies.items():
+            self.write_note(file_name, body)
+
+        file_handler = FileParser(self.vault)
+        self.cache = EmbeddingCache(self.vault, "bag of words", 6)
+        self.creator = SimpleNamespace(
+            file_handler=file_handler,
+            encoder=SimpleNamespace(
+                encode=lambda bodies, show_progress_bar=True: self.fake_encode(bodies)
+            ),
+            get_embedding_cache=lambda: self.cache,
+            get_refresh_settings=lambda: {"model": "bag of words"},
+            num_similar_notes=2,
+            num_lightning_links=1,
+            count_strong_similarities=lambda scores: count_above_threshold(
+                scores, -1.0
+            ).tolist(),
+            similarity_memory_budget=1 << 20,
+            extract_bodies=lambda notes: [note["body"] for note in notes],
+        )
+
+        self.watcher = VaultWatcher(self.creator, poll_interval=0, debounce=0)
+        self.watcher.set_embeddings(
+            file_handler.file_names,
+            self.fake_encode(
+                [
+                    self.bodies[os.path.basename(name)]
+                    for name in file_handler.file_names
+                ]
+            ),
+        )
+        self.watcher.snapshot = self.watcher.scan()
+
+    def tearDown(self):
+        self.temp_directory.cleanup()
+
+    def write_note(self, file_name, body):
+        with open(f"{self.vault}{file_name}", "w") as file:
+            file.write(body)
+
+    def fake_encode(self, bodies):
+        # bag of words embedding so that notes sharing words are similar
+        vocabulary = ["apple", "banana", "fruit", "car", "truck", "engine"]
+        return np.array(
+            [
+                [body.split().count(word) + 0.01 for word in vocabulary]
+                for body in bodies
+            ]
+        )
+
+    def lightning_links(self, file_name):
+        return self.creator.file_handler.parse_note(f"{self.vault}{file_name}")[
+            "smart_links"
+        ]
+
+    def test_saved_note_updates_its_neighbours(self):
+        self.write_note("car.md", "apple fruit apple\n")
+        changed, deleted = self.watcher.poll()
+        self.assertEqual([f"{self.vault}car.md"], changed)
+
+        self.watcher.apply_changes(changed, deleted)
+
+        self.assertEqual("[[car]]\n", self.lightning_links("apple.md"))
+        self.assertEqual("[[apple]]\n", self.lightning_links("car.md"))
+        # the watcher's own writes are not reported as saves
+        self.assertEqual(([], []), self.watcher.poll())
+
+    def test_deleted_and_new_notes(self):
+        os.remove(f"{self.vault}truck.md")
+        self.write_note("bus.md", "car engine\n")
+        changed, deleted = self.watcher.poll()
+        self.assertEqual([f"{self.vault}truck.md"], deleted)
+
+        self.watcher.apply_changes(changed, deleted)
+
+        self.assertNotIn(f"{self.vault}truck.md", self.watcher.file_names)
+        self.assertEqual("[[bus]]\n", self.lightning_links("car.md"))
+        self.assertEqual("[[car]]\n", self.lightning_links("bus.md"))
+
+    def test_weak_links_are_dropped_and_scores_saved(self):
+        self.creator.count_strong_similarities = lambda scores: count_above_threshold(
+            scores, 0.9
+        ).tolist()
+        self.write_note("car.md", "truck engine\n")
+        self.watcher.apply_changes(*self.watcher.poll())
+
+        # car and truck still match each other, apple has no match above the threshold
+        self.assertEqual("[[truck]]\n", self.lightning_links("car.md"))
+        store = self.creator.file_handler.load_similar_notes()
+        self.assertEqual([], store[f"{self.vault}apple.md"])
+        self.assertEqual([f"{self.vault}truck.md"], store[f"{self.vault}car.md"])
+        self.assertGreaterEqual(store.get_scores(f"{self.vault}car.md")[0], 0.9)
+
+    def test_debounce_waits_for_saves_to_settle(self):
+        self.watcher.debounce = 60
+        self.write_note("car.md", "apple fruit\n")
+
+        self.assertEqual(([], []), self.watcher.poll())
+        self.assertIn(f"{self.vault}car.md", self.watcher.pending)
+
+    def test_vault_is_only_walked_when_a_folder_changes(self):
+        file_handler = self.creator.file_handler
+        with mock.patch.object(
+            file_handler, "scan_vault", wraps=file_handler.scan_vault
+        ) as scan_vault:
+            # a save in place is found by statting the known notes
+            self.write_note("car.md", "apple fruit\n")
+            self.assertEqual(([f"{self.vault}car.md"], []), self.watcher.poll())
+            self.assertEqual(0, scan_vault.call_count)
+
+            # a new note changes its folder
+            self.write_note("bus.md", "car engine\n")
+            self.assertEqual(([f"{self.vault}bus.md"], []), self.watcher.poll())
+            self.assertEqual(1, scan_vault.call_count)
+
+    def test_saved_notes_are_persisted_for_incremental_refresh(self):
+        self.write_note("car.md", "truck engine\n")
+        self.watcher.apply_changes(*self.watcher.poll())
+        store_path = self.creator.file_handler.get_similar_notes_store_path()
+        store_inode = os.stat(store_path).st_ino
+
+        self.write_note("car.md", "apple fruit apple\n")
+        self.watcher.apply_changes(*self.watcher.poll())
+
+        # the new embedding is cached under the hash the next refresh will compute
+        car = f"{self.vault}car.md"
+        body = self.creator.file_handler.parse_note(car)["body"]
+        content_hash = EmbeddingCache.content_hash(body)
+        self.assertTrue(
+            np.allclose(
+                self.fake_encode(["apple fruit apple\n"])[0],
+                self.cache.matrix[self.cache.lookup(car, content_hash)],
+            )
+        )
+        self.assertEqual(1, len(self.cache.entries))
+        self.assertIsNone(
+            self.cache.lookup(car, EmbeddingCache.content_hash("truck engine\n"))
+        )
+
+        # the refresh state matches the note as the watcher left it
+        state = RefreshState(self.vault, {"model": "bag of words"})
+        self.assertEqual(content_hash, state.get_hash(car))
+        self.assertTrue(state.is_unchanged(car, os.stat(car)))
+        self.assertEqual(f"{self.vault}apple.md", state.get_similar_notes(car)[0])
+
+        # the store was patched in place rather than written again
+        self.assertEqual(store_inode, os.stat(store_path).st_ino)
+        store = self.creator.file_handler.load_similar_notes()
+        self.assertEqual([f"{self.vault}apple.md"], store[car][:1])
+        self.assertEqual(car, store[f"{self.vault}apple.md"][0])
+
+
+class FakeSentenceModel:
+    # a stand in for SentenceTransformer that embeds a text as its word count and first letter
+    def __init__(self, max_seq_length=8):
+        self.max_seq_length = max_seq_length
+        self.batches = []
+
+    def tokenizer(self, texts, add_special_tokens=True, **kwargs):
+        # one token per word plus two special tokens
+        special = 2 if add_special_tokens else 0
+        return {
+            "input_ids": [[0] * (len(text.split()) + special) for text in texts],
+            "offset_mapping": [
+                [match.span() for match in re.finditer(r"\S+", text)] for text in texts
+            ],
+        }
+
+    def encode(self, texts, batch_size=32, show_progress_bar=False):
+        self.batches.append(list(texts))
+        return np.array([[len(text.split()), ord(text[0])] for text in texts])
+
+    def get_sentence_embedding_dimension(self):
+        return 2
+
+    def start_multi_process_pool(self, target_devices):
+        self.pools_started = getattr(self, "pools_started", 0) + 1
+        return {"processes": target_devices}
+
+    def encode_multi_process(self, texts, pool, batch_size=32, chunk_size=None):
+        self.shards = [
+            list(texts[start : start + chunk_size])
+            for start in range(0, len(texts), chunk_size)
+        ]
+        return self.encode(texts)
+
+    def stop_multi_process_pool(self, pool):
+        self.pools_started -= 1
+
+
+class TestNoteEncoder(unittest.TestCase):
+    def setUp(self):
+        self.model = FakeSentenceModel()
+        self.encoder = NoteEncoder(
+            self.model,
+            batch_size=2,
+            max_seq_length=0,
+            num_workers=2,
+            torch_threads=0,
+            chunk_pooling="none",
+        )
+
+    def test_embeddings_keep_input_order(self):
+        texts = ["a b c d e f g h i j", "b", "c c c", "d d", "e e e e e"]
+        embeddings = self.encoder.encode(texts, show_progress_bar=False)
+
+        expected = np.array([[len(text.split()), ord(text[0])] for text in texts])
+        np.testing.assert_array_equal(expected, embeddings)
+
+    def test_batches_group_similar_lengths(self):
+        texts = ["long " * 20, "a", "b", "c", "d", "medium text here"]
+        self.encoder.encode(texts, show_progress_bar=False)
+
+        # every batch stays within batch_size * max_seq_length = 16 padded tokens
+        for batch in self.model.batches:
+            longest = max(min(len(text.split()) + 2, 8) for text in batch)
+            self.assertLessEqual(len(batch) * longest, 16)
+        # the short notes share a batch instead of being padded to the long note
+        self.assertIn(["a", "b", "c", "d"], self.model.batches)
+
+    def test_reports_truncation_and_tokens(self):
+        self.encoder.encode(["a " * 20, "b"], show_progress_bar=False)
+
+        self.assertEqual(1, self.encoder.truncated)
+        self.assertEqual(8 + 3, self.encoder.tokens)
+
+    def test_long_notes_are_chunked_at_headings(self):
+        # 6 token windows: "# a x x" and "# b y" fit, the last section needs two windows
+        text = "# a x x\n# b y\n# c z z z z z z"
+        encoder = NoteEncoder(
+            self.model,
+            max_seq_length=0,
+            torch_threads=0,
+            chunk_overlap=2,
+            keep_chunk_embeddings=True,
+        )
+        embeddings = encoder.encode([text, "short"], show_progress_bar=False)
+
+        self.assertEqual(
+            {"# a x x", "# b y", "# c z z z z", "z z z z", "short"},
+            {chunk for batch in self.model.batches for chunk in batch},
+        )
+        self.assertEqual(1, encoder.chunked)
+        self.assertEqual(0, encoder.truncated)
+        np.testing.assert_array_equal([0, 0, 0, 0, 1], encoder.chunk_owners)
+
+        # the mean is weighted by the tokens in each chunk
+        lengths = np.array([4, 3, 6, 4]) + 2
+        vectors = np.array([[4, 35], [3, 35], [6, 35], [4, ord("z")]])
+        np.testing.assert_allclose(
+            (vectors * lengths[:, None]).sum(axis=0) / lengths.sum(),
+            embeddings[0],
+            rtol=1e-6,
+        )
+        np.testing.assert_array_equal([1, ord("s")], embeddings[1])
+
+    def test_max_pooling_and_no_pooling(self):
+        text = "a b c d e f g h i j"
+        max_encoder = NoteEncoder(
+            FakeSentenceModel(),
+            max_seq_length=0,
+            torch_threads=0,
+            chunk_pooling="max",
+            chunk_overlap=0,
+        )
+        np.testing.assert_array_equal(
+            [6, ord("g")], max_encoder.encode([text], show_progress_bar=False)[0]
+        )
+
+        # without pooling the note is truncated, and that is reported
+        self.encoder.encode([text], show_progress_bar=False)
+        self.assertEqual(1, self.encoder.truncated)
+        self.assertEqual(0, self.encoder.chunked)
+
+    def test_process_pool_is_reused_and_keeps_order(self):
+        encoder = NoteEncoder(
+            self.model,
+            batch_size=1,
+            torch_threads=0,
+            chunk_pooling="none",
+            num_processes=2,
+        )
+        texts = ["a a a a", "b", "c c", "d d d"]
+
+        for _ in range(2):
+            embeddings = encoder.encode(texts, show_progress_bar=False)
+            np.testing.assert_array_equal(
+                [[len(text.split()), ord(text[0])] for text in texts], embeddings
+            )
+        # shards are sent shortest first, and the pool is only started once
+        self.assertEqual([["b"], ["c c"], ["d d d"], ["a a a a"]], self.model.shards)
+        self.assertEqual(1, self.model.pools_started)
+
+        encoder.stop_pool()
+        self.assertIsNone(encoder.pool)
+        self.assertEqual(0, self.model.pools_started)
+
+    def test_max_seq_length_is_capped_at_the_model(self):
+        encoder = NoteEncoder(FakeSentenceModel(), max_seq_length=100, torch_threads=0)
+        self.assertEqual(8, encoder.max_seq_length)
+
+        model = FakeSentenceModel()
+        encoder = NoteEncoder(model, max_seq_length=4, torch_threads=0)
+        self.assertEqual(4, model.max_seq_length)
+
+
+@unittest.skipUnless(
+    importlib.util.find_spec("sentence_transformers")
+    and importlib.util.find_spec("onnxruntime")
+    and importlib.util.find_spec("optimum"),
+    "needs sentence-transformers with the onnx extra",
+)
+class TestOnnxBackend(unittest.TestCase):
+    # a small model keeps the export quick
+    model_name = "sentence-transformers/paraphrase-MiniLM-L3-v2"
+    texts = (
+        "apples and bananas are fruit",
+        "cars and trucks have engines",
+        "a much longer note about the history of fruit farming " * 10,
+    )
+
+    def setUp(self):
+        self.temp_directory = tempfile.TemporaryDirectory()
+        self.torch_vectors = load_embedding_model(
+            self.model_name, "torch", "cpu"
+        ).encode(self.texts)
+
+    def tearDown(self):
+        self.temp_directory.cleanup()
+
+    def test_onnx_matches_torch(self):
+        model = load_embedding_model(
+            self.model_name, "onnx", "cpu", "", self.temp_directory.name
+        )
+        np.testing.assert_allclose(
+            self.torch_vectors, model.encode(self.texts), atol=1e-4
+        )
+
+        # the export is cached and reused
+        export_directory = get_onnx_directory(self.model_name, self.temp_directory.name)
+        self.assertTrue((export_directory / "onnx" / "model.onnx").exists())
+
+    def test_quantized_onnx_is_close_to_torch(self):
+        model = load_embedding_model(
+            self.model_name, "onnx", "cpu", "avx2", self.temp_directory.name
+        )
+        similarities = np.sum(
+            normalize(self.torch_vectors) * normalize(model.encode(self.texts)), axis=1
+        )
+        self.assertTrue(np.all(similarities > 0.97))
+
+    def test_unknown_backend(self):
+        with self.assertRaises(ValueError):
+            load_embedding_model(self.model_name, "tensorflow")
+
+
+class TestContextBuilder(unittest.TestCase):
+    def setUp(self):
+        self.notes = [
+            (
+                "vault/plants.md",
+                Note(
+                    links="[[biology]]",
+                    tags="#plants",
+                    body="Plants grow toward light.\n\nPhotosynthesis turns light into sugar.\n",
+                ),
+            ),
+            (
+                "vault/cars.md",
+                Note(body="Engines burn fuel.\n\n" + "Cars have wheels. " * 40 + "\n"),
+            ),
+        ]
+
+    def test_notes_within_budget_are_kept_whole(self):
+        context = ContextBuilder(max_tokens=1000).build(self.notes, "light")
+
+        self.assertEqual(
+            "file_name: vault/plants.md\nlinks: [[biology]]\ntags: #plants\n"
+            "body: Plants grow toward light.\n\nPhotosynthesis turns light into sugar.\n\n\n"
+            "file_name: vault/cars.md\nlinks: \ntags: \n"
+            f"body: {self.notes[1][1]['body']}\n\n",
+            context.text,
+        )
+        self.assertEqual((0, 0), (context.dropped_tokens, context.dropped_passages))
+
+    def test_most_relevant_passages_fit_the_budget(self):
+        builder = ContextBuilder(max_tokens=40, passage_tokens=20)
+        context = builder.build(self.notes, "how do engines use fuel")
+
+        self.assertLessEqual(context.tokens, 40)
+        self.assertEqual(count_tokens(context.text), context.tokens)
+        self.assertIn("Engines burn fuel.", context.text)
+        self.assertGreater(context.dropped_tokens, 0)
+        self.assertGreater(context.dropped_passages, 0)
+
+    def test_tokenizer_is_pluggable(self):
+        # a tokenizer counting characters leaves room for far fewer passages
+        builder = ContextBuilder(max_tokens=80, tokenizer=len)
+        context = builder.build(self.notes)
+
+        self.assertLessEqual(len(context.text), 80)
+        self.assertTrue(context.text.startswith("file_name: vault/plants.md"))
+
+
+class FakeOllamaClient:
+    # a stand in for ollama.Client that records the prompts it was sent
+    def __init__(self, *responses):
+        self.responses = list(responses)
+        self.requests = []
+
+    def chat(self, model, messages, options, format=None, stream=False):
+        self.requests.append(messages)
+        response = self.responses.pop(0)
+        if stream:
+            return iter([{"message": {"content": piece}} for piece in response])
+        return {"message": {"content": response}}
+
+
+def use_fake_embeddings(assistant):
+    # every note's embedding points along its own axis, and every prompt between the first two
+    assistant.ai_provider = "ollama"
+    assistant.response_cache.close()
+    assistant.response_cache = None
+    file_names = assistant.file_handler.file_names
+
+    cache = SimpleNamespace(
+        entries={
+            file_name: {"hash": "", "row": row}
+            for row, file_name in enumerate(file_names)
+        },
+        matrix=np.eye(len(file_names), dtype=np.float32) * 3,
+    )
+    query = np.zeros((1, len(file_names)))
+    query[0, :2] = [0.8, 0.6]
+    assistant.creator = SimpleNamespace(
+        get_embedding_cache=lambda: cache,
+        encoder=SimpleNamespace(
+            encode=lambda texts, show_progress_bar=True: np.repeat(query, len(texts), 0)
+        ),
+    )
+
+    return file_names[0], file_names[1]
+
+
+class TestSmartAssistant(unittest.TestCase):
+    def setUp(self):
+        self.assistant = SmartAssistant("testNoteDirectory/")
+        self.note_a, self.note_b = use_fake_embeddings(self.assistant)
+
+    def test_recommend_note_uses_embeddings(self):
+        self.assistant.client = FakeOllamaClient()
+
+        self.assertEqual(self.note_a, self.assistant.recommend_note("a prompt"))
+        # the closest notes are found without asking the model
+        self.assertEqual([], self.assistant.client.requests)
+        relevant = self.assistant.find_relevant_notes("a prompt", 2)
+        self.assertEqual([self.note_a, self.note_b], [name for name, _ in relevant])
+        self.assertAlmostEqual(0.8, relevant[0][1], places=5)
+
+    def test_recommend_note_reranks_candidates(self):
+        note_name = os.path.basename(self.note_b).removesuffix(".md")
+        self.assistant.client = FakeOllamaClient(json.dumps({"file_name": note_name}))
+        self.assistant.rerank = True
+        self.assistant.num_candidates = 2
+
+        self.assertEqual(self.note_b, self.assistant.recommend_note("a prompt"))
+        # only the candidates are sent to the model
+        user_prompt = self.assistant.client.requests[0][1]["content"]
+        self.assertEqual(2, user_prompt.split("Files:\n")[1].count("\n"))
+
+    def test_responses_are_streamed(self):
+        self.assistant.client = FakeOllamaClient(["Plants ", "", "need light."])
+        self.assistant.stream = True
+
+        with mock.patch("builtins.print") as printed:
+            response = self.assistant.print_response("system", "user", 0.4)
+
+        self.assertEqual("Plants need light.", response)
+        # each piece is printed as soon as it arrives
+        self.assertEqual(
+            ["Plants ", "need light."],
+            [call.args[0] for call in printed.call_args_list[:2]],
+        )
+        self.assertIsNotNone(self.assistant.time_to_first_token)
+
+    def test_openai_responses_are_streamed(self):
+        chunks = [
+            SimpleNamespace(
+                choices=[SimpleNamespace(delta=SimpleNamespace(content=text))]
+            )
+            for text in ["Plants ", None, "need light."]
+        ]
+        create = mock.Mock(return_value=iter(chunks))
+        self.assistant.client = SimpleNamespace(
+            chat=SimpleNamespace(completions=SimpleNamespace(create=create))
+        )
+
+        pieces = self.assistant.make_openai_request("system", "user", 0.4, stream=True)
+
+        self.assertEqual(["Plants ", "need light."], list(pieces))
+        self.assertTrue(create.call_args.kwargs["stream"])
+        with self.assertRaises(ValueError):
+            self.assistant.make_openai_request("system", "user", 0.4, dict, stream=True)
+
+    def test_repeated_create_reaches_the_model(self):
+        new_note = json.dumps(
+            {
+                "file_name": "ferns",
+                "links": "",
+                "tags": "",
+                "body": "ferns",
+                "similar_notes": [],
+            }
+        )
+        self.assistant.client = FakeOllamaClient(new_note, new_note)
+        self.assistant.similar_notes = {self.note_a: [self.note_b]}
+        self.assistant.save_new_note = mock.Mock()
+
+        with tempfile.TemporaryDirectory() as cache_directory:
+            self.assistant.response_cache = ResponseCache(cache_directory)
+            with mock.patch("builtins.print"):
+                self.assistant.create("ferns")
+                self.assistant.create("ferns")
+            self.assistant.response_cache.close()
+
+        # the same prompt creates a new note rather than reusing the cached one
+        self.assertEqual(2, len(self.assistant.client.requests))
+        self.assertEqual(2, self.assistant.save_new_note.call_count)
+
+
+class FakeAsyncOllamaClient:
+    # a stand in for ollama.AsyncClient that answers with a function of the user prompt, after a
+    # short wait, and records how many requests were in flight at once
+    def __init__(self, respond):
+        self.respond = respond
+        self.requests = []
+        self.in_flight = 0
+        self.max_in_flight = 0
+
+    async def chat(self, model, messages, options, format=None, stream=False):
+        self.requests.append(messages)
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            await asyncio.sleep(0.01)
+            response = self.respond(messages[1]["content"])
+        finally:
+            self.in_flight -= 1
+
+        if stream:
+
+            async def parts():
+                for piece in response:
+                    yield {"message": {"content": piece}}
+
+            return parts()
+        return {"message": {"content": response}}
+
+
+class TestAsyncSmartAssistant(unittest.TestCase):
+    def setUp(self):
+        self.assistant = AsyncSmartAssistant("testNoteDirectory/")
+        self.note_a, self.note_b = use_fake_embeddings(self.assistant)
+        self.assistant.similar_notes = {self.note_a: [self.note_b]}
+        self.created = []
+
+    def tearDown(self):
+        for file_name in self.created:
+            if os.path.exists(file_name):
+                os.remove(file_name)
+
+    @staticmethod
+    def new_note(user_prompt):
+        topic = user_prompt.split(" ")[0]
+        if topic == "broken":
+            raise ConnectionError("the model is unavailable")
+        return json.dumps(
+            {
+                "file_name": topic,
+                "links": "",
+                "tags": "",
+                "body": topic,
+                "similar_notes": [],
+            }
+        )
+
+    def test_create_many_limits_concurrency(self):
+        self.assistant.client = FakeAsyncOllamaClient(self.new_note)
+        prompts = ["alpha", "beta", "broken", "gamma", "delta"]
+
+        with mock.patch("builtins.print"):
+            results = asyncio.run(
+                self.assistant.create_many(prompts, max_concurrency=2)
+            )
+        self.created = [result for result in results if isinstance(result, str)]
+
+        self.assertEqual(2, self.assistant.client.max_in_flight)
+        # a failed note doesn't stop the others, and the results follow the prompts
+        self.assertIsInstance(results[2], ConnectionError)
+        self.assertEqual(
+            [
+                f"testNoteDirectory/{name}.md"
+                for name in ["alpha", "beta", "gamma", "delta"]
+            ],
+            self.created,
+        )
+        for file_name in self.created:
+            self.assertTrue(os.path.exists(file_name))
+
+    def test_create_many_doesnt_reuse_cached_notes(self):
+        self.assistant.client = FakeAsyncOllamaClient(self.new_note)
+
+        with tempfile.TemporaryDirectory() as cache_directory:
+            self.assistant.response_cache = ResponseCache(cache_directory)
+            # one at a time, so the second note would be found in the cache if it was stored
+            with mock.patch("builtins.print"):
+                results = asyncio.run(
+                    self.assistant.create_many(["ferns", "ferns"], max_concurrency=1)
+                )
+            self.assistant.response_cache.close()
+        self.created = results
+
+        self.assertEqual(2, len(self.assistant.client.requests))
+
+    def test_response_cache_is_used_off_the_event_loop(self):
+        self.assistant.client = FakeAsyncOllamaClient(lambda user_prompt: "answer")
+        self.assistant.stream = False
+        threads = []
+
+        def record_thread(function):
+            def wrapper(*args):
+                threads.append(threading.get_ident())
+                return function(*args)
+
+            return wrapper
+
+        with tempfile.TemporaryDirectory() as cache_directory:
+            cache = ResponseCache(cache_directory)
+            self.assistant.response_cache = cache
+            cache.get = record_thread(cache.get)
+            cache.put = record_thread(cache.put)
+            with mock.patch("builtins.print"):
+                asyncio.run(self.assistant.ask_yourself("plants"))
+                asyncio.run(self.assistant.ask_yourself("plants"))
+            cache.close()
+
+        # the second question is answered from the cache
+        self.assertEqual(1, len(self.assistant.client.requests))
+        self.assertEqual(3, len(threads))
+        self.assertNotIn(threading.get_ident(), threads)
+
+    def test_suggestions_are_requested_at_once(self):
+        suggestion = json.dumps({"suggestion": "ferns", "reasoning": "they like shade"})
+        self.assistant.client = FakeAsyncOllamaClient(lambda user_prompt: suggestion)
+        self.assistant.file_handler.get_current_note = lambda: self.note_a
+
+        with mock.patch("builtins.print"):
+            suggestions = asyncio.run(self.assistant.suggest_topics(3))
+
+        self.assertEqual(
+            ["ferns"] * 3, [response.suggestion for response in suggestions]
+        )
+        self.assertEqual(3, self.assistant.client.max_in_flight)
+
+    def test_responses_are_streamed(self):
+        self.assistant.client = FakeAsyncOllamaClient(
+            lambda user_prompt: ["Plants ", "", "need light."]
+        )
+        self.assistant.stream = True
+
+        with mock.patch("builtins.print") as printed:
+            response = asyncio.run(self.assistant.ask_yourself("plants"))
+
+        self.assertEqual("Plants need light.", response)
+        self.assertEqual(
+            ["Plants ", "need light."],
+            [call.args[0] for call in printed.call_args_list[-3:-1]],
+        )
+        self.assertIsNotNone(self.assistant.time_to_first_token)
+
+
+class TestResponseCache(unittest.TestCase):
+    def setUp(self):
+        self.temp_directory = tempfile.TemporaryDirectory()
+        self.cache = ResponseCache(
+            self.temp_directory.name, ttl_seconds=60, max_bytes=10
+        )
+
+        os.makedirs(f"{self.temp_directory.name}/.obsidian", exist_ok=True)
+        with open(
+            f"{self.temp_directory.name}/.obsidian/similar_notes.json", "w"
+        ) as file:
+            file.write("{}")
+        self.assistant = SmartAssistant(self.temp_directory.name + "/")
+        self.assistant.ai_provider = "ollama"
+        self.assistant.response_cache.close()
+        self.assistant.response_cache = self.cache
+
+    def tearDown(self):
+        self.cache.close()
+        self.temp_directory.cleanup()
+
+    def test_responses_expire(self):
+        key = ResponseCache.make_key("ollama", "llama3", 0.1, None, "system", "user")
+        self.cache.put(key, "answer")
+        self.assertEqual("answer", self.cache.get(key))
+
+        with mock.patch("src.response_cache.time", return_value=time.time() + 120):
+            self.assertIsNone(self.cache.get(key))
+        self.assertEqual(0, self.cache.stats()["responses"])
+
+    def test_database_is_created_on_first_use(self):
+        cache = ResponseCache(self.temp_directory.name + "/unused")
+        self.assertFalse(cache.database_path.parent.exists())
+
+        self.assertIsNone(cache.get("key"))
+        self.assertTrue(cache.database_path.exists())
+        cache.close()
+
+    def test_least_recently_used_responses_are_evicted(self):
+        self.cache.put("a", "1234")
+        self.cache.put("b", "1234")
+        self.cache.get("a")
+        self.cache.put("c", "1234")
+
+        self.assertEqual("1234", self.cache.get("a"))
+        self.assertIsNone(self.cache.get("b"))
+        self.assertEqual(
+            {
+                "responses": 2,
+                "bytes": 8,
+                "hits": 2,
+                "misses": 1,
+                "bypassed": 0,
+                "evictions": 1,
+            },
+            self.cache.stats(),
+        )
+
+    def test_identical_requests_are_answered_from_the_cache(self):
+        from pydantic import BaseModel
+
+        class FileName(BaseModel):
+            file_name: str
+
+        self.cache.max_bytes = 1 << 20
+        self.assistant.client = FakeOllamaClient("an answer", '{"file_name": "note"}')
+
+        for _ in range(2):
+            self.assertEqual("an answer", self.assistant.make_ai_request("s", "u", 0.4))
+            self.assertEqual(
+                "note",
+                self.assistant.make_ai_request("s", "u", 0.1, FileName).file_name,
+            )
+        self.assertEqual(2, len(self.assistant.client.requests))
+        self.assertEqual(2, self.cache.hits)
+
+        # a streamed request is answered with the cached text
+        self.assertEqual(
+            ["an answer"],
+            list(self.assistant.make_ai_request("s", "u", 0.4, stream=True)),
+        )
+
+    def test_high_temperatures_skip_the_cache(self):
+        self.cache.max_bytes = 1 << 20
+        self.assistant.client = FakeOllamaClient("first", "second", "third", "fourth")
+
+        self.assertEqual("first", self.assistant.make_ai_request("s", "u", 0.9))
+        self.assertEqual("second", self.assistant.make_ai_request("s", "u", 0.9))
+        self.assertEqual(2, self.cache.bypassed)
+
+        # unless the cache is forced
+        self.assertEqual(
+            "third", self.assistant.make_ai_request("s", "u", 0.9, use_cache=True)
+        )
+        self.assertEqual(
+            "third", self.assistant.make_ai_request("s", "u", 0.9, use_cache=True)
+        )
+
+
+class TestStartup(unittest.TestCase):
+    def test_imports_skip_heavy_modules(self):
+        # importing the entry points must not pull in the model or AI client libraries
+        script = (
+            "import json, sys, time\n"
+            "start = time.perf_counter()\n"
+            "import src.lightning_links_creator, src.smart_assistant, src.async_smart_assistant\n"
+            "heavy = ['torch', 'sentence_transformers', 'openai', 'ollama', 'pydantic']\n"
+            "print(json.dumps({'seconds': time.perf_counter() - start,"
+            " 'loaded': [name for name in heavy if name in sys.modules]}))\n"
+        )
+        root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        output = subprocess.run(
+            [sys.executable, "-c", script],
+            cwd=root,
+            env={**os.environ, "PYTHONPATH": root},
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout
+
+        result = json.loads(output.splitlines()[-1])
+        self.assertEqual([], result["loaded"])
+        self.assertLess(result["seconds"], 2.0)
+
+    def test_model_is_loaded_on_first_use(self):
+        creator = LightningLinksCreator("testNoteDirectory/")
+        self.assertIsNone(creator._model)
+
+        # closing without having encoded anything doesn't load the model
+        creator.close()
+        self.assertIsNone(creator._model)
+
+        model = FakeSentenceModel()
+        creator.model = model
+        self.assertIs(model, creator.encoder.model)
+
+
 if __name__ == "__main__":
     unittest.main()